@@ -1 +1 @@
-__version__ = '0.8.0'
+__version__ = '0.8.1'
@@ -60,3 +60,9 @@ ALTER TABLE Plans ADD COLUMN IF NOT EXISTS ptv_surface_area real;
 ALTER TABLE Plans ADD COLUMN IF NOT EXISTS ptv_volume real;
 ALTER TABLE Plans ADD COLUMN IF NOT EXISTS ptv_max_dose real;
 ALTER TABLE Plans ADD COLUMN IF NOT EXISTS ptv_min_dose real;
+-- The following columns have been added as of DVH Analytics 0.8.1
+ALTER TABLE DVHs ADD COLUMN IF NOT EXISTS dvh_string_5 text;
+ALTER TABLE DVHs ADD COLUMN IF NOT EXISTS dvh_string_10 text;
+ALTER TABLE DVHs ADD COLUMN IF NOT EXISTS dvh_string_25 text;
+-- The following tables have been added as of DVH Analytics 0.8.1
+CREATE TABLE IF NOT EXISTS TVs (mrn text, study_instance_uid text, ptv_checksum varchar(32), roi_coord_string text, centroid varchar(35), surface_points text, import_time_stamp timestamp);
@@ -15,15 +15,22 @@ from dateutil.relativedelta import relativedelta  # python-dateutil
 from dateutil.parser import parse as date_parser
 import numpy as np
 from os.path import basename, join
-from pubsub import pub
 import pydicom
 from dvha.options import Options
 from dvha.tools.roi_name_manager import clean_name, DatabaseROIs
 from dvha.tools.utilities import change_angle_origin, calc_stats, is_date, validate_transfer_syntax_uid
-from dvha.tools.roi_formatter import dicompyler_roi_coord_to_db_string, get_planes_from_string
+from dvha.tools.roi_formatter import dicompyler_roi_coord_to_db_string, get_planes_from_string, \
+    get_slice_geometry
 from dvha.tools import roi_geometry as roi_calc
-from dvha.tools.mlc_analyzer import Beam as mlca
+from dvha.tools.progress import ProgressReporter
+from dvha.tools.mlc_analyzer import Beam as mlca, get_mlc_summary, get_plan_aperture_data
 from dvha.db.sql_connector import DVH_SQL
+from dvha.db.sql_columns import dvh_pyramid
+from dvha.db.update import calc_surface_area
+
+
+# Only these tags of RT Structure files are needed prior to DVH calculation, contour data is not read
+STRUCTURE_HEADER_TAGS = ['StructureSetROISequence', 'RTROIObservationsSequence']
 
 
 class DICOM_Parser:
@@ -31,7 +38,8 @@ class DICOM_Parser:
     Parse a set of DICOM files for database
     """
     def __init__(self, plan_file=None, structure_file=None, dose_file=None, dose_sum_file=None, plan_over_rides=None,
-                 global_plan_over_rides=None, roi_over_ride=None, roi_map=None, use_dicom_dvh=False, plan_ptvs=None):
+                 global_plan_over_rides=None, roi_over_ride=None, roi_map=None, use_dicom_dvh=False, plan_ptvs=None,
+                 progress=None, contours_needed=False):
         """
         :param plan_file: absolute path of DICOM RT Plan file
         :type plan_file: str
@@ -53,48 +61,48 @@ class DICOM_Parser:
         :type use_dicom_dvh: bool
         :param plan_ptvs: assign specifc PTVs for distance calculations
         :type plan_ptvs: list
+        :param progress: reporter for DVH calculation progress, a new one is created if not provided
+        :type progress: ProgressReporter
+        :param contours_needed: the full RT Structure will be read (e.g., for DVH calculation), so use it rather than
+        reading the structure header separately
+        :type contours_needed: bool
         """
 
         self.database_rois = DatabaseROIs() if roi_map is None else roi_map
-        self.import_path = Options().IMPORTED_DIR
+        self.options = Options()  # read once, rather than for each roi
+        self.import_path = self.options.IMPORTED_DIR
 
         self.plan_file = plan_file
         self.structure_file = structure_file
         self.dose_file = dose_file
         self.dose_sum_file = dose_sum_file
+        self.contours_needed = contours_needed
 
         self.use_dicom_dvh = use_dicom_dvh
+        self.progress = progress if progress is not None else ProgressReporter()
 
         # store these values when clearing file loaded data
         self.stored_values = {}
 
-        self.rt_data = {key: None for key in ['plan', 'structure', 'dose']}
-        self.dicompyler_data = {key: None for key in ['plan', 'structure', 'dose']}
-        self.dicompyler_rt_plan = None
+        # DICOM files are only read when first needed, e.g., pre_import_data does not read contours or dose
+        self.rt_data = DeferredDatasets({'plan': self.read_plan,
+                                         'structure': self.read_structure,
+                                         'structure_header': self.read_structure_header,
+                                         'dose': self.read_dose})
+        self.dicompyler_data = DeferredDatasets({'plan': lambda: self.get_dicompyler_parser('plan'),
+                                                 'structure': lambda: self.get_dicompyler_parser('structure')})
+        self.dicompyler_rt_plan = self.dicompyler_data['plan'].GetPlan() if self.plan_file else None
         self.structure_name_and_type = None
-        if self.plan_file:
-            self.dicompyler_data['plan'] = dicompylerParser(self.plan_file)
-            self.rt_data['plan'] = self.dicompyler_data['plan'].ds
-            self.dicompyler_rt_plan = self.dicompyler_data['plan'].GetPlan()
         if self.structure_file:
-            self.dicompyler_data['structure'] = dicompylerParser(self.structure_file)
-            self.rt_data['structure'] = self.dicompyler_data['structure'].ds
-            self.structure_name_and_type = self.get_structure_name_and_type(self.rt_data['structure'])
-        if self.dose_file:
-            if self.dose_sum_file is None:
-                # self.rt_data['dose'] = dicompylerParser(self.dose_file).ds
-                # The above line may lead to OSError: Deferred read -- original filename not stored. Cannot re-open
-                # switching back to pydicom.read_file()
-                self.rt_data['dose'] = pydicom.read_file(self.dose_file, force=True)
-            else:
-                self.rt_data['dose'] = pydicom.read_file(self.dose_sum_file, force=True)
+            self.structure_name_and_type = self.get_structure_name_and_type(self.rt_data['structure_header'])
 
         # These properties are not inherently stored in Pinnacle DICOM files, but can be extracted from dummy ROI
         # names automatically generated by the Pinnacle Script provided by DVH Analytics
         self.poi_rx_data = self.get_rx_data_from_dummy_rois()
         self.poi_tx_site = self.get_tx_site_from_dummy_rois()
 
-        self.__initialize_rx_beam_and_ref_beam_data()
+        self.__initialize_rx_data()
+        self._beam_data = None
 
         # over ride objects
         keys = ['mrn', 'study_instance_uid', 'birth_date', 'sim_study_date', 'physician', 'tx_site', 'rx_dose']
@@ -113,24 +121,68 @@ class DICOM_Parser:
                 'rx_dose', 'ptv_names', 'physician', 'ptv_exists', 'tx_site', 'patient_orientation']
         self.stored_values = {key: getattr(self, key) for key in keys}
 
-    def __initialize_rx_beam_and_ref_beam_data(self):
-        beam_num = 0
+    def read_plan(self):
+        if self.plan_file:
+            return pydicom.read_file(self.plan_file, force=True)
+
+    def read_structure(self):
+        if self.structure_file:
+            return dicompylerParser(self.structure_file).ds
+
+    def read_structure_header(self):
+        if self.structure_file:
+            if self.contours_needed:
+                return self.rt_data['structure']
+            return pydicom.read_file(self.structure_file, force=True, specific_tags=STRUCTURE_HEADER_TAGS)
+
+    def read_dose(self):
+        if self.dose_file:
+            # dicompylerParser(self.dose_file).ds may lead to
+            # OSError: Deferred read -- original filename not stored. Cannot re-open
+            # so use pydicom.read_file()
+            return pydicom.read_file(self.dose_file if self.dose_sum_file is None else self.dose_sum_file, force=True)
+
+    def get_dicompyler_parser(self, rt_type):
+        if self.rt_data[rt_type] is not None:
+            return dicompylerParser(self.rt_data[rt_type])
+
+    def __initialize_rx_data(self):
         self.rx_data = []
-        self.beam_data = {}
-        self.ref_beam_data = []
-        for fx_grp_index, fx_grp_seq in enumerate(self.rt_data['plan'].FractionGroupSequence):
-            self.rx_data.append(RxParser(self.rt_data['plan'], self.dicompyler_rt_plan, self.rt_data['structure'],
-                                         fx_grp_index, self.poi_rx_data, self.study_instance_uid_to_be_imported))
-            self.beam_data[fx_grp_index] = []
-            for fx_grp_beam in range(int(fx_grp_seq.NumberOfBeams)):
-                beam_number = self.beam_sequence[beam_num].BeamNumber
-                beam_seq = self.beam_sequence[beam_num]
-                cp_seq = self.get_cp_sequence(self.beam_sequence[beam_num])
-                ref_beam_seq_index = self.get_referenced_beam_sequence_index(fx_grp_seq, beam_number)
-                ref_beam_seq = fx_grp_seq.ReferencedBeamSequence[ref_beam_seq_index]
-                self.beam_data[fx_grp_index].append(BeamParser(beam_seq, ref_beam_seq, cp_seq))
-
-                beam_num += 1
+        for fx_grp_index in range(len(self.rt_data['plan'].FractionGroupSequence)):
+            self.rx_data.append(RxParser(self.rt_data['plan'], self.dicompyler_rt_plan,
+                                         self.rt_data['structure_header'], fx_grp_index, self.poi_rx_data,
+                                         self.study_instance_uid_to_be_imported))
+
+    @property
+    def beam_data(self):
+        """
+        BeamParser objects for each fraction group, parsed when first needed since the pre-import does not need them
+        :rtype: dict
+        """
+        if self._beam_data is None:
+            # analyze the apertures once per plan, cached to disk for later recalculations of beam complexity
+            try:
+                plan_aperture_data = get_plan_aperture_data(self.plan_file, rt_plan=self.rt_data['plan'])
+            except Exception as e:
+                print('WARNING: Could not get aperture data of %s because ' % self.plan_file, str(e))
+                plan_aperture_data = {}
+
+            beam_num = 0
+            self._beam_data = {}
+            for fx_grp_index, fx_grp_seq in enumerate(self.rt_data['plan'].FractionGroupSequence):
+                self._beam_data[fx_grp_index] = []
+                for fx_grp_beam in range(int(fx_grp_seq.NumberOfBeams)):
+                    beam_number = self.beam_sequence[beam_num].BeamNumber
+                    beam_seq = self.beam_sequence[beam_num]
+                    cp_seq = self.get_cp_sequence(self.beam_sequence[beam_num])
+                    ref_beam_seq_index = self.get_referenced_beam_sequence_index(fx_grp_seq, beam_number)
+                    ref_beam_seq = fx_grp_seq.ReferencedBeamSequence[ref_beam_seq_index]
+                    aperture_data = plan_aperture_data.get(int(beam_number))
+                    self._beam_data[fx_grp_index].append(BeamParser(beam_seq, ref_beam_seq, cp_seq, aperture_data))
+
+                    beam_num += 1
+
+        return self._beam_data
 
     @staticmethod
     def get_referenced_beam_sequence_index(fx_grp_seq, beam_number):
@@ -162,7 +214,7 @@ class DICOM_Parser:
         """
 
         if self.structure_file:
-            struct_seq = self.rt_data['structure'].StructureSetROISequence
+            struct_seq = self.rt_data['structure_header'].StructureSetROISequence
             rx_indices = [i for i, roi in enumerate(struct_seq) if roi.ROIName.lower().startswith('rx ')]
 
             rx_data = {}
@@ -208,7 +260,7 @@ class DICOM_Parser:
         """
 
         if self.structure_file:
-            struct_seq = self.rt_data['structure'].StructureSetROISequence
+            struct_seq = self.rt_data['structure_header'].StructureSetROISequence
             tx_indices = [i for i, roi in enumerate(struct_seq) if roi.ROIName.lower().startswith('tx: ')]
 
             if tx_indices:
@@ -433,34 +485,40 @@ class DICOM_Parser:
         if dvh and dvh.volume > 0:  # ignore points and empty ROIs
             geometries = self.get_dvh_geometries(dvh_index)
 
-            return {'mrn': [self.mrn, 'text'],
-                    'study_instance_uid': [self.study_instance_uid_to_be_imported, 'text'],
-                    'institutional_roi': [self.get_institutional_roi(dvh_index), 'varchar(50)'],
-                    'physician_roi': [self.get_physician_roi(dvh_index), 'varchar(50)'],
-                    'roi_name': [self.get_roi_name(dvh_index), 'varchar(50)'],
-                    'roi_type': [self.get_roi_type(dvh_index), 'varchar(20)'],
-                    'volume': [dvh.volume, 'real'],
-                    'min_dose': [dvh.min, 'real'],
-                    'mean_dose': [dvh.mean, 'real'],
-                    'max_dose': [dvh.max, 'real'],
-                    'dvh_string': [','.join(['%.2f' % num for num in dvh.counts]), 'text'],
-                    'roi_coord_string': [geometries['roi_coord_str'], 'text'],
-                    'dist_to_ptv_min': [None, 'real'],
-                    'dist_to_ptv_mean': [None, 'real'],
-                    'dist_to_ptv_median': [None, 'real'],
-                    'dist_to_ptv_max': [None, 'real'],
-                    'surface_area': [geometries['surface_area'], 'real'],
-                    'ptv_overlap': [None, 'real'],
-                    'import_time_stamp': [None, 'timestamp'],
-                    'centroid': [geometries['centroid'], 'varchar(35)'],
-                    'dist_to_ptv_centroids': [None, 'real'],
-                    'dth_string': [None, 'text'],
-                    'spread_x': [geometries['spread'][0], 'real'],
-                    'spread_y': [geometries['spread'][1], 'real'],
-                    'spread_z': [geometries['spread'][2], 'real'],
-                    'cross_section_max': [geometries['cross_sections']['max'], 'real'],
-                    'cross_section_median': [geometries['cross_sections']['median'], 'real'],
-                    'toxicity_grade': [None, 'smallint']}
+            row = {'mrn': [self.mrn, 'text'],
+                   'study_instance_uid': [self.study_instance_uid_to_be_imported, 'text'],
+                   'institutional_roi': [self.get_institutional_roi(dvh_index), 'varchar(50)'],
+                   'physician_roi': [self.get_physician_roi(dvh_index), 'varchar(50)'],
+                   'roi_name': [self.get_roi_name(dvh_index), 'varchar(50)'],
+                   'roi_type': [self.get_roi_type(dvh_index), 'varchar(20)'],
+                   'volume': [dvh.volume, 'real'],
+                   'min_dose': [dvh.min, 'real'],
+                   'mean_dose': [dvh.mean, 'real'],
+                   'max_dose': [dvh.max, 'real'],
+                   'dvh_string': [','.join(['%.2f' % num for num in dvh.counts]), 'text'],
+                   'roi_coord_string': [geometries['roi_coord_str'], 'text'],
+                   'dist_to_ptv_min': [None, 'real'],
+                   'dist_to_ptv_mean': [None, 'real'],
+                   'dist_to_ptv_median': [None, 'real'],
+                   'dist_to_ptv_max': [None, 'real'],
+                   'surface_area': [geometries['surface_area'], 'real'],
+                   'ptv_overlap': [None, 'real'],
+                   'import_time_stamp': [None, 'timestamp'],
+                   'centroid': [geometries['centroid'], 'varchar(35)'],
+                   'dist_to_ptv_centroids': [None, 'real'],
+                   'dth_string': [None, 'text'],
+                   'spread_x': [geometries['spread'][0], 'real'],
+                   'spread_y': [geometries['spread'][1], 'real'],
+                   'spread_z': [geometries['spread'][2], 'real'],
+                   'cross_section_max': [geometries['cross_sections']['max'], 'real'],
+                   'cross_section_median': [geometries['cross_sections']['median'], 'real'],
+                   'toxicity_grade': [None, 'smallint']}
+
+            # Store down-sampled DVHs, DVH.__init__ will select the coarsest column compatible with dvh_bin_width
+            for bin_width, column in dvh_pyramid.items():
+                row[column] = [','.join(['%.2f' % num for num in dvh.counts[::bin_width]]), 'text']
+
+            return row
 
     def get_dicom_file_row(self):
         """
@@ -519,7 +577,8 @@ class DICOM_Parser:
 
     @property
     def missing_files(self):
-        return [key.capitalize() for key, value in self.rt_data.items() if value is None]
+        file_set = {'plan': self.plan_file, 'structure': self.structure_file, 'dose': self.dose_file}
+        return [key.capitalize() for key, value in file_set.items() if value is None]
 
     # ------------------------------------------------------------------------------
     # Plan table data
@@ -885,17 +944,19 @@ class DICOM_Parser:
 
         structure_coord = self.dicompyler_data['structure'].GetStructureCoordinates(key)
 
+        roi_coord_str = dicompyler_roi_coord_to_db_string(structure_coord)
+        planes = get_planes_from_string(roi_coord_str)
+        slice_geometry = get_slice_geometry(planes)  # slice polygons are built once and shared by each calculation
+
         try:
-            surface_area = roi_calc.surface_area(structure_coord)
+            surface_area = calc_surface_area(slice_geometry, self.options, roi_coord_string=roi_coord_str)
         except Exception:
             print("Surface area calculation failed for key, name: %s, %s" % (key, self.get_roi_name(key)))
             surface_area = None
 
-        roi_coord_str = dicompyler_roi_coord_to_db_string(structure_coord)
-        planes = get_planes_from_string(roi_coord_str)
-        centroid = roi_calc.centroid(planes)
-        spread = roi_calc.spread(planes)
-        cross_sections = roi_calc.cross_section(planes)
+        centroid = roi_calc.centroid(slice_geometry)
+        spread = roi_calc.spread(slice_geometry)
+        cross_sections = roi_calc.cross_section(slice_geometry)
 
         return {'roi_coord_str': roi_coord_str,
                 'surface_area': surface_area,
@@ -1003,8 +1064,7 @@ class DICOM_Parser:
 
         return structures
 
-    @staticmethod
-    def send_dvh_progress(current_plane, plane_count):
+    def send_dvh_progress(self, current_plane, plane_count):
         """
         Callback for dicompyler-core dvh calculation
         :param current_plane: the plane to be calculated
@@ -1013,22 +1073,44 @@ class DICOM_Parser:
         :type plane_count: int
         """
         progress = float(current_plane) / float(plane_count)
-        pub.sendMessage('update_dvh_progress', msg=progress)
+        self.progress.update('update_dvh_progress', msg=progress)
+
+
+class DeferredDatasets(dict):
+    """
+    Datasets (e.g., pydicom or dicompyler-core objects) keyed by rt type, each is read on first access
+    """
+    def __init__(self, readers):
+        """
+        :param readers: functions without parameters that return the dataset (or None) of each key
+        :type readers: dict
+        """
+        dict.__init__(self)
+        self.readers = readers
+
+    def __missing__(self, key):
+        if key not in self.readers:
+            raise KeyError(key)
+        self[key] = self.readers[key]()
+        return self[key]
 
 
 class BeamParser:
     """
     This class is used to parse beam data needed for importing a plan into the database
     """
-    def __init__(self, beam_data, ref_beam_data, cp_seq):
+    def __init__(self, beam_data, ref_beam_data, cp_seq, aperture_data=None):
         """
         :param beam_data:
         :param ref_beam_data:
         :param cp_seq:
+        :param aperture_data: optional Beam.aperture_data from mlc_analyzer, to avoid re-analyzing the control points
+        :type aperture_data: dict
         """
         self.beam_data = beam_data
         self.ref_beam_data = ref_beam_data
         self.cp_seq = cp_seq
+        self.aperture_data = aperture_data
 
     ################################################################################
     # General beam parser tools
@@ -1268,7 +1350,10 @@ class BeamParser:
     def mlc_stat_data(self):
         mlc_keys = ['area', 'x_perim', 'y_perim', 'perim', 'cmp_score', 'cp_mu']
         try:
-            mlc_summary_data = mlca(self.beam_data, self.beam_mu, ignore_zero_mu_cp=True).summary
+            if self.aperture_data is not None:
+                mlc_summary_data = get_mlc_summary(self.aperture_data, self.beam_mu, ignore_zero_mu_cp=True)
+            else:
+                mlc_summary_data = mlca(self.beam_data, self.beam_mu, ignore_zero_mu_cp=True).summary_data
             mlca_stat_data = {key: calc_stats(mlc_summary_data[key]) for key in mlc_keys}
             mlca_stat_data['complexity'] = np.sum(mlc_summary_data['cmp_score'])
         except Exception as e:
@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# db.recalculate.py
+"""
+Recalculate values not stored in DICOM files for the entire database (or rows meeting a condition)
+
+The work is planned per study. Each study's roi_coord_strings are queried once, the calculations are performed in a
+process pool, and the results are written back with a single transaction per study. The functions in db.update are
+still used for single rois (e.g., post-import calculations).
+"""
+# Copyright (c) 2016-2019 Dan Cutright
+# This file is part of DVH Analytics, released under a BSD license.
+#    See the file LICENSE included with this distribution, also
+#    available at https://github.com/cutright/DVH-Analytics
+
+from dateutil.parser import parse as date_parser
+from dateutil.relativedelta import relativedelta
+from multiprocessing import Pool, cpu_count
+import numpy as np
+from os.path import join as join_path
+from dvha.db.sql_columns import dvh_pyramid
+from dvha.db.sql_connector import DVH_SQL
+from dvha.db import update as db_update
+from dvha.options import Options
+from dvha.tools.errors import SQLError
+from dvha.tools import roi_geometry as roi_geom
+from dvha.tools import roi_mask
+from dvha.tools.roi_formatter import get_planes_from_string, get_slice_geometry
+
+
+# Calculation choices with the table and columns they update
+CALCULATIONS = {'PTV Distances': {'table': 'DVHs',
+                                  'columns': ['dist_to_ptv_min', 'dist_to_ptv_mean', 'dist_to_ptv_median',
+                                              'dist_to_ptv_max', 'dth_string']},
+                'PTV Overlap': {'table': 'DVHs', 'columns': ['ptv_overlap']},
+                'ROI Centroid': {'table': 'DVHs', 'columns': ['centroid']},
+                'ROI Spread': {'table': 'DVHs', 'columns': ['spread_x', 'spread_y', 'spread_z']},
+                'ROI Cross-Section': {'table': 'DVHs', 'columns': ['cross_section_max', 'cross_section_median']},
+                'OAR-PTV Centroid Distance': {'table': 'DVHs', 'columns': ['dist_to_ptv_centroids']},
+                'DVH Pyramids': {'table': 'DVHs', 'columns': [dvh_pyramid[key] for key in sorted(dvh_pyramid)]},
+                'Beam Complexities': {'table': 'Beams', 'columns': ['complexity']},
+                'Plan Complexities': {'table': 'Plans', 'columns': ['complexity']},
+                'Patient Ages': {'table': 'Plans', 'columns': ['age']}}
+
+# These calculations are relative to the union of the PTVs, so they are not applied to PTVs
+PTV_CALCULATIONS = {'PTV Distances', 'PTV Overlap', 'OAR-PTV Centroid Distance'}
+
+# A condition may refer to the columns of any of these tables, see get_table_condition
+CONDITION_TABLES = ['DVHs', 'Plans', 'Rxs', 'Beams']
+
+# Number of studies queried and sent to the process pool at once, limits the memory used by roi_coord_strings
+STUDY_CHUNK_SIZE = 4 * cpu_count()
+
+
+def recalculate(calculations, condition=None, only_missing=False, processes=None, callback=None):
+    """
+    :param calculations: keys of CALCULATIONS
+    :type calculations: list
+    :param condition: optional condition in SQL syntax, see get_table_condition
+    :type condition: str
+    :param only_missing: if True, only calculate values that are NULL in the database
+    :type only_missing: bool
+    :param processes: number of worker processes, defaults to the number of CPUs
+    :type processes: int
+    :param callback: optional function called after each study is written with parameters of the number of studies
+    completed, the total number of studies, and the study_instance_uid
+    """
+    options = Options()
+    with DVH_SQL() as cnx:
+        tasks = get_study_tasks(cnx, calculations, condition, only_missing)
+        for task in tasks:
+            task['geometry_engine'] = options.GEOMETRY_ENGINE
+            task['mask_resolution'] = options.ROI_MASK_RESOLUTION
+            task['complexity_weights'] = (options.COMPLEXITY_SCORE_X_WEIGHT, options.COMPLEXITY_SCORE_Y_WEIGHT)
+        study_total = len(tasks)
+
+        pool = Pool(processes=processes)
+        try:
+            study_counter = 0
+            for i in range(0, study_total, STUDY_CHUNK_SIZE):
+                chunk = [load_study_task(cnx, task) for task in tasks[i:i + STUDY_CHUNK_SIZE]]
+                for results in pool.imap_unordered(calculate_study, chunk):
+                    write_study_results(cnx, results)
+                    study_counter += 1
+                    if callback is not None:
+                        callback(study_counter, study_total, results['study_instance_uid'])
+        finally:
+            pool.close()
+            pool.join()
+
+
+def get_study_tasks(cnx, calculations, condition=None, only_missing=False):
+    """
+    Plan the work for each study, roi_coord_strings are not queried here (see load_study_task)
+    :param cnx: connection to DVHA SQL database
+    :type cnx: DVH_SQL
+    :param calculations: keys of CALCULATIONS
+    :type calculations: list
+    :param condition: optional condition in SQL syntax, see get_table_condition
+    :type condition: str
+    :param only_missing: if True, only calculate values that are NULL in the database
+    :type only_missing: bool
+    :return: a task for each study, with the calculations needed for each roi, beam, and plan
+    :rtype: list
+    """
+    tasks = {}
+
+    def get_task(uid):
+        if uid not in tasks:
+            tasks[uid] = {'study_instance_uid': uid, 'rois': {}, 'beams': [], 'plan': []}
+        return tasks[uid]
+
+    for table in ['DVHs', 'Beams', 'Plans']:
+        table_calcs = [calc for calc in calculations if CALCULATIONS[calc]['table'] == table]
+        if not table_calcs:
+            continue
+
+        columns = [column for calc in table_calcs for column in CALCULATIONS[calc]['columns']]
+        key_column = {'DVHs': 'roi_name, roi_type', 'Beams': 'beam_number', 'Plans': 'mrn'}[table]
+        rows = cnx.query(table, "study_instance_uid, %s, %s" % (key_column, ', '.join(columns)),
+                         get_table_condition(cnx, table, condition))
+
+        for row in rows:
+            uid = row[0]
+            values = dict(zip(columns, row[len(row) - len(columns):]))
+            needed = [calc for calc in table_calcs
+                      if not only_missing or any([values[c] is None for c in CALCULATIONS[calc]['columns']])]
+            if table == 'DVHs':
+                if str(row[2]).upper().startswith('PTV'):
+                    needed = [calc for calc in needed if calc not in PTV_CALCULATIONS]
+                if needed:
+                    get_task(uid)['rois'][row[1]] = needed
+            elif needed and table == 'Beams':
+                get_task(uid)['beams'].append(row[1])
+            elif needed:
+                get_task(uid)['plan'] = needed
+
+    return [tasks[uid] for uid in sorted(tasks)]
+
+
+def get_table_condition(cnx, table, condition):
+    """
+    Apply a condition to table. If the condition refers to columns of another table (e.g., roi_type for a Beams
+    calculation), it selects the studies with rows in that table meeting the condition
+    :param cnx: connection to DVHA SQL database
+    :type cnx: DVH_SQL
+    :param table: the table to be queried
+    :type table: str
+    :param condition: condition in SQL syntax
+    :type condition: str
+    :return: condition in SQL syntax for table
+    :rtype: str
+    """
+    if not condition or is_condition_valid(cnx, table, condition):
+        return condition
+    for condition_table in CONDITION_TABLES:
+        if condition_table != table and is_condition_valid(cnx, condition_table, condition):
+            return "study_instance_uid IN (SELECT study_instance_uid FROM %s WHERE %s)" % (condition_table, condition)
+    raise SQLError("The condition is not valid for any of the %s tables" % ', '.join(CONDITION_TABLES), condition)
+
+
+def is_condition_valid(cnx, table, condition):
+    """
+    :return: True if condition can be applied to table, no rows are returned by the test query
+    :rtype: bool
+    """
+    try:
+        cnx.query(table, 'study_instance_uid', "(%s) AND 1 = 0" % condition)
+    except SQLError:
+        cnx.cnx.rollback()  # a failed query aborts the current transaction in PostgreSQL
+        return False
+    return True
+
+
+def load_study_task(cnx, task):
+    """
+    Add the data needed by calculate_study to a task from get_study_tasks
+    :param cnx: connection to DVHA SQL database
+    :type cnx: DVH_SQL
+    :param task: a study task from get_study_tasks
+    :type task: dict
+    :return: task with roi_coord_strings, dvh_strings, treatment volume, plan file, and plan dates as needed
+    :rtype: dict
+    """
+    uid = task['study_instance_uid']
+    condition = "study_instance_uid = '%s'" % uid
+
+    if task['rois']:
+        rows = cnx.query('DVHs', 'roi_name, roi_type, centroid, roi_coord_string', condition)
+        task['roi_coord_strings'] = {row[0]: row[3] for row in rows if row[0] in task['rois']}
+        task['centroids'] = {row[0]: row[2] for row in rows if row[0] in task['rois']}
+
+        task['dvh_strings'] = {}
+        if any(['DVH Pyramids' in calcs for calcs in task['rois'].values()]):
+            task['dvh_strings'] = {row[0]: row[1] for row in cnx.query('DVHs', 'roi_name, dvh_string', condition)
+                                   if 'DVH Pyramids' in task['rois'].get(row[0], [])}
+
+        if any([PTV_CALCULATIONS.intersection(calcs) for calcs in task['rois'].values()]):
+            # The stored treatment volume is used if its PTVs have not changed, otherwise it is calculated in the pool
+            task['ptv_checksum'] = db_update.get_ptv_checksum(cnx, uid)
+            task['tv'] = db_update.load_treatment_volume_artifacts(cnx, uid, task['ptv_checksum'])
+            if task['tv'] is None:
+                task['ptv_coord_strings'] = [row[3] for row in rows
+                                             if str(row[1]).upper().startswith('PTV') and row[3]]
+
+    if task['beams']:
+        plan_file = cnx.query('DICOM_Files', 'folder_path, plan_file', condition)
+        task['plan_file'] = join_path(plan_file[0][0], plan_file[0][1]) if plan_file else None
+        task['beam_mu'] = {int(row[0]): row[1] for row in cnx.query('Beams', 'beam_number, beam_mu', condition)}
+
+    if 'Patient Ages' in task['plan']:
+        task['plan_dates'] = cnx.query('Plans', 'sim_study_date, birth_date', condition)[0]
+
+    return task
+
+
+def calculate_study(task):
+    """
+    Perform the calculations of a study task, called by the process pool so the database is not accessed here
+    :param task: a study task from load_study_task
+    :type task: dict
+    :return: the calculated values organized by table, and the treatment volume artifacts if calculated
+    :rtype: dict
+    """
+    uid = task['study_instance_uid']
+    results = {'study_instance_uid': uid, 'DVHs': {}, 'Beams': {}, 'Plans': {},
+               'tv': None, 'ptv_checksum': task.get('ptv_checksum'), 'plan_complexity': 'Plan Complexities' in task['plan']}
+
+    tv = task.get('tv')
+    if tv is None and task.get('ptv_coord_strings'):
+        tv = db_update.calc_treatment_volume_artifacts(task['ptv_coord_strings'])
+        results['tv'] = tv
+    tv_overlap = None
+    if tv is not None and any(['PTV Overlap' in calcs for calcs in task['rois'].values()]):
+        if task.get('geometry_engine') == 'mask':
+            tv_overlap = db_update.get_treatment_volume_mask(tv['tv'], resolution=task['mask_resolution'])
+        else:
+            tv_overlap = get_slice_geometry(tv['tv'])
+
+    for roi_name, calcs in task['rois'].items():
+        values = {}
+        if 'DVH Pyramids' in calcs and task['dvh_strings'].get(roi_name):
+            # Only needs the stored DVH, not the roi geometry
+            values.update(db_update.calc_dvh_pyramid_strings(task['dvh_strings'][roi_name]))
+            calcs = [calc for calc in calcs if calc != 'DVH Pyramids']
+
+        roi_coord_string = task['roi_coord_strings'].get(roi_name)
+        if tv is None and PTV_CALCULATIONS.intersection(calcs):
+            calcs = [calc for calc in calcs if calc not in PTV_CALCULATIONS]
+
+        if calcs and roi_coord_string:
+            try:
+                values.update(calc_roi_values(roi_coord_string, task['centroids'].get(roi_name), calcs,
+                                              tv, tv_overlap, uid, roi_name))
+            except Exception as e:
+                print('Error: ', e)
+                print('Recalculation failed for %s with study_instance_uid %s' % (roi_name, uid))
+
+        results['DVHs'][roi_name] = values
+
+    if task['beams'] and task['plan_file']:
+        try:
+            complexity = db_update.calc_beam_complexity(task['plan_file'], task['beam_mu'], uid,
+                                                        weights=task.get('complexity_weights'))
+            results['Beams'] = {beam_number: complexity[beam_number]
+                                for beam_number in task['beams'] if beam_number in complexity}
+        except Exception as e:
+            print('Error: ', e)
+            print('Beam complexity calculation failed for study_instance_uid %s' % uid)
+
+    if 'Patient Ages' in task['plan']:
+        age = calc_age(*task['plan_dates'])
+        if age is not None:
+            results['Plans']['age'] = age
+
+    return results
+
+
+def calc_roi_values(roi_coord_string, stored_centroid, calcs, tv, tv_overlap, study_instance_uid, roi_name):
+    """
+    :param roi_coord_string: roi_coord_string of the roi
+    :type roi_coord_string: str
+    :param stored_centroid: centroid of the roi in the DVHs table, used if 'ROI Centroid' is not in calcs
+    :type stored_centroid: str
+    :param calcs: keys of CALCULATIONS
+    :type calcs: list
+    :param tv: treatment volume artifacts as described in db.update.get_treatment_volume_artifacts
+    :type tv: dict
+    :param tv_overlap: the treatment volume as a SliceGeometry or ROIMask, based on GEOMETRY_ENGINE in Options
+    :param study_instance_uid: study_instance_uid of the roi, used for error messages
+    :type study_instance_uid: str
+    :param roi_name: name of the roi, used for error messages
+    :type roi_name: str
+    :return: values with DVHs table columns as keys
+    :rtype: dict
+    """
+    geometry = get_slice_geometry(get_planes_from_string(roi_coord_string))  # shared by each calculation
+    values = {}
+
+    centroid = None
+    if 'ROI Centroid' in calcs:
+        centroid = roi_geom.centroid(geometry)
+        values['centroid'] = ','.join([str(round(v, 3)) for v in centroid])
+    elif stored_centroid and stored_centroid != 'None':
+        centroid = [float(v) for v in stored_centroid.split(',')]
+
+    if 'ROI Spread' in calcs:
+        for column, value in zip(['spread_x', 'spread_y', 'spread_z'], roi_geom.spread(geometry)):
+            values[column] = round(value / 10., 3)
+
+    if 'ROI Cross-Section' in calcs:
+        area = roi_geom.cross_section(geometry)
+        values['cross_section_max'], values['cross_section_median'] = area['max'], area['median']
+
+    if 'PTV Overlap' in calcs:
+        if isinstance(tv_overlap, roi_mask.ROIMask):
+            overlap = tv_overlap.overlap_volume(tv_overlap.grid.get_mask(geometry))
+        else:
+            overlap = roi_geom.overlap_volume(geometry, tv_overlap)
+        values['ptv_overlap'] = round(float(overlap), 2)
+
+    if 'OAR-PTV Centroid Distance' in calcs and centroid is not None:
+        distance = float(np.linalg.norm(tv['centroid'] - np.array(centroid))) / 10.
+        values['dist_to_ptv_centroids'] = round(distance, 3)
+
+    if 'PTV Distances' in calcs:
+        data_map = db_update.calc_ptv_distances(list(geometry.points), tv['surface_points'],
+                                                study_instance_uid, roi_name)
+        if data_map:
+            values.update(data_map)
+
+    return values
+
+
+def calc_age(sim_study_date, birth_date):
+    """
+    :param sim_study_date: simulation date
+    :param birth_date: birth date
+    :return: age in years at simulation, None if either date is not valid
+    :rtype: int
+    """
+    try:
+        age = relativedelta(date_parser(str(sim_study_date)).date(), date_parser(str(birth_date)).date()).years
+        if age >= 0:
+            return age
+    except Exception:
+        pass
+
+
+def write_study_results(cnx, results):
+    """
+    Write the return of calculate_study to the database with a single transaction
+    :param cnx: connection to DVHA SQL database
+    :type cnx: DVH_SQL
+    :param results: return of calculate_study
+    :type results: dict
+    """
+    uid = results['study_instance_uid']
+    condition = "study_instance_uid = '%s'" % uid
+
+    updates = []
+    for roi_name, values in results['DVHs'].items():
+        if values:
+            updates.append(('DVHs', values, "%s and roi_name = '%s'" % (condition, roi_name)))
+    for beam_number, values in results['Beams'].items():
+        updates.append(('Beams', values, "%s and beam_number = '%s'" % (condition, beam_number)))
+    if results['Plans']:
+        updates.append(('Plans', results['Plans'], condition))
+
+    if updates:
+        cnx.update_multiple(updates)
+
+    if results['tv'] is not None:
+        db_update.store_treatment_volume_artifacts(cnx, uid, results['ptv_checksum'], results['tv'])
+
+    # Depends on the beam complexities, which may have just been updated
+    if results['plan_complexity']:
+        db_update.plan_complexity(cnx, uid)
@@ -127,3 +127,9 @@ numerical_detailed.update(numerical)
 all_columns = {}
 all_columns.update(categorical)
 all_columns.update(numerical_detailed)
+
+# DVHs are stored with 1 cGy bins in the dvh_string column of the DVHs table. Down-sampled copies are stored on import
+# so that queries with a coarser dvh_bin_width transfer and parse less data. Keys are bin widths in cGy.
+dvh_pyramid = {5: 'dvh_string_5',
+               10: 'dvh_string_10',
+               25: 'dvh_string_25'}
@@ -53,6 +53,7 @@ class DVH_SQL:
 
         self.cursor = self.cnx.cursor()
         self.tables = ['DVHs', 'Plans', 'Rxs', 'Beams', 'DICOM_Files']
+        self.cache_tables = ['TVs']  # derived data, recalculated by db.update if missing or outdated
 
     def __enter__(self):
         return self
@@ -160,6 +161,47 @@ class DVH_SQL:
         self.cursor.execute(query_str)
         return self.cursor.fetchall()
 
+    def load_uid_table(self, uids, column='study_instance_uid', table_name='temp_uids'):
+        """
+        Load study_instance_uids into a temporary table so that queries of a large cohort do not need to send a
+        "study_instance_uid in ('uid1', 'uid2', ...)" condition for every table and column. The temporary table only
+        exists for this connection, so the returned condition must be used with this DVH_SQL object. Calling this
+        again replaces the previously loaded uids.
+        :param uids: study_instance_uids to be loaded, duplicates are ignored
+        :type uids: list
+        :param column: the column name used in the returned condition (e.g., 'Plans.study_instance_uid' for a JOIN)
+        :type column: str
+        :param table_name: name of the temporary table
+        :type table_name: str
+        :return: condition in SQL syntax limiting a query to the loaded uids
+        :rtype: str
+        """
+        self.cursor.execute("CREATE TEMPORARY TABLE IF NOT EXISTS %s (study_instance_uid text PRIMARY KEY);" %
+                            table_name)
+        self.cursor.execute("DELETE FROM %s;" % table_name)
+
+        uids = sorted(set([str(uid) for uid in uids]))
+        if self.db_type == 'sqlite':
+            self.cursor.executemany("INSERT INTO %s VALUES (?);" % table_name, [(uid,) for uid in uids])
+        else:
+            # psycopg2 adapts a python list into a pgsql array, so all uids are sent as a single parameter
+            self.cursor.execute("INSERT INTO %s SELECT unnest(%%s::text[]);" % table_name, (uids,))
+        self.cnx.commit()
+
+        return self.get_uid_table_condition(column=column, table_name=table_name)
+
+    @staticmethod
+    def get_uid_table_condition(column='study_instance_uid', table_name='temp_uids'):
+        """
+        :param column: the column name to be compared to the temporary table
+        :type column: str
+        :param table_name: name of the temporary table created with load_uid_table
+        :type table_name: str
+        :return: condition in SQL syntax limiting a query to the uids loaded with load_uid_table
+        :rtype: str
+        """
+        return "%s IN (SELECT study_instance_uid FROM %s)" % (column, table_name)
+
     @property
     def now(self):
         """
@@ -191,6 +233,42 @@ class DVH_SQL:
         :type condition_str: str
         """
 
+        update = "Update %s SET %s = %s WHERE %s" % (table_name, column, self.format_value(value), condition_str)
+
+        try:
+            self.cursor.execute(update)
+            self.cnx.commit()
+        except Exception as e:
+            raise SQLError(str(e), update)
+
+    def update_multiple(self, updates):
+        """
+        Change the data in the database with a single transaction, useful for writing many calculated values
+        :param updates: each item is a tuple of table_name, a dictionary of values with SQL columns as keys,
+        and a condition in SQL syntax
+        :type updates: list
+        """
+        update = None
+        try:
+            for table_name, column_values, condition_str in updates:
+                set_str = ', '.join(["%s = %s" % (column, self.format_value(value))
+                                     for column, value in column_values.items()])
+                update = "Update %s SET %s WHERE %s" % (table_name, set_str, condition_str)
+                self.cursor.execute(update)
+            self.cnx.commit()
+        except Exception as e:
+            self.cnx.rollback()
+            raise SQLError(str(e), update)
+
+    def format_value(self, value):
+        """
+        :param value: value to be set with an UPDATE command
+        :return: value formatted for SQL syntax
+        :rtype: str
+        """
+        if value is None:
+            return "NULL"
+
         try:
             float(value)
             value_is_numeric = True
@@ -207,13 +285,7 @@ class DVH_SQL:
         else:
             value = "'%s'" % str(value)  # need quotes to input a string
 
-        update = "Update %s SET %s = %s WHERE %s" % (table_name, column, value, condition_str)
-
-        try:
-            self.cursor.execute(update)
-            self.cnx.commit()
-        except Exception as e:
-            raise SQLError(str(e), update)
+        return value
 
     def is_study_instance_uid_in_table(self, table_name, study_instance_uid):
         # As of DVH v0.7.5, study_instance_uid may end with _N where N is the nth plan of a file set
@@ -310,7 +382,7 @@ class DVH_SQL:
         :type ignore_tables: list
         """
 
-        tables = set(self.tables)
+        tables = set(self.tables + self.cache_tables)
         if ignore_tables:
             tables = tables - set(ignore_tables)
 
@@ -327,7 +399,7 @@ class DVH_SQL:
         :type new: str
         """
         condition = "mrn = '%s'" % old
-        for table in self.tables:
+        for table in self.tables + self.cache_tables:
             self.update(table, 'mrn', new, condition)
 
     def change_uid(self, old, new):
@@ -339,7 +411,7 @@ class DVH_SQL:
         :type new: str
         """
         condition = "study_instance_uid = '%s'" % old
-        for table in self.tables:
+        for table in self.tables + self.cache_tables:
             self.update(table, 'study_instance_uid', new, condition)
 
     def delete_dvh(self, roi_name, study_instance_uid):
@@ -371,7 +443,7 @@ class DVH_SQL:
 
     def drop_tables(self):
         """Delete all tables in the database if they exist"""
-        for table in self.tables:
+        for table in self.tables + self.cache_tables:
             self.cursor.execute("DROP TABLE IF EXISTS %s;" % table)
             self.cnx.commit()
 
@@ -388,6 +460,23 @@ class DVH_SQL:
         """Ensure that all of the latest SQL columns exist in the user's database"""
         create_tables_file = [CREATE_PGSQL_TABLES, CREATE_SQLITE_TABLES][self.db_type == 'sqlite']
         self.execute_file(create_tables_file)
+        if self.db_type == 'sqlite':
+            self.add_missing_sqlite_columns()
+
+    def add_missing_sqlite_columns(self):
+        """
+        SQLite does not support ADD COLUMN IF NOT EXISTS, so compare the columns defined in CREATE_SQLITE_TABLES
+        with the user's database and add any that are missing (e.g., database created with an older DVHA version)
+        """
+        for line in open(CREATE_SQLITE_TABLES):
+            if line.startswith('CREATE TABLE'):
+                table = line.split('(')[0].split()[-1]
+                column_defs = line[line.find('(') + 1:line.rfind(')')].split(', ')
+                current_columns = set(self.get_column_names(table))
+                for column_def in column_defs:
+                    if column_def.split()[0] not in current_columns:
+                        self.cursor.execute("ALTER TABLE %s ADD COLUMN %s;" % (table, column_def))
+        self.cnx.commit()
 
     def reinitialize_database(self):
         """Delete all data and create all tables with latest columns"""
@@ -544,15 +633,15 @@ class DVH_SQL:
     def get_roi_count_from_query(self, uid=None, dvh_condition=None):
         """
         Counts the DVH rows that match the provided conditions
-        :param uid: study instance uid
-        :type uid: str
+        :param uid: study instance uid, or a list of study instance uids
+        :type uid: str or list
         :param dvh_condition: condition in SQL syntax for the DVHs table
         :type dvh_condition: str
         :return: number of DVH rows
         :rtype: int
         """
         if uid:
-            condition = "study_instance_uid in ('%s')" % "', '".join(dvh_condition)
+            condition = self.load_uid_table([uid] if isinstance(uid, str) else uid)
             if dvh_condition:
                 condition = " and " + condition
         else:
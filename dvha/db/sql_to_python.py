@@ -22,7 +22,8 @@ class QuerySQL:
     you can access any column name 'some_column' with QuerySQL.some_column which will return a list of values
     for 'some_column'.  All properties contain lists with the order of their values synced, unless unique=True
     """
-    def __init__(self, table_name, condition_str, unique=False, columns=None):
+    def __init__(self, table_name, condition_str, unique=False, columns=None, ignored_columns=None, cnx=None,
+                 save_data=None):
         """
         :param table_name: 'Beams', 'DVHs', 'Plans', or 'Rxs'
         :type table_name: str
@@ -30,6 +31,14 @@ class QuerySQL:
         :type condition_str: str
         :param unique: If set to True, only unique values stored
         :type unique: bool
+        :param columns: optionally restrict the query to these columns
+        :type columns: list
+        :param ignored_columns: columns to be skipped in addition to roi_coord_string and distances_to_ptv
+        :type ignored_columns: list
+        :param cnx: optionally use an open connection (e.g., one with uids loaded by DVH_SQL.load_uid_table)
+        :type cnx: DVH_SQL
+        :param save_data: column data from get_save_data (e.g., from a saved session), used rather than querying SQL
+        :type save_data: dict
         """
 
         table_name = table_name.lower()
@@ -37,27 +46,61 @@ class QuerySQL:
         if table_name in {'beams', 'dvhs', 'plans', 'rxs'}:
             self.table_name = table_name
             self.condition_str = condition_str
-            with DVH_SQL() as cnx:
-
-                all_columns = cnx.get_column_names(table_name)
-                if columns is not None:
-                    columns = set(all_columns).intersection(columns)  # ensure provided columns exist in SQL table
-                else:
-                    columns = all_columns
-
-                for column in columns:
-                    if column not in {'roi_coord_string', 'distances_to_ptv'}:  # ignored for memory since not used here
-                        self.cursor = cnx.query(self.table_name,
-                                                column,
-                                                self.condition_str)
-                        force_date = cnx.is_sqlite_column_datetime(self.table_name, column)  # returns False for pgsql
-                        rtn_list = self.cursor_to_list(force_date=force_date)
-                        if unique:
-                            rtn_list = get_unique_list(rtn_list)
-                        setattr(self, column, rtn_list)  # create property of QuerySQL based on SQL column name
+            if save_data is not None:
+                self.load_save_data(save_data)
+            elif cnx is None:
+                with DVH_SQL() as cnx:
+                    self.__query_columns(cnx, unique, columns, ignored_columns)
+            else:
+                self.__query_columns(cnx, unique, columns, ignored_columns)
         else:
             print('Table name in valid. Please select from Beams, DVHs, Plans, or Rxs.')
 
+    def __query_columns(self, cnx, unique, columns, ignored_columns):
+        """
+        Query each column and store the results as a property of this object
+        :param cnx: an open connection to the SQL database
+        :type cnx: DVH_SQL
+        """
+        all_columns = cnx.get_column_names(self.table_name)
+        if columns is not None:
+            columns = set(all_columns).intersection(columns)  # ensure provided columns exist in SQL table
+        else:
+            columns = all_columns
+
+        ignored = {'roi_coord_string', 'distances_to_ptv'}  # ignored for memory since not used here
+        if ignored_columns is not None:
+            ignored = ignored.union(ignored_columns)
+
+        for column in columns:
+            if column not in ignored:
+                self.cursor = cnx.query(self.table_name,
+                                        column,
+                                        self.condition_str)
+                force_date = cnx.is_sqlite_column_datetime(self.table_name, column)  # returns False for pgsql
+                rtn_list = self.cursor_to_list(force_date=force_date)
+                if unique:
+                    rtn_list = get_unique_list(rtn_list)
+                setattr(self, column, rtn_list)  # create property of QuerySQL based on SQL column name
+
+    def get_save_data(self):
+        """
+        :return: the queried data as plain lists, keyed by SQL column
+        :rtype: dict
+        """
+        return {'condition_str': self.condition_str,
+                'columns': {key: value for key, value in self.__dict__.items()
+                            if key not in {'table_name', 'condition_str', 'cursor'}}}
+
+    def load_save_data(self, save_data):
+        """
+        :param save_data: the return of get_save_data
+        :type save_data: dict
+        """
+        self.condition_str = save_data['condition_str']
+        for column, values in save_data['columns'].items():
+            setattr(self, column, values)
+
     def cursor_to_list(self, force_date=False):
         """
         Convert a cursor return into a list of values
@@ -11,13 +11,16 @@ Functions to call appropriate calculations and update various columns in the SQL
 #    available at https://github.com/cutright/DVH-Analytics
 
 
+import hashlib
 import numpy as np
 from os.path import join as join_path
-import pydicom as dicom
 from dvha.db.sql_connector import DVH_SQL
+from dvha.db.sql_columns import dvh_pyramid
+from dvha.options import Options
 from dvha.tools import roi_geometry as roi_geom
 from dvha.tools import roi_formatter as roi_form
-from dvha.tools.mlc_analyzer import Beam as BeamAnalyzer
+from dvha.tools import roi_mask
+from dvha.tools.mlc_analyzer import get_mlc_summary, get_plan_aperture_data
 from dvha.tools.utilities import calc_stats, sample_roi
 
 
@@ -81,8 +84,7 @@ def dist_to_ptv_centroids(study_instance_uid, roi_name, pre_calc=None):
 
     ptv_centroid = pre_calc
     if ptv_centroid is None:
-        tv = get_total_treatment_volume_of_study(study_instance_uid)
-        ptv_centroid = get_treatment_volume_centroid(tv)
+        ptv_centroid = get_treatment_volume_artifacts(study_instance_uid)['centroid']
 
     data = float(np.linalg.norm(ptv_centroid - oar_centroid)) / 10.
 
@@ -100,16 +102,31 @@ def min_distances(study_instance_uid, roi_name, pre_calc=None):
 
     treatment_volume_coord = pre_calc
     if treatment_volume_coord is None:
-        with DVH_SQL() as cnx:
-            ptv_coordinates_strings = cnx.query('dvhs', 'roi_coord_string',
-                                                "study_instance_uid = '%s' and roi_type like 'PTV%%'"
-                                                % study_instance_uid)
-
-        ptvs = [roi_form.get_planes_from_string(ptv[0]) for ptv in ptv_coordinates_strings]
-        treatment_volume_coord = roi_form.get_roi_coordinates_from_planes(roi_geom.union(ptvs))
+        treatment_volume_coord = get_treatment_volume_artifacts(study_instance_uid)['surface_points']
 
     oar_coordinates = roi_form.get_roi_coordinates_from_string(oar_coordinates_string[0][0])
 
+    data_map = calc_ptv_distances(oar_coordinates, treatment_volume_coord, study_instance_uid, roi_name)
+
+    if data_map:
+        for key, value in data_map.items():
+            update_dvhs_table(study_instance_uid, roi_name, key, value)
+
+
+def calc_ptv_distances(oar_coordinates, treatment_volume_coord, study_instance_uid, roi_name):
+    """
+    Calculate the min, mean, median, and max PTV distances and DTH of an roi
+    :param oar_coordinates: points of the roi, return from get_roi_coordinates_from_string
+    :type oar_coordinates: list
+    :param treatment_volume_coord: points of the combined PTV, return from get_treatment_volume_coord
+    :type treatment_volume_coord: list
+    :param study_instance_uid: study_instance_uid of the roi, used for error messages
+    :type study_instance_uid: str
+    :param roi_name: name of the roi, used for error messages
+    :type roi_name: str
+    :return: values with DVHs table columns as keys, None if calculation failed
+    :rtype: dict
+    """
     treatment_volume_coord = sample_roi(treatment_volume_coord)
     oar_coordinates = sample_roi(oar_coordinates)
 
@@ -131,6 +148,7 @@ def min_distances(study_instance_uid, roi_name, pre_calc=None):
             print('Skipping PTV distance and DTH calculations for this ROI.')
             data = None
 
+    data_map = None
     if data is not None:
         try:
             dth = roi_geom.dth(data)
@@ -145,17 +163,14 @@ def min_distances(study_instance_uid, roi_name, pre_calc=None):
             print("Memory Error: ", e)
             print('Error reported for %s with study_instance_uid %s' % (roi_name, study_instance_uid))
             print('Skipping PTV distance and DTH calculations for this ROI.')
-            data_map = None
 
-        if data_map:
-            for key, value in data_map.items():
-                update_dvhs_table(study_instance_uid, roi_name, key, value)
+    return data_map
 
 
 def treatment_volume_overlap(study_instance_uid, roi_name, pre_calc=None):
     """
     Recalculate the PTV overlap of an roi based on data in the SQL DB.
-    Optional provide union of PTVs, return from get_total_treatment_volume_of_study
+    Optional provide union of PTVs, return from get_total_treatment_volume_of_study or get_treatment_volume_mask
     """
 
     oar_coordinates_string = query('dvhs', 'roi_coord_string',
@@ -164,9 +179,14 @@ def treatment_volume_overlap(study_instance_uid, roi_name, pre_calc=None):
 
     treatment_volume = pre_calc
     if treatment_volume is None:
-        treatment_volume = get_total_treatment_volume_of_study(study_instance_uid)
+        treatment_volume = get_treatment_volume_artifacts(study_instance_uid)['tv']
+        if Options().GEOMETRY_ENGINE == 'mask':
+            treatment_volume = get_treatment_volume_mask(treatment_volume)
 
-    overlap = roi_geom.overlap_volume(oar, treatment_volume)
+    if isinstance(treatment_volume, roi_mask.ROIMask):
+        overlap = treatment_volume.overlap_volume(treatment_volume.grid.get_mask(oar))
+    else:
+        overlap = roi_geom.overlap_volume(oar, treatment_volume)
     update_dvhs_table(study_instance_uid, roi_name, 'ptv_overlap', round(float(overlap), 2))
 
 
@@ -195,11 +215,28 @@ def surface_area(study_instance_uid, roi_name):
 
     roi = roi_form.get_planes_from_string(coordinates_string[0][0])
 
-    data = roi_geom.surface_area(roi, coord_type="sets_of_points")
+    data = calc_surface_area(roi, Options(), roi_coord_string=coordinates_string[0][0])
 
     update_dvhs_table(study_instance_uid, roi_name, 'surface_area', round(float(data), 2))
 
 
+def calc_surface_area(roi, options, roi_coord_string=None):
+    """
+    :param roi: a "sets of points" formatted dictionary or a SliceGeometry object
+    :param options: the SURFACE_AREA_ENGINE and SURFACE_AREA_RESOLUTION of these options are used
+    :type options: Options
+    :param roi_coord_string: roi_coord_string of roi, if provided mesh surface areas are cached
+    :type roi_coord_string: str
+    :return: surface area in cm^2
+    :rtype: float
+    """
+    if options.SURFACE_AREA_ENGINE == 'mesh':
+        if roi_coord_string is not None:
+            return roi_mask.cached_surface_area(roi_coord_string, roi, resolution=options.SURFACE_AREA_RESOLUTION)
+        return roi_mask.surface_area(roi, resolution=options.SURFACE_AREA_RESOLUTION)
+    return roi_geom.surface_area(roi, coord_type='sets_of_points')
+
+
 def update_dvhs_table(study_instance_uid, roi_name, column, value):
     """
     Generic function to update a value in the DVHs table
@@ -251,40 +288,89 @@ def plan_complexity(cnx, study_instance_uid):
         print('Zero plan MU detected for uid %s' % study_instance_uid)
 
 
-def beam_complexity(cnx, study_instance_uid):
+def beam_complexity(cnx, study_instance_uid, weights=None):
     """
     :param cnx: connection to DVHA SQL database
     :type cnx: DVH_SQL
     :param study_instance_uid: study_instance_uid in SQL database
     :type study_instance_uid: str
+    :param weights: x and y path weights of the complexity score, defaults to the values in Options
+    :type weights: tuple
     """
 
     rt_plan_query = cnx.query('DICOM_Files', 'folder_path, plan_file',
                               "study_instance_uid = '%s'" % study_instance_uid)[0]
     rt_plan_file_path = join_path(rt_plan_query[0], rt_plan_query[1])
 
-    rt_plan = dicom.read_file(rt_plan_file_path)
+    condition = "study_instance_uid = '%s'" % study_instance_uid
+    beam_mu = {int(row[0]): row[1] for row in cnx.query('Beams', 'beam_number, beam_mu', condition)}
 
-    for beam_num, beam in enumerate(rt_plan.BeamSequence):
-        try:
-            condition = "study_instance_uid = '%s' and beam_number = '%s'" % (study_instance_uid, (beam_num + 1))
-            meterset = float(cnx.query('Beams', 'beam_mu', condition)[0][0])
-            mlca_data = BeamAnalyzer(beam, meterset, ignore_zero_mu_cp=True)
-            mlc_keys = ['area', 'x_perim', 'y_perim', 'cmp_score', 'cp_mu']
-            summary_stats = {key: calc_stats(mlca_data.summary[key]) for key in mlc_keys}
+    complexity = calc_beam_complexity(rt_plan_file_path, beam_mu, study_instance_uid, weights=weights)
+    cnx.update_multiple([('Beams', values, "%s and beam_number = '%s'" % (condition, beam_number))
+                         for beam_number, values in complexity.items()])
 
-            column_vars = {'area': 'area', 'x_perim': 'x_perim', 'y_perim': 'y_perim', 'complexity': 'cmp_score',
-                           'cp_mu': 'cp_mu'}
-            stat_map = {'min': 5, 'mean': 3, 'median': 2, 'max': 0}
 
+def calc_beam_complexity(rt_plan_file_path, beam_mu, study_instance_uid, weights=None):
+    """
+    :param rt_plan_file_path: absolute file path of the DICOM RT Plan
+    :type rt_plan_file_path: str
+    :param beam_mu: beam_mu from the Beams table with beam_number as keys
+    :type beam_mu: dict
+    :param study_instance_uid: study_instance_uid of the plan, used for error messages
+    :type study_instance_uid: str
+    :param weights: x and y path weights of the complexity score, defaults to the values in Options
+    :type weights: tuple
+    :return: values with Beams table columns as keys, for each beam_number
+    :rtype: dict
+    """
+    aperture_data = get_plan_aperture_data(rt_plan_file_path)
+
+    column_vars = {'area': 'area', 'x_perim': 'x_perim', 'y_perim': 'y_perim', 'complexity': 'cmp_score',
+                   'cp_mu': 'cp_mu'}
+    stat_map = {'min': 5, 'mean': 3, 'median': 2, 'max': 0}
+
+    complexity = {}
+    for beam_number, beam_aperture_data in aperture_data.items():
+        try:
+            meterset = float(beam_mu[beam_number])
+            summary = get_mlc_summary(beam_aperture_data, meterset, ignore_zero_mu_cp=True, weights=weights)
+            summary_stats = {key: calc_stats(summary[key]) for key in set(column_vars.values())}
+
+            values = {}
             for c in list(column_vars):
                 for s in list(stat_map):
-                    value = summary_stats[column_vars[c]][stat_map[s]]
-                    column = "%s_%s" % (c, s)
-                    cnx.update('Beams', column, value, condition)
-            cnx.update('Beams', 'complexity', np.sum(mlca_data.summary['cmp_score']), condition)
+                    values["%s_%s" % (c, s)] = summary_stats[column_vars[c]][stat_map[s]]
+            values['complexity'] = np.sum(summary['cmp_score'])
+            complexity[beam_number] = values
         except Exception:
-            print('MLC Analyzer fail for beam number %s and uid %s' % ((beam_num+1), study_instance_uid))
+            print('MLC Analyzer fail for beam number %s and uid %s' % (beam_number, study_instance_uid))
+
+    return complexity
+
+
+def dvh_pyramid_strings(cnx, study_instance_uid):
+    """
+    Store the down-sampled DVH columns for DVHs imported prior to DVH Analytics 0.8.1
+    :param cnx: connection to DVHA SQL database
+    :type cnx: DVH_SQL
+    :param study_instance_uid: study_instance_uid in SQL database
+    :type study_instance_uid: str
+    """
+    condition = "study_instance_uid = '%s'" % study_instance_uid
+    for roi_name, dvh_string in cnx.query('DVHs', 'roi_name, dvh_string', condition):
+        for column, value in calc_dvh_pyramid_strings(dvh_string).items():
+            cnx.update('DVHs', column, value, "%s and roi_name = '%s'" % (condition, roi_name))
+
+
+def calc_dvh_pyramid_strings(dvh_string):
+    """
+    :param dvh_string: dvh_string of a DVHs table row
+    :type dvh_string: str
+    :return: down-sampled DVH strings with the dvh_pyramid columns as keys
+    :rtype: dict
+    """
+    dvh = dvh_string.split(',')
+    return {column: ','.join(dvh[::bin_width]) for bin_width, column in dvh_pyramid.items()}
 
 
 def update_all_generic(table, func, condition):
@@ -318,6 +404,10 @@ def beam_complexities(condition=None):
     update_all_generic('Beams', beam_complexity, condition)
 
 
+def dvh_pyramids(condition=None):
+    update_all_generic('DVHs', dvh_pyramid_strings, condition)
+
+
 def update_ptv_data(tv, study_instance_uid):
     """
     :param tv: treatment volume formatted as a "sets of points" object specified in tools.roi_geometry
@@ -325,6 +415,7 @@ def update_ptv_data(tv, study_instance_uid):
     :param study_instance_uid: study_instance_uid in SQL database
     :type study_instance_uid: str
     """
+    tv = roi_form.get_slice_geometry(tv)  # share slice polygons between each calculation
     ptv_cross_section = roi_geom.cross_section(tv)
     ptv_spread = roi_geom.spread(tv)
 
@@ -340,7 +431,7 @@ def update_ptv_data(tv, study_instance_uid):
                     'ptv_spread_x': ptv_spread[0],
                     'ptv_spread_y': ptv_spread[1],
                     'ptv_spread_z': ptv_spread[2],
-                    'ptv_surface_area': roi_geom.surface_area(tv, coord_type='sets_of_points'),
+                    'ptv_surface_area': calc_surface_area(tv, Options()),
                     'ptv_volume': roi_geom.volume(tv)}
 
         for key, value in ptv_data.items():
@@ -353,15 +444,137 @@ def get_total_treatment_volume_of_study(study_instance_uid, ptvs=None):
     """
 
     condition = "study_instance_uid = '%s' and roi_type like 'PTV%%'" % study_instance_uid
-    if ptvs:
-        condition += " and roi_name in ('%s')" % "','".join(ptvs)
-    ptv_coordinates_strings = query('dvhs', 'roi_coord_string', condition)
+    ptv_coordinates_strings = [row[1] for row in query('dvhs', 'roi_name, roi_coord_string', condition)
+                               if not ptvs or row[0] in ptvs]  # a study has few PTVs, so ptvs is applied here
 
-    ptvs = [roi_form.get_planes_from_string(ptv[0]) for ptv in ptv_coordinates_strings]
+    ptvs = [roi_form.get_planes_from_string(ptv) for ptv in ptv_coordinates_strings]
 
     return roi_geom.union(ptvs)
 
 
+def get_treatment_volume_artifacts(study_instance_uid):
+    """
+    Get the union of all PTVs of a study with its centroid and sampled surface points. These are stored in the TVs
+    table so that they are only recalculated if the PTVs of the study have changed (see get_ptv_checksum)
+    :param study_instance_uid: study_instance_uid in SQL database
+    :type study_instance_uid: str
+    :return: treatment volume as a "sets of points" object, its centroid, and a list of surface points, with keys of
+    'tv', 'centroid', and 'surface_points'
+    :rtype: dict
+    """
+    with DVH_SQL() as cnx:
+        checksum = get_ptv_checksum(cnx, study_instance_uid)
+        artifacts = load_treatment_volume_artifacts(cnx, study_instance_uid, checksum)
+        if artifacts is None:
+            ptv_coordinates_strings = cnx.query('dvhs', 'roi_coord_string',
+                                                "study_instance_uid = '%s' and roi_type like 'PTV%%'"
+                                                % study_instance_uid)
+            artifacts = calc_treatment_volume_artifacts([row[0] for row in ptv_coordinates_strings])
+            store_treatment_volume_artifacts(cnx, study_instance_uid, checksum, artifacts)
+
+    return artifacts
+
+
+def calc_treatment_volume_artifacts(ptv_coordinates_strings):
+    """
+    :param ptv_coordinates_strings: roi_coord_string of each PTV
+    :type ptv_coordinates_strings: list
+    :return: treatment volume artifacts as described in get_treatment_volume_artifacts
+    :rtype: dict
+    """
+    tv = roi_geom.union([roi_form.get_planes_from_string(ptv) for ptv in ptv_coordinates_strings])
+    return {'tv': tv,
+            'centroid': get_treatment_volume_centroid(tv),
+            'surface_points': sample_roi(get_treatment_volume_coord(tv))}
+
+
+def load_treatment_volume_artifacts(cnx, study_instance_uid, checksum):
+    """
+    :param cnx: connection to DVHA SQL database
+    :type cnx: DVH_SQL
+    :param study_instance_uid: study_instance_uid in SQL database
+    :type study_instance_uid: str
+    :param checksum: current return of get_ptv_checksum
+    :type checksum: str
+    :return: treatment volume artifacts as described in get_treatment_volume_artifacts, None if not stored or outdated
+    :rtype: dict
+    """
+    stored = cnx.query('TVs', 'ptv_checksum, roi_coord_string, centroid, surface_points',
+                       "study_instance_uid = '%s'" % study_instance_uid)
+    if stored and stored[0][0] == checksum:
+        surface_points = np.array(stored[0][3].split(','), dtype=float).reshape(-1, 3)
+        return {'tv': roi_form.get_planes_from_string(stored[0][1]),
+                'centroid': np.array([float(v) for v in stored[0][2].split(',')]),
+                'surface_points': list(surface_points)}
+
+
+def store_treatment_volume_artifacts(cnx, study_instance_uid, checksum, artifacts):
+    """
+    Replace the TVs table row of a study
+    :param cnx: connection to DVHA SQL database
+    :type cnx: DVH_SQL
+    :param study_instance_uid: study_instance_uid in SQL database
+    :type study_instance_uid: str
+    :param checksum: return of get_ptv_checksum used to calculate artifacts
+    :type checksum: str
+    :param artifacts: return of calc_treatment_volume_artifacts
+    :type artifacts: dict
+    """
+    condition = "study_instance_uid = '%s'" % study_instance_uid
+    mrn = cnx.query('DVHs', 'mrn', condition)[0][0]
+    row = {'mrn': [mrn, 'text'],
+           'study_instance_uid': [study_instance_uid, 'text'],
+           'ptv_checksum': [checksum, 'varchar(32)'],
+           'roi_coord_string': [roi_form.sets_of_points_to_db_string(artifacts['tv']), 'text'],
+           'centroid': [','.join(['%.3f' % v for v in artifacts['centroid']]), 'varchar(35)'],
+           'surface_points': [','.join(['%.3f' % v for point in artifacts['surface_points'] for v in point]), 'text'],
+           'import_time_stamp': None}
+    cnx.execute_str("DELETE FROM TVs WHERE %s;" % condition)
+    cnx.insert_row('TVs', row)
+
+
+def get_ptv_checksum(cnx, study_instance_uid):
+    """
+    Summarize the PTV rows of a study, which changes if a PTV is added, deleted, re-imported, or re-assigned
+    :param cnx: connection to DVHA SQL database
+    :type cnx: DVH_SQL
+    :param study_instance_uid: study_instance_uid in SQL database
+    :type study_instance_uid: str
+    :return: md5 checksum of the roi_name, roi_type, length of roi_coord_string, and import_time_stamp of each PTV
+    :rtype: str
+    """
+    ptvs = cnx.query('DVHs', 'roi_name, roi_type, length(roi_coord_string), import_time_stamp',
+                     "study_instance_uid = '%s' and roi_type like 'PTV%%'" % study_instance_uid,
+                     order_by='roi_name')
+    return hashlib.md5(str([[str(v) for v in row] for row in ptvs]).encode()).hexdigest()
+
+
+def get_treatment_volume_mask(tv, resolution=None):
+    """
+    Rasterize the treatment volume onto a voxel grid encompassing it, rois rasterized onto this grid are clipped
+    to the extent of the treatment volume, which is sufficient for overlap calculations
+    :param tv: treatment volume formatted as a "sets of points" object specified in tools.roi_geometry
+    :type tv: dict
+    :param resolution: voxel width in x and y (mm), defaults to ROI_MASK_RESOLUTION in Options
+    :type resolution: float
+    :rtype: ROIMask
+    """
+    if resolution is None:
+        resolution = Options().ROI_MASK_RESOLUTION
+    return roi_mask.VoxelGrid([tv], resolution=resolution).get_mask(tv)
+
+
+def get_treatment_volume_overlap_pre_calc(tv):
+    """
+    :param tv: treatment volume formatted as a "sets of points" object specified in tools.roi_geometry
+    :type tv: dict
+    :return: pre_calc for treatment_volume_overlap based on the GEOMETRY_ENGINE in Options
+    """
+    if Options().GEOMETRY_ENGINE == 'mask':
+        return get_treatment_volume_mask(tv)
+    return tv
+
+
 def get_treatment_volume_centroid(tv):
     return np.array(roi_geom.centroid(tv))
 
@@ -16,16 +16,19 @@ import wx
 from datetime import datetime
 from os import mkdir, rename
 from os.path import join, basename
+from pubsub import pub
+from threading import Thread
 from dvha.db.sql_connector import DVH_SQL, echo_sql_db, is_file_sqlite_db
+from dvha.db.recalculate import recalculate, CALCULATIONS
 from dvha.models.import_dicom import ImportDicomFrame
 from dvha.paths import DATA_DIR
-from dvha.tools.errors import SQLError, SQLErrorDialog
+from dvha.tools.errors import SQLError, SQLErrorDialog, ErrorDialog
+from dvha.tools.progress import ProgressReporter
 from dvha.tools.utilities import delete_directory_contents, move_files_to_new_path, delete_file, get_file_paths,\
-    delete_imported_dicom_files, move_imported_dicom_files, MessageDialog
+    delete_imported_dicom_files, move_imported_dicom_files, MessageDialog, get_elapsed_time, set_msw_background_color
 
 
 class CalculationsDialog(wx.Dialog):
-    # TODO: Add functionality to OK button
     """
     Dialog to perform various calculations for values not stored in DICOM files.
     """
@@ -33,13 +36,12 @@ class CalculationsDialog(wx.Dialog):
         wx.Dialog.__init__(self, None, title="Calculations")
 
         choices = ["PTV Distances", "PTV Overlap", "ROI Centroid", "ROI Spread", "ROI Cross-Section",
-                   "OAR-PTV Centroid Distance", "Beam Complexities", "Plan Complexities", "All (except age)",
-                   "Patient Ages"]
+                   "OAR-PTV Centroid Distance", "DVH Pyramids", "Beam Complexities", "Plan Complexities",
+                   "All (except age)", "Patient Ages"]
         self.combo_box_calculate = wx.ComboBox(self, wx.ID_ANY, choices=choices, style=wx.CB_DROPDOWN | wx.CB_READONLY)
         self.checkbox = wx.CheckBox(self, wx.ID_ANY, "Only Calculate Missing Values")
         self.text_ctrl_condition = wx.TextCtrl(self, wx.ID_ANY, "")
         self.button_ok = wx.Button(self, wx.ID_OK, "Calculate")
-        self.button_ok.Disable()  # Remove this line once functionality is added
         self.button_cancel = wx.Button(self, wx.ID_CANCEL, "Cancel")
 
         self.__set_properties()
@@ -86,9 +88,139 @@ class CalculationsDialog(wx.Dialog):
     def run(self):
         res = self.ShowModal()
         if res == wx.ID_OK:
-            pass
+            self.action()
+        self.Destroy()
+
+    def action(self):
+        calculation = self.combo_box_calculate.GetValue()
+        if not calculation:
+            return
+        if calculation == "All (except age)":
+            calculations = [calc for calc in CALCULATIONS if calc != "Patient Ages"]
+        else:
+            calculations = [calculation]
+        condition = self.text_ctrl_condition.GetValue().strip()
+        RecalculationFrame(calculations, condition=condition if condition else None,
+                           only_missing=self.checkbox.GetValue())
+
+
+class RecalculationWorker(Thread):
+    """
+    Create a thread to recalculate values not stored in DICOM files, see db.recalculate
+    """
+    def __init__(self, calculations, condition=None, only_missing=False):
+        """
+        :param calculations: keys of CALCULATIONS in db.recalculate
+        :type calculations: list
+        :param condition: optional condition in SQL syntax
+        :type condition: str
+        :param only_missing: if True, only calculate values that are NULL in the database
+        :type only_missing: bool
+        """
+        Thread.__init__(self)
+
+        self.calculations = calculations
+        self.condition = condition
+        self.only_missing = only_missing
+        self.start_time = datetime.now()
+        self.progress = ProgressReporter()
+
+        self.start()  # start the thread
+
+    def run(self):
+        try:
+            recalculate(self.calculations, condition=self.condition, only_missing=self.only_missing,
+                        callback=self.update_progress)
+        except Exception as e:
+            self.progress.flush()
+            wx.CallAfter(pub.sendMessage, "recalculation_error", error=e)
+            return
+        self.progress.flush()
+        wx.CallAfter(pub.sendMessage, "recalculation_close")
+
+    def update_progress(self, study_counter, study_total, study_instance_uid):
+        msg = ["Study (%s of %s): %s" % (study_counter, study_total, study_instance_uid),
+               int(100 * study_counter / study_total)]
+        self.progress.update("recalculation_update_gauge_info", msg=msg)
+        msg = "Elapsed Time: %s" % get_elapsed_time(self.start_time, datetime.now())
+        self.progress.update("recalculation_update_elapsed_time", msg=msg)
+
+
+class RecalculationFrame(wx.Frame):
+    """
+    Companion class for RecalculationWorker to display progress, Automatically calls RecalculationWorker
+    """
+    def __init__(self, calculations, condition=None, only_missing=False):
+        """
+        :param calculations: keys of CALCULATIONS in db.recalculate
+        :type calculations: list
+        :param condition: optional condition in SQL syntax
+        :type condition: str
+        :param only_missing: if True, only calculate values that are NULL in the database
+        :type only_missing: bool
+        """
+        wx.Frame.__init__(self, None, title='Calculating %s' % ', '.join(calculations))
+        set_msw_background_color(self)
+
+        self.gauge = wx.Gauge(self, wx.ID_ANY, 100)
+
+        self.__set_properties()
+        self.__do_layout()
+        self.__do_subscribe()
+
+        self.Show()
+
+        RecalculationWorker(calculations, condition=condition, only_missing=only_missing)
+
+    def __set_properties(self):
+        self.gauge.SetMinSize((358, 17))
+
+    def __do_layout(self):
+        sizer_wrapper = wx.BoxSizer(wx.VERTICAL)
+        sizer_progress = wx.StaticBoxSizer(wx.StaticBox(self, wx.ID_ANY, ""), wx.VERTICAL)
+
+        self.label_study = wx.StaticText(self, wx.ID_ANY, "Planning calculations...")
+        sizer_progress.Add(self.label_study, 0, 0, 0)
+        sizer_progress.Add(self.gauge, 0, wx.EXPAND, 0)
+        sizer_wrapper.Add(sizer_progress, 0, wx.ALL | wx.EXPAND, 5)
+
+        self.label_elapsed_time = wx.StaticText(self, wx.ID_ANY, "Elapsed Time:")
+        sizer_wrapper.Add(self.label_elapsed_time, 0, wx.BOTTOM | wx.LEFT, 10)
+
+        self.SetSizer(sizer_wrapper)
+        self.Fit()
+        self.Layout()
+        self.Center()
+
+    def __do_subscribe(self):
+        pub.subscribe(self.update_gauge_info, "recalculation_update_gauge_info")
+        pub.subscribe(self.update_elapsed_time, "recalculation_update_elapsed_time")
+        pub.subscribe(self.close, "recalculation_close")
+        pub.subscribe(self.on_error, "recalculation_error")
+
+    def __do_unsubscribe(self):
+        for topic in ["recalculation_update_gauge_info", "recalculation_update_elapsed_time", "recalculation_close",
+                      "recalculation_error"]:
+            pub.unsubAll(topicName=topic)
+
+    def close(self):
+        self.__do_unsubscribe()
         self.Destroy()
 
+    def on_error(self, error):
+        if isinstance(error, SQLError):
+            SQLErrorDialog(self, error)
+        else:
+            ErrorDialog(self, "Recalculation was not completed.\n%s" % error, "Recalculation Error")
+        self.close()
+
+    def update_gauge_info(self, msg):
+        wx.CallAfter(self.label_study.SetLabelText, msg[0])
+        wx.CallAfter(self.gauge.SetValue, msg[1])
+
+    def update_elapsed_time(self, msg):
+        wx.CallAfter(self.label_elapsed_time.SetLabelText, msg)
+
 
 class ChangeOrDeleteBaseClass(wx.Dialog):
     """
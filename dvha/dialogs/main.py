@@ -348,13 +348,37 @@ class DelEndpointDialog(SelectFromListDialog):
 
 
 class SelectRegressionVariablesDialog(SelectFromListDialog):
-    def __init__(self, dependent_variable, independent_variable_choices, selections=None):
+    def __init__(self, dependent_variable, independent_variable_choices, selections=None, regressions=None):
+        """
+        :param dependent_variable: the y-variable
+        :type dependent_variable: str
+        :param independent_variable_choices: the x-variables to choose from
+        :type independent_variable_choices: list
+        :param selections: x-variables selected initially
+        :type selections: list
+        :param regressions: optional output of StatsData.get_univariate_regressions to display R² and p-value
+        :type regressions: dict
+        """
         self.dependent_variable = dependent_variable
         self.independent_variable_choices = independent_variable_choices
         size = get_window_size(1, 0.8)
+        width = [350, 550][regressions is not None]
         SelectFromListDialog.__init__(self, "Select Variables for %s" % dependent_variable,
                                       "Independent Variables", independent_variable_choices,
-                                      size=(350, size[1]), column_width=300, selections=selections)
+                                      size=(width, size[1]), column_width=300, selections=selections)
+        if regressions is not None:
+            self.add_regression_columns(regressions)
+
+    def add_regression_columns(self, regressions):
+        self.list_ctrl.AppendColumn('R²', format=wx.LIST_FORMAT_RIGHT, width=60)
+        self.list_ctrl.AppendColumn('p-value', format=wx.LIST_FORMAT_RIGHT, width=70)
+        self.list_ctrl.AppendColumn('Slope', format=wx.LIST_FORMAT_RIGHT, width=80)
+        for row in range(self.list_ctrl.GetItemCount()):
+            regression = regressions.get(self.list_ctrl.GetItemText(row))
+            if regression is not None:
+                self.list_ctrl.SetItem(row, 1, "%0.3f" % regression['r_sq'])
+                self.list_ctrl.SetItem(row, 2, "%0.3f" % regression['p_value'][1])
+                self.list_ctrl.SetItem(row, 3, "%0.3g" % regression['slope'])
 
 
 def query_dlg(parent, query_type, set_values=False):
@@ -623,6 +647,10 @@ class UserSettings(wx.Frame):
     """
     Customize directories and visual settings for DVHA
     """
+    # Choice labels for the GEOMETRY_ENGINE and SURFACE_AREA_ENGINE options
+    geometry_engines = {'Polygons (Shapely)': 'shapely', 'Voxel Mask': 'mask'}
+    surface_area_engines = {'Polygons (Shapely)': 'shapely', 'Mesh': 'mesh'}
+
     def __init__(self, parent):
         """
         :param parent: main application frame
@@ -651,6 +679,10 @@ class UserSettings(wx.Frame):
         self.button_imported = wx.Button(self, wx.ID_ANY, u"…")
 
         self.checkbox_dicom_dvh = wx.CheckBox(self, wx.ID_ANY, "Import DICOM DVH if available")
+        self.combo_box_geometry_engine = wx.ComboBox(self, wx.ID_ANY, choices=list(self.geometry_engines),
+                                                     style=wx.CB_DROPDOWN | wx.CB_READONLY)
+        self.combo_box_surface_area_engine = wx.ComboBox(self, wx.ID_ANY, choices=list(self.surface_area_engines),
+                                                         style=wx.CB_DROPDOWN | wx.CB_READONLY)
         self.dvh_bin_width_input = wx.TextCtrl(self, wx.ID_ANY, str(self.options.dvh_bin_width))
         self.combo_box_colors_category = wx.ComboBox(self, wx.ID_ANY, choices=color_variables,
                                                      style=wx.CB_DROPDOWN | wx.CB_READONLY)
@@ -696,6 +728,15 @@ class UserSettings(wx.Frame):
         self.checkbox_dicom_dvh.SetValue(self.options.USE_DICOM_DVH)
         self.checkbox_dicom_dvh.SetToolTip("If a DICOM RT-Dose file has a DVH Sequence, use this DVH instead of "
                                            "recalculating during import.")
+        self.combo_box_geometry_engine.SetToolTip("Method used to calculate PTV overlap during import and "
+                                                  "recalculation, other roi geometries always use polygons.\n"
+                                                  "Polygons: exact, recommended.\n"
+                                                  "Voxel Mask: approximate, only faster than polygons at coarse "
+                                                  "mask resolutions.")
+        self.combo_box_surface_area_engine.SetToolTip("Polygons: slice polygons with stair-step edges between slices.\n"
+                                                      "Mesh: triangle mesh interpolated between slices, more accurate "
+                                                      "for sloped surfaces but several times slower.")
+        self.set_engine_values()
         self.dvh_bin_width_input.SetToolTip("Value must be an integer.")
         self.dvh_bin_width_input.SetMinSize((50, 21))
         self.combo_box_colors_category.SetMinSize((250, self.combo_box_colors_category.GetSize()[1]))
@@ -762,6 +803,12 @@ class UserSettings(wx.Frame):
         sizer_wrapper.Add(sizer_dicom_directories, 0, wx.ALL | wx.EXPAND, 10)
 
         sizer_dvh_options.Add(self.checkbox_dicom_dvh, 0, wx.ALL, 5)
+        sizer_geometry_engines = wx.BoxSizer(wx.HORIZONTAL)
+        for label, combo_box in [("PTV Overlap:", self.combo_box_geometry_engine),
+                                 ("Surface Area:", self.combo_box_surface_area_engine)]:
+            sizer_geometry_engines.Add(wx.StaticText(self, wx.ID_ANY, label), 0, wx.ALL, 5)
+            sizer_geometry_engines.Add(combo_box, 0, wx.ALL, 2)
+        sizer_dvh_options.Add(sizer_geometry_engines, 0, wx.ALL, 5)
         sizer_wrapper.Add(sizer_dvh_options, 0, wx.ALL | wx.EXPAND, 10)
 
         label_dvh_bin_width = wx.StaticText(self, wx.ID_ANY, "DVH Bin Width (cGy):")
@@ -828,6 +875,8 @@ class UserSettings(wx.Frame):
         self.Bind(wx.EVT_BUTTON, self.imported_dir_dlg, id=self.button_imported.GetId())
 
         self.Bind(wx.EVT_CHECKBOX, self.on_use_dicom_dvh, id=self.checkbox_dicom_dvh.GetId())
+        self.Bind(wx.EVT_COMBOBOX, self.on_geometry_engine, id=self.combo_box_geometry_engine.GetId())
+        self.Bind(wx.EVT_COMBOBOX, self.on_surface_area_engine, id=self.combo_box_surface_area_engine.GetId())
 
         self.Bind(wx.EVT_TEXT, self.update_dvh_bin_width_val, id=self.dvh_bin_width_input.GetId())
         self.Bind(wx.EVT_COMBOBOX, self.update_input_colors_var, id=self.combo_box_colors_category.GetId())
@@ -1028,10 +1077,25 @@ class UserSettings(wx.Frame):
         MessageDialog(self, "Restore default preferences?", action_yes_func=self.options.restore_defaults)
         self.update_size_val()
         self.refresh_options()
+        self.set_engine_values()
 
     def on_use_dicom_dvh(self, *evt):
         self.options.set_option('USE_DICOM_DVH', self.checkbox_dicom_dvh.GetValue())
 
+    def set_engine_values(self):
+        for combo_box, engines, option in [(self.combo_box_geometry_engine, self.geometry_engines, 'GEOMETRY_ENGINE'),
+                                           (self.combo_box_surface_area_engine, self.surface_area_engines,
+                                            'SURFACE_AREA_ENGINE')]:
+            value = getattr(self.options, option, 'shapely')
+            combo_box.SetValue({engine: label for label, engine in engines.items()}.get(value, list(engines)[0]))
+
+    def on_geometry_engine(self, *evt):
+        self.options.set_option('GEOMETRY_ENGINE', self.geometry_engines[self.combo_box_geometry_engine.GetValue()])
+
+    def on_surface_area_engine(self, *evt):
+        self.options.set_option('SURFACE_AREA_ENGINE',
+                                self.surface_area_engines[self.combo_box_surface_area_engine.GetValue()])
+
     def on_apply(self, *evt):
         self.apply_and_redraw_plots()
         self.is_edited = True  # Used to track edits since last options save
@@ -21,7 +21,7 @@ import webbrowser
 from pubsub import pub
 from dvha.db import sql_columns
 from dvha.db.sql_to_python import QuerySQL
-from dvha.db.sql_connector import echo_sql_db, initialize_db
+from dvha.db.sql_connector import DVH_SQL, echo_sql_db, initialize_db
 from dvha.dialogs.main import query_dlg, UserSettings, About, PythonLibraries, do_sqlite_backup
 from dvha.dialogs.database import SQLSettingsDialog
 from dvha.dialogs.export import ExportCSVDialog, ExportFigure
@@ -42,11 +42,12 @@ from dvha.models.roi_map import ROIMapFrame
 from dvha.models.stats_data_editor import StatsDataEditor
 from dvha.options import Options, DefaultOptions
 from dvha.paths import LOGO_PATH, DATA_DIR, ICONS, MODELS_DIR, APP_DIR
-from dvha.tools.errors import MemoryErrorDialog, PlottingMemoryError, ErrorDialog
+from dvha.tools.errors import MemoryErrorDialog, PlottingMemoryError, ErrorDialog, SessionFileError
 from dvha.tools.roi_name_manager import DatabaseROIs
+from dvha.tools.session import save_session, load_session
 from dvha.tools.stats import StatsData, sync_variables_in_stats_data_objects
 from dvha.tools.utilities import get_study_instance_uids, scale_bitmap, is_windows, is_linux, is_mac, get_window_size, \
-    save_object_to_file, load_object_from_file, set_msw_background_color, initialize_directories, \
+    set_msw_background_color, initialize_directories, prune_cache_directory, \
     set_frame_icon, main_is_frozen
 from dvha.db.sql_columns import all_columns as sql_column_info
 
@@ -554,7 +555,7 @@ class DVHAMainFrame(wx.Frame):
             dlg.SetDirectory(DATA_DIR)
             if dlg.ShowModal() == wx.ID_OK:
                 self.save_data_obj()
-                save_object_to_file(self.save_data, dlg.GetPath())
+                save_session(self.save_data, dlg.GetPath())
             dlg.Destroy()
         else:
             wx.MessageBox('There is no data to save. Please query/open some data first.', 'Save Error',
@@ -592,7 +593,7 @@ class DVHAMainFrame(wx.Frame):
         return self.radio_button_query_group.GetSelection() + 1
 
     def save_data_obj(self):
-        self.save_data['group_data'] = self.group_data
+        self.save_data['group_data'] = self.get_group_save_data()
         self.save_data['query_filters'] = self.query_filters
         self.save_data['time_stamp'] = datetime.now()
         self.save_data['version'] = DefaultOptions().VERSION
@@ -604,9 +605,65 @@ class DVHAMainFrame(wx.Frame):
         self.save_data['regression'] = self.regression.get_save_data()
         self.save_data['control_chart'] = self.control_chart.get_save_data()
 
+    def get_group_save_data(self):
+        """
+        :return: the DVH, table, and stats data of each group as plain data, see load_group_save_data
+        :rtype: dict
+        """
+        save_data = {}
+        for grp, data in self.group_data.items():
+            save_data[grp] = {'dvh': data['dvh'].get_save_data() if data['dvh'] else None,
+                              'data': {key: table.get_save_data() if table else None
+                                       for key, table in data['data'].items()},
+                              'stats_data': data['stats_data'].get_save_data() if data['stats_data'] else None}
+        return save_data
+
+    def load_group_save_data(self, save_data):
+        """
+        Rebuild the DVH, QuerySQL, and StatsData objects of each group
+        :param save_data: the return of get_group_save_data, or the pickled objects of sessions saved by DVHA 0.8.0
+        and earlier
+        :type save_data: dict
+        """
+        if any(isinstance(data['dvh'], DVH) for data in save_data.values()):
+            self.group_data = save_data
+            return
+
+        for grp, data in save_data.items():
+            dvh = DVH(save_data=data['dvh']) if data['dvh'] else None
+            table_data = {key: QuerySQL(key, None, save_data=table) if table else None
+                          for key, table in data['data'].items()}
+            stats_data = None
+            if data['stats_data']:
+                stats_data = StatsData(dvh, table_data, group=grp, save_data=data['stats_data'])
+            self.group_data[grp] = {'dvh': dvh, 'data': table_data, 'stats_data': stats_data}
+
     def load_data_obj(self, abs_file_path):
-        self.save_data = load_object_from_file(abs_file_path)
-        self.group_data = self.save_data['group_data']
+        try:
+            self.save_data = load_session(abs_file_path)
+        except SessionFileError as e:
+            self.save_data = {}
+            wx.MessageBox(str(e), 'Open Error', wx.OK | wx.OK_DEFAULT | wx.ICON_WARNING)
+            return
+
+        try:
+            self.restore_save_data()
+        except Exception as e:
+            logger.error("Could not restore session %s: %s", abs_file_path, traceback.format_exc())
+            saved_version = self.save_data.get('version')
+            self.close()
+            self.save_data = {}
+            if saved_version == DefaultOptions().VERSION:
+                msg = "This session could not be restored.\n%s" % e
+            else:
+                # other saved data may be missing values expected by this version (e.g., pickled regressions)
+                msg = "This session was saved with DVHA %s and could not be restored with DVHA %s.\n%s" % \
+                      (saved_version, DefaultOptions().VERSION, e)
+            ErrorDialog(self, msg, 'Open Error')
+
+    def restore_save_data(self):
+        """Load self.save_data, from load_session, into the GUI"""
+        self.load_group_save_data(self.save_data['group_data'])
 
         # .load_save_data loses column widths?
         self.radio_button_query_group.SetSelection(0)
@@ -766,7 +823,12 @@ class DVHAMainFrame(wx.Frame):
             try:
                 self.endpoint.update_dvh(self.group_data)
                 self.set_summary_text(group)
-                self.plot.update_plot(self.group_data[1]['dvh'], dvh_2=self.group_data[2]['dvh'])
+                if group == 2 and self.group_data[1]['dvh'] is not None and \
+                        self.plot.dvh is self.group_data[1]['dvh']:
+                    # group 1 is already plotted, only replace the group 2 data
+                    self.plot.update_plot_2(self.group_data[2]['dvh'])
+                else:
+                    self.plot.update_plot(self.group_data[1]['dvh'], dvh_2=self.group_data[2]['dvh'])
                 wx.EndBusyCursor()
                 self.update_data(load_saved_dvh_data=load_saved_dvh_data, group_2_only=bool(group-1))
 
@@ -848,9 +910,9 @@ class DVHAMainFrame(wx.Frame):
             if not(grp == 1 and group_2_only) or grp == 2:
                 if hasattr(grp_data['dvh'], 'study_instance_uid'):
                     if not load_saved_dvh_data:
-                        condition_str = "study_instance_uid in ('%s')" % "','".join(
-                           grp_data['dvh'].study_instance_uid)
-                        grp_data['data'] = {key: QuerySQL(key, condition_str) for key in tables}
+                        with DVH_SQL() as cnx:
+                            condition_str = cnx.load_uid_table(grp_data['dvh'].study_instance_uid)
+                            grp_data['data'] = {key: QuerySQL(key, condition_str, cnx=cnx) for key in tables}
                         grp_data['stats_data'] = StatsData(grp_data['dvh'], grp_data['data'], group=grp)
                 else:
                     grp_data['data'] = {key: None for key in tables}
@@ -1156,6 +1218,7 @@ class MainApp(wx.App):
     def OnInit(self):
 
         initialize_directories()
+        prune_cache_directory()
         if is_windows():
             from dvha.tools.windows_reg_edit import set_ie_emulation_level, set_ie_lockdown_level
             set_ie_emulation_level()
@@ -16,6 +16,7 @@ from copy import deepcopy
 from dvha.models.plot import PlotControlChart
 from dvha.db import sql_columns
 from dvha.dialogs.export import save_data_to_file
+from dvha.tools.stats import to_list
 
 
 class ControlChartFrame:
@@ -99,7 +100,8 @@ class ControlChartFrame:
         sort_index = sorted(range(len(dates)), key=lambda k: dates[k])
         dates_sorted = [dates[i] for i in sort_index]
 
-        y_values_sorted = [stats_data.data[self.y_axis]['values'][i] for i in sort_index]
+        y_values = to_list(stats_data.data[self.y_axis]['values'])
+        y_values_sorted = [y_values[i] for i in sort_index]
         mrn_sorted = [stats_data.mrns[i] for i in sort_index]
         uid_sorted = [stats_data.uids[i] for i in sort_index]
 
@@ -9,6 +9,8 @@
 #    available at https://github.com/cutright/DVH-Analytics
 
 import wx
+import hashlib
+from multiprocessing import Pool
 import os
 import pydicom as dicom
 from dicompylercore import dicomparser
@@ -18,12 +20,17 @@ from threading import Thread
 from queue import Queue
 from dvha.db.dicom_parser import DICOM_Parser
 from dvha.paths import ICONS
-from dvha.tools.utilities import get_file_paths
+from dvha.tools.progress import ProgressReporter
+from dvha.tools.roi_name_manager import DatabaseROIs
+from dvha.tools.utilities import get_file_paths, save_object_to_file, load_object_from_file, get_cache_file_path
 from time import sleep
 
 
 SCRIPT_DIR = os.path.dirname(__file__)
 
+# roi map of each pre-import worker process, set by set_process_roi_map
+PROCESS_ROI_MAP = {}
+
 
 class DicomTreeBuilder:
     """
@@ -448,6 +455,7 @@ class DicomDirectoryParserWorker(Thread):
         self.uid_to_mrn = {}
         self.dicom_file_paths = {}
         self.other_dicom_files = {}
+        self.progress = ProgressReporter()
 
         self.start()  # begin thread
 
@@ -478,7 +486,8 @@ class DicomDirectoryParserWorker(Thread):
 
         msg = {'label': "Complete",
                'gauge': 1.}
-        wx.CallAfter(pub.sendMessage, "pre_import_progress_update", msg=msg)
+        self.progress.update("pre_import_progress_update", msg=msg)
+        self.progress.flush()
         sleep(0.3)
 
         wx.CallAfter(pub.sendMessage, 'dicom_directory_parser_set_file_tree',
@@ -493,7 +502,7 @@ class DicomDirectoryParserWorker(Thread):
 
     def parser(self, file_path, msg):
 
-        wx.CallAfter(pub.sendMessage, "pre_import_progress_update", msg=msg)
+        self.progress.update("pre_import_progress_update", msg=msg)
 
         file_name = os.path.basename(file_path)
         file_ext = os.path.splitext(file_path)[1]
@@ -645,6 +654,10 @@ class DicomDirectoryParserWorker(Thread):
 
 
 class PreImportFileSetParserWorker(Thread):
+    """
+    Parse the pre-import data of each complete file set with a process pool, sending each result through pubsub as
+    it finishes. Results are cached in CACHE_DIR, so file sets that have not changed are not parsed again.
+    """
     def __init__(self, file_paths):
         Thread.__init__(self)
 
@@ -652,44 +665,127 @@ class PreImportFileSetParserWorker(Thread):
 
         self.file_paths = file_paths
         self.total_plan_count = len(self.file_paths)
+        self.plan_counter = 0
+        self.progress = ProgressReporter()
 
         self.start()
 
     def run(self):
-        queue = self.get_queue()
-        worker = Thread(target=self.do_parse, args=[queue])
-        worker.setDaemon(True)
-        worker.start()
-        queue.join()
-        sleep(0.3)  # Allow time for user to see final progress in GUI
-        pub.sendMessage('pre_import_progress_close')
+        roi_map = DatabaseROIs()
 
-    def get_queue(self):
-        queue = Queue()
-        for plan_counter, uid in enumerate(list(self.file_paths)):
+        file_sets = []
+        for uid in list(self.file_paths):
             if self.file_paths[uid]['rtplan'] and self.file_paths[uid]['rtstruct'] and self.file_paths[uid]['rtdose']:
                 init_params = {'plan_file': self.file_paths[uid]['rtplan'][0],
                                'structure_file': self.file_paths[uid]['rtstruct'][0],
                                'dose_file': self.file_paths[uid]['rtdose'][0]}
-                msg = {'label': 'Parsing File Set %s of %s' % (plan_counter+1, self.total_plan_count),
-                       'gauge': plan_counter / self.total_plan_count}
-                queue.put((uid, init_params, msg))
-        return queue
+                pre_import_data = load_cached_pre_import_data(init_params)
+                if pre_import_data is None:
+                    file_sets.append((uid, init_params))
+                else:
+                    self.send_pre_import_data(uid, pre_import_data, roi_map)
 
-    def do_parse(self, queue):
-        while queue.qsize():
-            parameters = queue.get()
-            self.parser(*parameters)
-            queue.task_done()
+        if file_sets:
+            pool = Pool(initializer=set_process_roi_map, initargs=(roi_map,))
+            try:
+                for uid, pre_import_data in pool.imap_unordered(parse_file_set, file_sets):
+                    self.send_pre_import_data(uid, pre_import_data, roi_map)
+            finally:
+                pool.close()
+                pool.join()
 
         plan_count = self.total_plan_count
         msg = {'label': 'Parsing Complete: %s fileset%s' % (plan_count, ['', 's'][plan_count != 1]),
                'gauge': 1.}
-        pub.sendMessage("pre_import_progress_update", msg=msg)
+        self.progress.update("pre_import_progress_update", msg=msg)
+        self.progress.flush()
+        sleep(0.3)  # Allow time for user to see final progress in GUI
+        wx.CallAfter(pub.sendMessage, 'pre_import_progress_close')
+
+    def send_pre_import_data(self, uid, pre_import_data, roi_map):
+        """
+        :param uid: the plan uid of the file set
+        :type uid: str
+        :param pre_import_data: the return of parse_file_set, None if parsing failed
+        :type pre_import_data: dict
+        :param roi_map: roi name map, shared by each PreImportData
+        :type roi_map: DatabaseROIs
+        """
+        self.plan_counter += 1
+        self.progress.increment('plans')
+        msg = {'label': 'Parsing File Set %s of %s (%0.1f plans/min)' %
+                        (self.plan_counter, self.total_plan_count, self.progress.get_rate('plans', period=60.)),
+               'gauge': self.plan_counter / self.total_plan_count}
+        self.progress.update("pre_import_progress_update", msg=msg)
+
+        if pre_import_data is not None:  # data messages are not throttled
+            pre_import_data['roi_map'] = roi_map
+            msg = {'uid': uid, 'init_params': pre_import_data}
+            wx.CallAfter(pub.sendMessage, "set_pre_import_parsed_dicom_data", msg=msg)
+
+
+def set_process_roi_map(roi_map):
+    """
+    Pool initializer, so parse_file_set does not load the roi map for each file set
+    :param roi_map: roi name map
+    :type roi_map: DatabaseROIs
+    """
+    PROCESS_ROI_MAP['roi_map'] = roi_map
 
-    def parser(self, uid, init_params, msg):
-        pub.sendMessage("pre_import_progress_update", msg=msg)
 
-        pre_import_data = DICOM_Parser(**init_params).pre_import_data
-        msg = {'uid': uid, 'init_params': pre_import_data}
-        pub.sendMessage("set_pre_import_parsed_dicom_data", msg=msg)
+def parse_file_set(file_set):
+    """
+    Get the pre-import data of a file set, intended for a process pool
+    :param file_set: the plan uid and the DICOM_Parser init parameters
+    :type file_set: tuple
+    :return: the plan uid and DICOM_Parser.pre_import_data without the roi map, or None if parsing failed
+    :rtype: tuple
+    """
+    uid, init_params = file_set
+    try:
+        pre_import_data = DICOM_Parser(roi_map=PROCESS_ROI_MAP.get('roi_map'), **init_params).pre_import_data
+    except Exception as e:
+        print('Error: ', e)
+        print('Could not parse the file set of plan %s' % init_params['plan_file'])
+        return uid, None
+
+    pre_import_data.pop('roi_map')
+    cache_file_path = get_pre_import_cache_path(init_params)
+    try:  # write to a temporary file first, so other processes never read a partial file
+        save_object_to_file(pre_import_data, cache_file_path + '.tmp')
+        os.rename(cache_file_path + '.tmp', cache_file_path)
+    except Exception as e:
+        print('Error: ', e)
+        print('Could not write pre-import cache for %s' % init_params['plan_file'])
+
+    return uid, pre_import_data
+
+
+def get_pre_import_cache_path(init_params):
+    """
+    :param init_params: DICOM_Parser init parameters of a file set
+    :type init_params: dict
+    :return: the cache file path, based on the DVHA version and the path, size, and modification time of each file in
+    the file set
+    :rtype: str
+    """
+    file_stats = []
+    for key in ['plan_file', 'structure_file', 'dose_file']:
+        file_path = init_params[key]
+        file_stats.append('%s|%s|%s' % (file_path, os.path.getsize(file_path), os.path.getmtime(file_path)))
+    file_set_hash = hashlib.md5('\n'.join(file_stats).encode()).hexdigest()
+    return get_cache_file_path('pre_import', file_set_hash)
+
+
+def load_cached_pre_import_data(init_params):
+    """
+    :param init_params: DICOM_Parser init parameters of a file set
+    :type init_params: dict
+    :return: the pre-import data from a previous parse_file_set of this file set, or None if not cached
+    :rtype: dict
+    """
+    try:
+        return load_object_from_file(get_pre_import_cache_path(init_params))
+    except Exception as e:
+        print('Error: ', e)
+        print('Could not load pre-import cache for %s' % init_params['plan_file'])
@@ -10,21 +10,26 @@ Class to retrieve DVH data from SQL, calculate parameters dependent on DVHs, and
 #    See the file LICENSE included with this distribution, also
 #    available at https://github.com/cutright/DVH-Analytics
 
-from copy import deepcopy
+from copy import copy
 from dateutil.parser import parse as date_parser
 import numpy as np
 from dvha.db.sql_connector import DVH_SQL
 from dvha.db.sql_to_python import QuerySQL
+from dvha.db.sql_columns import dvh_pyramid
 from dvha.options import Options
 
 
 MAX_DOSE_VOLUME = Options().MAX_DOSE_VOLUME
 
+# Plans and Rxs columns loaded with a single JOIN on DVH init, see DVH.load_plan_and_rx_values
+PLAN_COLUMNS = ['rx_dose', 'sim_study_date', 'fxs', 'tx_site', 'physician']
+RX_COLUMNS = ['fx_dose']
+
 
 # This class retrieves DVH data from the SQL database and calculates statistical DVHs (min, max, quartiles)
 # It also provides some inspection tools of the retrieved data
 class DVH:
-    def __init__(self, uid=None, dvh_condition=None, dvh_bin_width=5):
+    def __init__(self, uid=None, dvh_condition=None, dvh_bin_width=5, save_data=None):
         """
         This class will retrieve DVHs and other data in the DVH SQL table meeting the given constraints,
         it will also parse the DVH_string into python lists and retrieve the associated Rx dose
@@ -32,26 +37,40 @@ class DVH:
         :param dvh_condition: a string in SQL syntax applied to a DVH Table query
         :param dvh_bin_width: retrieve every nth value from dvh_string in SQL
         :type dvh_bin_width: int
+        :param save_data: data from get_save_data (e.g., from a saved session), used rather than querying SQL
+        :type save_data: dict
         """
 
         self.dvh_bin_width = dvh_bin_width
 
-        if uid:
-            constraints_str = "study_instance_uid in ('%s')" % "', '".join(uid)
-            if dvh_condition:
-                constraints_str = "(%s) and %s" % (dvh_condition, constraints_str)
-        else:
-            constraints_str = ''
+        if save_data is not None:
+            self.load_save_data(save_data)
+            return
 
         # Get DVH data from SQL and set as attributes
-        dvh_data = QuerySQL('DVHs', constraints_str)
+        # Only the coarsest stored DVH resolution compatible with dvh_bin_width is queried
+        dvh_column, dvh_step = get_dvh_pyramid_level(self.dvh_bin_width)
+        dvh_columns = {'dvh_string'}.union(set(dvh_pyramid.values()))
+        with DVH_SQL() as cnx:
+            # uids are loaded into a temporary table once and reused by each query on this connection
+            if uid:
+                constraints_str = cnx.load_uid_table(uid)
+                if dvh_condition:
+                    constraints_str = "(%s) and %s" % (dvh_condition, constraints_str)
+            else:
+                constraints_str = ''
+
+            dvh_data = QuerySQL('DVHs', constraints_str, ignored_columns=dvh_columns - {dvh_column}, cnx=cnx)
+            if dvh_data.mrn:
+                dvh_split = self.get_dvh_split(dvh_data, dvh_column, dvh_step, constraints_str, cnx=cnx)
+                self.study_instance_uid = dvh_data.study_instance_uid
+                self.load_plan_and_rx_values(cnx=cnx)
+
         if dvh_data.mrn:
-            ignored_keys = {'cnx', 'cursor', 'table_name', 'constraints_str', 'condition_str'}
+            ignored_keys = {'cnx', 'cursor', 'table_name', 'constraints_str', 'condition_str'}.union(dvh_columns)
             self.keys = []
             for key, value in dvh_data.__dict__.items():
                 if not key.startswith("__") and key not in ignored_keys:
-                    if key == 'dvh_string':
-                        dvh_split = [dvh.split(',')[::self.dvh_bin_width] for i, dvh in enumerate(value)]
                     setattr(self, key, value)
                     if '_string' not in key:
                         self.keys.append(key)
@@ -66,9 +85,7 @@ class DVH:
 
             # Add these properties to dvh_data since they aren't in the DVHs SQL table
             self.count = len(self.mrn)
-            self.study_count = len(set(self.uid))
-            self.rx_dose = self.get_plan_values('rx_dose')
-            self.sim_study_date = self.get_plan_values('sim_study_date')
+            self.set_plan_and_rx_properties()
             self.keys.append('rx_dose')
             self.endpoints = {'data': None,
                               'defs': None}
@@ -97,16 +114,156 @@ class DVH:
                     self.dth.append(np.array(self.dth_string[i].split(','), dtype='|S4').astype(np.float))
                 except Exception:
                     self.dth.append(np.array([0]))
-
-            # Store these now so they can be saved in DVH object without needing to query later
-            with DVH_SQL() as cnx:
-                self.physician_count = len(cnx.get_unique_values('Plans', 'physician',
-                                                                 "study_instance_uid in ('%s')" % "','".join(self.uid)))
-            self.total_fxs = self.get_plan_values('fxs')
-            self.fx_dose = self.get_rx_values('fx_dose')
         else:
             self.count = 0
 
+    def set_plan_and_rx_properties(self):
+        """
+        Set the properties from the Plans and Rxs tables, after the DVHs table columns and plan_rx_values are loaded
+        """
+        self.study_count = len(set(self.uid))
+        self.rx_dose = self.get_plan_values('rx_dose')
+        self.sim_study_date = self.get_plan_values('sim_study_date')
+
+        # Store these now so they can be saved in DVH object without needing to query later
+        self.physician_count = len(set([str(v) for v in self.plan_rx_values['Plans']['physician'].values()]))
+        self.total_fxs = self.get_plan_values('fxs')
+        self.fx_dose = self.get_rx_values('fx_dose')
+
+    def get_save_data(self):
+        """
+        Get the data of this DVH object as plain lists, dicts, and arrays, so that saved sessions do not depend on the
+        DVH class. DVHs table columns only used to initialize this object (e.g., dth_string) are not included.
+        :return: DVHs table columns, the DVH matrix and DTHs, the cached Plans and Rxs values, and the calculated
+        endpoints, EUD, and NTCP or TCP
+        :rtype: dict
+        """
+        return {'dvh_bin_width': self.dvh_bin_width,
+                'columns': {key: getattr(self, key) for key in self.keys if key != 'rx_dose'},
+                'dvh': self.dvh,
+                'dth': self.dth,
+                'plan_rx_values': self.plan_rx_values,
+                'endpoints': self.endpoints,
+                'eud': self.eud,
+                'ntcp_or_tcp': self.ntcp_or_tcp}
+
+    def load_save_data(self, save_data):
+        """
+        :param save_data: the return of get_save_data
+        :type save_data: dict
+        """
+        self.dvh_bin_width = save_data['dvh_bin_width']
+        self.keys = list(save_data['columns']) + ['rx_dose']
+        for key, value in save_data['columns'].items():
+            setattr(self, key, value)
+        self.uid = self.study_instance_uid
+        self.count = len(self.mrn)
+
+        self.dvh = save_data['dvh']
+        self.bin_count = self.dvh.shape[0]
+        self.dth = save_data['dth']
+        self.plan_rx_values = save_data['plan_rx_values']
+        self.set_plan_and_rx_properties()
+
+        self.endpoints = save_data['endpoints']
+        self.eud = save_data['eud']
+        self.ntcp_or_tcp = save_data['ntcp_or_tcp']
+
+
+    def get_dvh_split(self, dvh_data, dvh_column, dvh_step, constraints_str, cnx=None):
+        """
+        Down-sample the queried DVH strings. Rows imported prior to storing down-sampled DVHs (i.e., dvh_column is
+        NULL or does not exist) will fall back to the full resolution dvh_string
+        :param dvh_data: DVHs table query
+        :type dvh_data: QuerySQL
+        :param dvh_column: the DVHs table column returned by get_dvh_pyramid_level
+        :type dvh_column: str
+        :param dvh_step: keep every nth value of dvh_column
+        :type dvh_step: int
+        :param constraints_str: the condition used to generate dvh_data
+        :type constraints_str: str
+        :param cnx: the connection used to generate dvh_data, required if constraints_str uses a temporary table
+        :type cnx: DVH_SQL
+        :return: DVH values (as str) for each row of dvh_data
+        :rtype: list
+        """
+        dvh_strings = getattr(dvh_data, dvh_column, ['None'] * len(dvh_data.mrn))
+
+        full_dvh_strings = {}
+        if dvh_column != 'dvh_string' and 'None' in dvh_strings:
+            condition = constraints_str
+            if hasattr(dvh_data, dvh_column):
+                condition = "%s IS NULL" % dvh_column
+                if constraints_str:
+                    condition = "(%s) and %s" % (constraints_str, condition)
+            if cnx is None:
+                with DVH_SQL() as cnx:
+                    data = cnx.query('DVHs', 'study_instance_uid, roi_name, dvh_string', condition)
+            else:
+                data = cnx.query('DVHs', 'study_instance_uid, roi_name, dvh_string', condition)
+            full_dvh_strings = {(str(row[0]), str(row[1])): row[2] for row in data}
+
+        dvh_split = []
+        for i, dvh_string in enumerate(dvh_strings):
+            key = (dvh_data.study_instance_uid[i], dvh_data.roi_name[i])
+            if key in full_dvh_strings:
+                dvh_split.append(full_dvh_strings[key].split(',')[::self.dvh_bin_width])
+            else:
+                dvh_split.append(dvh_string.split(',')[::dvh_step])
+        return dvh_split
+
+    def load_plan_and_rx_values(self, plan_columns=None, rx_columns=None, cnx=None):
+        """
+        Query the Plans and Rxs tables with one JOIN for the study_instance_uids of this DVH object and cache the
+        results in self.plan_rx_values, indexed by study_instance_uid
+        :param plan_columns: Plans table columns to be queried, defaults to PLAN_COLUMNS
+        :type plan_columns: list
+        :param rx_columns: Rxs table columns to be queried, defaults to RX_COLUMNS
+        :type rx_columns: list
+        :param cnx: optionally use an open connection, a new connection is opened if not provided
+        :type cnx: DVH_SQL
+        """
+        if cnx is None:
+            with DVH_SQL() as cnx:
+                self.load_plan_and_rx_values(plan_columns=plan_columns, rx_columns=rx_columns, cnx=cnx)
+            return
+
+        plan_columns = PLAN_COLUMNS if plan_columns is None else plan_columns
+        rx_columns = RX_COLUMNS if rx_columns is None else rx_columns
+
+        if not hasattr(self, 'plan_rx_values'):  # DVH objects from saved sessions prior to DVHA 0.8.1
+            self.plan_rx_values = {'Plans': {}, 'Rxs': {}}
+
+        columns = ['Plans.study_instance_uid'] + \
+                  ['Plans.%s' % c for c in plan_columns] + \
+                  ['Rxs.%s' % c for c in rx_columns]
+        condition = cnx.load_uid_table(self.study_instance_uid, column='Plans.study_instance_uid')
+        query_str = "SELECT %s FROM Plans LEFT JOIN Rxs ON Plans.study_instance_uid = Rxs.study_instance_uid " \
+                    "WHERE %s ORDER BY Rxs.fx_grp_number;" % (', '.join(columns), condition)
+
+        data = cnx.query_generic(query_str)
+        force_date = {c: cnx.is_sqlite_column_datetime('Plans', c) for c in plan_columns}  # False for pgsql
+
+        plan_values = {c: {} for c in plan_columns}
+        rx_values = {c: {} for c in rx_columns}
+        for row in data:
+            uid = row[0]
+            for i, column in enumerate(plan_columns):
+                if uid not in plan_values[column]:  # Rxs JOIN repeats plan values for each fraction group
+                    value = row[i + 1]
+                    if force_date[column]:  # sqlite does not have date or time like variables
+                        value = parse_sqlite_date(value)
+                    plan_values[column][uid] = value
+            for i, column in enumerate(rx_columns):
+                value = row[i + 1 + len(plan_columns)]
+                if value is not None:
+                    if uid in rx_values[column]:
+                        rx_values[column][uid] = "%s,%s" % (rx_values[column][uid], value)
+                    else:
+                        rx_values[column][uid] = str(value)
+
+        self.plan_rx_values['Plans'].update(plan_values)
+        self.plan_rx_values['Rxs'].update(rx_values)
 
     def get_plan_values(self, plan_column):
         """
@@ -116,45 +273,37 @@ class DVH:
         :return: values from the Plans table for the DVHs stored in this class
         :rtype: list
         """
-        with DVH_SQL() as cnx:
-            condition = "study_instance_uid in ('%s')" % "','".join(self.study_instance_uid)
-            data = cnx.query('Plans', 'study_instance_uid, %s' % plan_column, condition)
-            force_date = cnx.is_sqlite_column_datetime('Plans', plan_column)  # returns False for pgsql
-
-        uids = [row[0] for row in data]
-        values = [row[1] for row in data]
-        if force_date:  # sqlite does not have date or time like variables
-            for i, value in enumerate(values):
-                try:
-                    if type(value) is int:
-                        values[i] = str(date_parser(str(value)))
-                    else:
-                        values[i] = str(date_parser(value))
-                except Exception:
-                    values[i] = 'None'
-        return [values[uids.index(uid)] for uid in self.study_instance_uid]
+        return self.get_cached_values('Plans', plan_column)
 
     def get_rx_values(self, rx_column):
         """
-        Get values from the Rxs table and store in order matching mrn / study_instance_uid
+        Get values from the Rxs table and store in order matching mrn / study_instance_uid. Studies with multiple
+        prescriptions will have their values joined by a comma
         :param rx_column: name of the SQL column to be queried
         :type rx_column: str
         :return: values from the Rxs table for the DVHs stored in this class
         :rtype: list
         """
-        with DVH_SQL() as cnx:
-            condition = "study_instance_uid in ('%s')" % "','".join(self.study_instance_uid)
-            data = cnx.query('Rxs', 'study_instance_uid, %s' % rx_column, condition)
-
-        uids = [row[0] for row in data]
-        values = [row[1] for row in data]
-        final_values = {}
-        for i, uid in enumerate(uids):
-            if uid in list(values):
-                final_values[uid] = "%s,%s" % (final_values[uid], values[i])
+        return self.get_cached_values('Rxs', rx_column)
+
+    def get_cached_values(self, table, column):
+        """
+        Look-up values loaded with load_plan_and_rx_values, querying the column first if it has not been loaded
+        :param table: either 'Plans' or 'Rxs'
+        :type table: str
+        :param column: name of the SQL column
+        :type column: str
+        :return: values in order matching mrn / study_instance_uid
+        :rtype: list
+        """
+        if not hasattr(self, 'plan_rx_values') or column not in self.plan_rx_values[table]:
+            if table == 'Plans':
+                self.load_plan_and_rx_values(plan_columns=[column], rx_columns=[])
             else:
-                final_values[uid] = str(values[i])
-        return [final_values[uid] for uid in self.study_instance_uid]
+                self.load_plan_and_rx_values(plan_columns=[], rx_columns=[column])
+
+        values = self.plan_rx_values[table][column]
+        return [values.get(uid, [None, 'None'][table == 'Rxs']) for uid in self.study_instance_uid]
 
     @property
     def x_data(self):
@@ -184,7 +333,33 @@ class DVH:
         if not keys:
             keys = self.keys
 
-        return deepcopy({key: getattr(self, key) for key in keys})
+        # values are lists of str or numbers, so a shallow copy of each list is sufficient
+        return {key: copy(getattr(self, key)) for key in keys}
+
+    def get_decimated_xy(self, tolerance):
+        """
+        Down-sample the DVHs for plotting. Bins are grouped into runs with volumes in the same multiple of tolerance,
+        and only the first and last bin of each run are kept, so the plotted line is never further than tolerance from
+        the DVH. The long flat portions of DVHs (e.g., the zero padding past the max dose) are reduced to two points.
+        :param tolerance: maximum difference in relative volume, if 0 only bins with repeated volumes are removed
+        :type tolerance: float
+        :return: x and y values of each DVH as float32 arrays
+        :rtype: tuple
+        """
+        x_axis = np.multiply(np.arange(self.bin_count) + self.dvh_bin_width / 2., self.dvh_bin_width)
+        levels = np.floor(np.divide(self.dvh, tolerance)) if tolerance > 0 else self.dvh
+
+        changed = levels[1:] != levels[:-1]
+        keep = np.zeros(self.dvh.shape, dtype=bool)
+        keep[[0, -1]] = True
+        keep[1:] |= changed
+        keep[:-1] |= changed
+
+        x, y = [], []
+        for i in range(self.count):
+            x.append(x_axis[keep[:, i]].astype(np.float32))
+            y.append(self.dvh[keep[:, i], i].astype(np.float32))
+        return x, y
 
     def get_percentile_dvh(self, percentile):
         """
@@ -390,6 +565,35 @@ class DVH:
         return constraint(self.dvh[:, index], self.mean_dose[index], self.volume[index], self.dvh_bin_width)
 
 
+def parse_sqlite_date(value):
+    """
+    SQLite does not have date or time variable types, parse the stored value into a datetime string
+    :param value: a date as stored in SQLite
+    :return: datetime string or 'None'
+    :rtype: str
+    """
+    try:
+        if type(value) is int:
+            return str(date_parser(str(value)))
+        return str(date_parser(value))
+    except Exception:
+        return 'None'
+
+
+def get_dvh_pyramid_level(dvh_bin_width):
+    """
+    Select the coarsest DVH resolution stored in the DVHs table that can be down-sampled to dvh_bin_width
+    :param dvh_bin_width: requested dose bin width in cGy
+    :type dvh_bin_width: int
+    :return: the DVHs table column and the step needed to down-sample its values to dvh_bin_width
+    :rtype: tuple
+    """
+    for bin_width in sorted(list(dvh_pyramid), reverse=True):
+        if dvh_bin_width % bin_width == 0:
+            return dvh_pyramid[bin_width], dvh_bin_width // bin_width
+    return 'dvh_string', dvh_bin_width
+
+
 # Returns the isodose level outlining the given volume
 def dose_to_volume(dvh, rel_volume, dvh_bin_width=1):
     """
@@ -33,6 +33,7 @@ from dvha.models.data_table import DataTable
 from dvha.paths import ICONS, TEMP_DIR
 from dvha.tools.dicom_dose_sum import DoseGrid
 from dvha.tools.errors import ErrorDialog
+from dvha.tools.progress import ProgressReporter
 from dvha.tools.roi_name_manager import clean_name
 from dvha.tools.utilities import datetime_to_date_string, get_elapsed_time, move_files_to_new_path, rank_ptvs_by_D95,\
     set_msw_background_color, is_windows, get_tree_ctrl_image, sample_roi, remove_empty_sub_folders, get_window_size,\
@@ -998,17 +999,19 @@ class ImportStatusDialog(wx.Dialog):
         self.Bind(wx.EVT_BUTTON, self.set_terminate, id=self.button_cancel.GetId())
 
         self.start_time = datetime.now()
+        self.rates = ''
 
     def __do_subscribe(self):
         pub.subscribe(self.update_patient, "update_patient")
         pub.subscribe(self.update_calculation, "update_calculation")
         pub.subscribe(self.update_dvh_progress, "update_dvh_progress")
         pub.subscribe(self.update_elapsed_time, "update_elapsed_time")
+        pub.subscribe(self.update_import_rates, "update_import_rates")
         pub.subscribe(self.close, "close")
 
     @staticmethod
     def do_unsubscribe():
-        for topic in ['update_patient', 'update_calculation', 'update_elapsed_time', 'close']:
+        for topic in ['update_patient', 'update_calculation', 'update_elapsed_time', 'update_import_rates', 'close']:
             pub.unsubAll(topicName=topic)
 
     def __set_properties(self):
@@ -1099,7 +1102,16 @@ class ImportStatusDialog(wx.Dialog):
         Update the elapsed time. Linked with pubsub to ImportWorker
         """
         elapsed_time = get_elapsed_time(self.start_time, datetime.now())
-        wx.CallAfter(self.label_elapsed_time.SetLabelText, "Elapsed Time: %s" % elapsed_time)
+        wx.CallAfter(self.label_elapsed_time.SetLabelText, "Elapsed Time: %s%s" % (elapsed_time, self.rates))
+
+    def update_import_rates(self, msg):
+        """
+        Update the import rates shown with the elapsed time. Linked with pubsub to StudyImporter
+        :param msg: plans_per_min and rois_per_sec values
+        :type msg: dict
+        """
+        self.rates = "    (%0.1f plans/min, %0.1f ROIs/s)" % (msg['plans_per_min'], msg['rois_per_sec'])
+        self.update_elapsed_time()
 
     def set_terminate(self, evt):
         pub.sendMessage('terminate_import')
@@ -1107,7 +1119,7 @@ class ImportStatusDialog(wx.Dialog):
 
 
 class StudyImporter:
-    def __init__(self, init_params, msg, import_uncategorized, final_plan_in_study):
+    def __init__(self, init_params, msg, import_uncategorized, final_plan_in_study, progress=None):
         """
         Intended to import a study on init, no use afterwards as no properties available
         :param init_params: initial parameters to create DICOM_Parser object
@@ -1118,6 +1130,8 @@ class StudyImporter:
         :type import_uncategorized: bool
         :param final_plan_in_study: prompts composite PTV calculations if True
         :type final_plan_in_study: bool
+        :param progress: reporter shared by each StudyImporter of an import, to throttle GUI updates and count rates
+        :type progress: ProgressReporter
         """
 
         # Store SQL time for deleting a partially imported plan
@@ -1128,6 +1142,7 @@ class StudyImporter:
         self.msg = msg
         self.import_uncategorized = import_uncategorized
         self.final_plan_in_study = final_plan_in_study
+        self.progress = progress if progress is not None else ProgressReporter()
 
         self.terminate = False
         pub.subscribe(self.set_terminate, 'terminate_import')
@@ -1136,18 +1151,18 @@ class StudyImporter:
 
     def run(self):
 
-        wx.CallAfter(pub.sendMessage, "update_patient", msg=self.msg)
-        wx.CallAfter(pub.sendMessage, "update_elapsed_time")
+        self.progress.update("update_patient", msg=self.msg)
+        self.progress.update("update_elapsed_time")
         msg = {'calculation': 'DICOM Parsing',
                'roi_num': 1,
                'roi_total': 1,
                'roi_name': '',
                'progress': 0}
-        wx.CallAfter(pub.sendMessage, "update_calculation", msg=msg)
+        self.progress.update("update_calculation", msg=msg)
 
-        parsed_data = DICOM_Parser(**self.init_params)
+        parsed_data = DICOM_Parser(progress=self.progress, contours_needed=True, **self.init_params)
 
-        wx.CallAfter(pub.sendMessage, "update_elapsed_time")
+        self.progress.update("update_elapsed_time")
 
         # Storing this now, parsed_data sometimes gets cleared prior storing actual values in this message when
         # generating this immediately before pub.sendMessage
@@ -1190,8 +1205,8 @@ class StudyImporter:
                        'roi_total': roi_total,
                        'roi_name': roi_name_map[roi_key],
                        'progress': int(100 * (roi_counter+1) / roi_total)}
-                wx.CallAfter(pub.sendMessage, "update_calculation", msg=msg)
-                wx.CallAfter(pub.sendMessage, "update_elapsed_time")
+                self.progress.update("update_calculation", msg=msg)
+                self.progress.update("update_elapsed_time")
 
                 try:
                     dvh_row = parsed_data.get_dvh_row(roi_key)
@@ -1199,6 +1214,8 @@ class StudyImporter:
                     print('Skipping roi: %s, for mrn: %s' % (roi_name_map[roi_key], mrn))
                     print('Memory Error:\n%s' % e)
                     dvh_row = None
+                self.progress.increment('rois')
+                self.send_rates()
 
                 if dvh_row:
                     roi_type = dvh_row['roi_type'][0]
@@ -1249,7 +1266,8 @@ class StudyImporter:
                 # Calculate the PTV overlap for each roi
                 tv = db_update.get_total_treatment_volume_of_study(study_uid, ptvs=parsed_data.plan_ptvs)
                 self.post_import_calc('PTV Overlap Volume', study_uid, post_import_rois,
-                                      db_update.treatment_volume_overlap, tv)
+                                      db_update.treatment_volume_overlap,
+                                      db_update.get_treatment_volume_overlap_pre_calc(tv))
 
                 # Calculate the centroid distances of roi-to-PTV for each roi
                 tv_centroid = db_update.get_treatment_volume_centroid(tv)
@@ -1276,6 +1294,14 @@ class StudyImporter:
         if self.final_plan_in_study:
             pub.sendMessage('dicom_import_move_files')
 
+        self.progress.increment('plans')
+        self.send_rates()
+
+    def send_rates(self):
+        msg = {'plans_per_min': self.progress.get_rate('plans', period=60.),
+               'rois_per_sec': self.progress.get_rate('rois')}
+        self.progress.update("update_import_rates", msg=msg)
+
     @staticmethod
     def push(data_to_import):
         """
@@ -1307,7 +1333,7 @@ class StudyImporter:
                        'roi_total': roi_total,
                        'roi_name': roi_name,
                        'progress': int(100 * roi_counter / roi_total)}
-                wx.CallAfter(pub.sendMessage, "update_calculation", msg=msg)
+                self.progress.update("update_calculation", msg=msg)
                 func(uid, roi_name, pre_calc=pre_calc)
 
     def update_ptv_data_in_db(self, tv, study_uid):
@@ -1318,14 +1344,14 @@ class StudyImporter:
                    'roi_total': 1,
                    'roi_name': 'PTV',
                    'progress': 0}
-            wx.CallAfter(pub.sendMessage, "update_calculation", msg=msg)
+            self.progress.update("update_calculation", msg=msg)
 
             # Update PTV geometric data
             db_update.update_ptv_data(tv, study_uid)
 
             # Update progress dialog
             msg['roi_num'], msg['progress'] = 1, 100
-            wx.CallAfter(pub.sendMessage, "update_calculation", msg=msg)
+            self.progress.update("update_calculation", msg=msg)
 
     def delete_partially_updated_plan(self):
         """
@@ -1382,6 +1408,7 @@ class ImportWorker(Thread):
         self.dose_sum_save_file_names = self.get_dose_sum_save_file_names()
         self.move_msg_queue = []
         self.terminate = False
+        self.progress = None
 
         self.__do_subscribe()
 
@@ -1407,6 +1434,8 @@ class ImportWorker(Thread):
     def close(self):
         self.delete_dose_sum_files()
         remove_empty_sub_folders(self.start_path)
+        if self.progress is not None:
+            self.progress.flush()
         pub.sendMessage("close")
 
     def run_dose_sum(self):
@@ -1416,6 +1445,7 @@ class ImportWorker(Thread):
         pool.close()
 
     def run_import(self):
+        self.progress = ProgressReporter()  # started after dose summation, so rates only include the import
         queue = self.import_queue
         worker = Thread(target=self.import_target, args=[queue])
         worker.setDaemon(True)
@@ -1426,7 +1456,7 @@ class ImportWorker(Thread):
         while queue.qsize():
             parameters = queue.get()
             if not self.terminate:
-                StudyImporter(*parameters)
+                StudyImporter(*parameters, progress=self.progress)
             queue.task_done()
 
     def get_dose_file_sets(self):
@@ -12,14 +12,18 @@ Classes to view and calculate Machine Learning predictions
 
 import wx
 import numpy as np
+from multiprocessing import cpu_count
+from threading import Thread, Event
+from sklearn.base import clone
 from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import train_test_split, GridSearchCV, KFold, ParameterGrid, ParameterSampler
 from sklearn.svm import SVR
 from sklearn.tree import DecisionTreeRegressor
 from dvha.dialogs.export import save_data_to_file
 from dvha.options import DefaultOptions
 from dvha.paths import MODELS_DIR
 from dvha.models.plot import PlotMachineLearning, PlotFeatureImportance
+from dvha.tools.errors import MachineLearningCancelled
 from dvha.tools.stats import MultiVariableRegression
 from dvha.tools.utilities import set_msw_background_color, get_window_size, load_object_from_file, set_frame_icon
 
@@ -36,6 +40,8 @@ class MachineLearningFrame(wx.Frame):
         self.include_test_data = include_test_data
 
         self.reg = None
+        self.worker = None
+        self.search_cache = {}
         self.plot = PlotMachineLearning(self, ml_type=self.title, ml_type_short=self.ml_type_short,
                                         include_test_data=include_test_data, **self.data)
 
@@ -61,7 +67,21 @@ class MachineLearningFrame(wx.Frame):
                                    'random_state': self.to_int_or_none,
                                    'shuffle': self.to_bool}
 
+        self.search_input = {'search_type': wx.ComboBox(self, wx.ID_ANY, choices=["Grid", "Random"],
+                                                        style=wx.CB_DROPDOWN | wx.CB_READONLY),
+                             'cv': wx.TextCtrl(self, wx.ID_ANY, "5"),
+                             'n_iter': wx.TextCtrl(self, wx.ID_ANY, "10")}
+        self.search_defaults = {'search_type': 'Grid',
+                                'cv': 5,
+                                'n_iter': 10}
+        self.search_getters = {'search_type': self.to_str,
+                               'cv': self.to_int,
+                               'n_iter': self.to_int}
+        self.label_search_score = wx.StaticText(self, wx.ID_ANY, "Best CV MSE:")
+
         self.button_calculate = wx.Button(self, wx.ID_ANY, "Calculate")
+        self.button_search = wx.Button(self, wx.ID_ANY, "Search")
+        self.gauge = wx.Gauge(self, wx.ID_ANY, 100)
         self.button_importance = wx.Button(self, wx.ID_ANY, "Importance Plot")
         self.button_export_data = wx.Button(self, wx.ID_ANY, "Export Data")
         self.button_save_figure = wx.Button(self, wx.ID_ANY, "Save Figure")
@@ -71,11 +91,13 @@ class MachineLearningFrame(wx.Frame):
 
     def do_bind(self):
         self.Bind(wx.EVT_BUTTON, self.on_calculate, id=self.button_calculate.GetId())
+        self.Bind(wx.EVT_BUTTON, self.on_search, id=self.button_search.GetId())
         self.Bind(wx.EVT_BUTTON, self.on_feature_importance, id=self.button_importance.GetId())
         self.Bind(wx.EVT_BUTTON, self.on_export, id=self.button_export_data.GetId())
         self.Bind(wx.EVT_BUTTON, self.on_save_figure, id=self.button_save_figure.GetId())
         self.Bind(wx.EVT_BUTTON, self.on_save_model, id=self.button_save_model.GetId())
         self.Bind(wx.EVT_SIZE, self.on_resize)
+        self.Bind(wx.EVT_CLOSE, self.on_close)
 
     def set_properties(self):
         self.SetTitle(self.title)
@@ -89,12 +111,17 @@ class MachineLearningFrame(wx.Frame):
         for key, input_obj in self.data_split_input.items():
             input_obj.SetToolTip(DATA_SPLIT_TOOL_TIPS[key])
 
+        for key, input_obj in self.search_input.items():
+            input_obj.SetToolTip(SEARCH_TOOL_TIPS[key])
+        self.button_search.SetToolTip(SEARCH_TOOL_TIPS['search'])
+
     def do_layout(self):
         sizer_wrapper = wx.BoxSizer(wx.HORIZONTAL)
         sizer_side_bar = wx.BoxSizer(wx.VERTICAL)
         sizer_actions = wx.StaticBoxSizer(wx.StaticBox(self, wx.ID_ANY, "Actions"), wx.VERTICAL)
         sizer_param = wx.StaticBoxSizer(wx.StaticBox(self, wx.ID_ANY, "Parameters"), wx.VERTICAL)
         sizer_split_param = wx.StaticBoxSizer(wx.StaticBox(self, wx.ID_ANY, "Data Split"), wx.VERTICAL)
+        sizer_search_param = wx.StaticBoxSizer(wx.StaticBox(self, wx.ID_ANY, "Hyper-Parameter Search"), wx.VERTICAL)
 
         variables = list(self.input)
         variables.sort()
@@ -113,7 +140,18 @@ class MachineLearningFrame(wx.Frame):
             sizer_split_param.Add(sizer_split_input[variable], 1, wx.EXPAND | wx.ALL, 2)
         sizer_side_bar.Add(sizer_split_param, 0, wx.ALL | wx.EXPAND, 5)
 
+        search_variables = ['search_type', 'cv', 'n_iter']
+        sizer_search_input = {variable: wx.BoxSizer(wx.HORIZONTAL) for variable in search_variables}
+        for variable in search_variables:
+            sizer_search_input[variable].Add(wx.StaticText(self, wx.ID_ANY, "%s:\t" % variable), 0, wx.EXPAND, 0)
+            sizer_search_input[variable].Add(self.search_input[variable], 1, wx.EXPAND, 0)
+            sizer_search_param.Add(sizer_search_input[variable], 1, wx.EXPAND | wx.ALL, 2)
+        sizer_search_param.Add(self.button_search, 0, wx.EXPAND | wx.ALL, 2)
+        sizer_search_param.Add(self.label_search_score, 0, wx.EXPAND | wx.ALL, 2)
+        sizer_side_bar.Add(sizer_search_param, 0, wx.ALL | wx.EXPAND, 5)
+
         sizer_actions.Add(self.button_calculate, 1, wx.EXPAND | wx.LEFT | wx.RIGHT | wx.TOP, 5)
+        sizer_actions.Add(self.gauge, 0, wx.EXPAND | wx.LEFT | wx.RIGHT | wx.BOTTOM, 5)
         sizer_actions.Add(self.button_importance, 1, wx.EXPAND | wx.LEFT | wx.RIGHT | wx.TOP, 5)
         sizer_actions.Add(self.button_export_data, 1, wx.EXPAND | wx.LEFT | wx.RIGHT, 5)
         sizer_actions.Add(self.button_save_figure, 1, wx.EXPAND | wx.LEFT | wx.RIGHT, 5)
@@ -148,6 +186,8 @@ class MachineLearningFrame(wx.Frame):
             input_obj.SetValue(self.to_str_for_gui(self.defaults[variable]))
         for variable, input_obj in self.data_split_input.items():
             input_obj.SetValue(self.to_str_for_gui(self.data_split_defaults[variable]))
+        for variable, input_obj in self.search_input.items():
+            input_obj.SetValue(self.to_str_for_gui(self.search_defaults[variable]))
 
     @property
     def input_parameters(self):
@@ -158,11 +198,83 @@ class MachineLearningFrame(wx.Frame):
         for variable, value in input_parameters.items():
             self.input[variable].SetValue(str(value))
 
+    @property
+    def model_parameters(self):
+        """
+        :return: non-default parameters of the current model, the inputs may have been edited or hold search candidates
+        :rtype: dict
+        """
+        if self.reg is None:
+            return {}
+        regressor_defaults = self.regressor().get_params()
+        return {variable: value for variable, value in self.reg.get_params().items()
+                if variable in self.input and value != regressor_defaults.get(variable)}
+
     @property
     def data_split_parameters(self):
         return {variable: self.get_param(variable) for variable in self.data_split_input.keys()
                 if self.get_param(variable) != self.data_split_defaults[variable]}
 
+    def get_search_param(self, variable):
+        try:
+            return self.search_getters[variable](self.search_input[variable].GetValue())
+        except Exception:
+            return self.search_defaults[variable]
+
+    def get_param_candidates(self, variable):
+        """
+        :param variable: a key of self.input
+        :type variable: str
+        :return: each comma-separated value of the input, converted with its getter
+        :rtype: list
+        """
+        candidates = []
+        for value in self.input[variable].GetValue().split(','):
+            try:
+                value = self.getters[variable](value.strip())
+            except Exception:
+                value = self.defaults[variable]
+            if value not in candidates:
+                candidates.append(value)
+        return candidates
+
+    @property
+    def search_parameters(self):
+        """
+        :return: parameters with more than one candidate value (param_grid), and all other non-default parameters
+        :rtype: tuple
+        """
+        param_grid, fixed_parameters = {}, {}
+        for variable in self.input.keys():
+            candidates = self.get_param_candidates(variable)
+            if len(candidates) > 1:
+                param_grid[variable] = candidates
+            elif candidates[0] != self.defaults[variable]:
+                fixed_parameters[variable] = candidates[0]
+        return param_grid, fixed_parameters
+
+    def get_search_data(self, cv):
+        """
+        The training/testing split and the cross-validation folds of the training data are cached, so that repeated
+        searches with the same data split parameters are compared on the same data
+        :param cv: number of folds
+        :type cv: int
+        :return: split_data (output of train_test_split), X_train, y_train, and folds (train and test indices)
+        :rtype: dict
+        """
+        split_parameters = self.data_split_parameters
+        key = (tuple(sorted(split_parameters.items())), cv)
+        if key not in self.search_cache:
+            indices = list(range(len(self.data['y'])))
+            split_data = train_test_split(self.data['X'], indices, **split_parameters)
+            X_train = np.ascontiguousarray(split_data[0], dtype=float)
+            y_train = np.array([self.data['y'][i] for i in split_data[2]], dtype=float)
+            folds = list(KFold(n_splits=cv, shuffle=True,
+                               random_state=split_parameters.get('random_state')).split(X_train))
+            self.search_cache[key] = {'split_data': split_data, 'X_train': X_train, 'y_train': y_train,
+                                      'folds': folds}
+        return self.search_cache[key]
+
     def set_data_split_parameters(self, data_split_input):
         for variable, value in data_split_input.keys():
             self.data_split_input[variable].SetValue(str(value))
@@ -243,24 +355,139 @@ class MachineLearningFrame(wx.Frame):
             return 'None'
         return str(value)
 
-    @property
-    def plot_data(self):
+    def do_regression(self):
+        """
+        Train the regressor in a MachineLearningWorker, the plot is updated by on_training_complete
+        """
+        self.cancel_regression()
+        multiple_values = sorted([variable for variable in self.input if len(self.get_param_candidates(variable)) > 1])
+        if multiple_values:
+            wx.MessageBox("Multiple values were entered for %s.\nEnter a single value of each parameter to Calculate, "
+                          "or use Search to compare them." % ', '.join(multiple_values), 'Error!',
+                          wx.OK | wx.OK_DEFAULT | wx.ICON_WARNING)
+            return
         try:
-            self.reg = self.regressor(**self.input_parameters)
-            return MachineLearningPlotData(self.data['X'], self.data['y'], self.reg, **self.data_split_parameters)
+            reg = self.regressor(**self.input_parameters)
         except Exception as e:
             wx.MessageBox(str(e), 'Error!',
                           wx.OK | wx.OK_DEFAULT | wx.ICON_WARNING)
+            return
+        self.set_busy(self.button_calculate)
+        # self.reg is replaced in on_training_complete, so it is always a trained model
+        self.worker = MachineLearningWorker(self.data['X'], self.data['y'], reg, self.data_split_parameters,
+                                            self.on_training_complete, self.on_training_progress)
+
+    def do_search(self):
+        """
+        Cross-validated hyper-parameter search in a MachineLearningSearchWorker, comma-separated parameter inputs are
+        the candidate values
+        """
+        self.cancel_regression()
+        try:
+            param_grid, fixed_parameters = self.search_parameters
+            reg = self.regressor(**fixed_parameters)
+            search_data = self.get_search_data(self.get_search_param('cv'))
+        except Exception as e:
+            wx.MessageBox(str(e), 'Error!',
+                          wx.OK | wx.OK_DEFAULT | wx.ICON_WARNING)
+            return
+        self.set_busy(self.button_search)
+        self.label_search_score.SetLabel("Best CV MSE:")
+        self.label_search_score.SetToolTip('')
+        self.worker = MachineLearningSearchWorker(self.data['X'], self.data['y'], reg, param_grid, search_data,
+                                                  self.on_training_complete, self.on_training_progress,
+                                                  self.on_search_result, random=self.is_random_search,
+                                                  n_iter=self.get_search_param('n_iter'),
+                                                  random_state=self.data_split_parameters.get('random_state'))
 
-    def do_regression(self):
-        self.reg = self.regressor(**self.input_parameters)
-        return MachineLearningPlotData(self.data['X'], self.data['y'], self.reg, **self.data_split_parameters)
+    @property
+    def is_random_search(self):
+        return self.get_search_param('search_type') == 'Random'
+
+    def set_busy(self, button=None):
+        """
+        :param button: the button used to start training is changed to Cancel, or None to reset both buttons
+        :type button: wx.Button
+        """
+        self.gauge.SetValue(0)
+        self.button_calculate.SetLabel(["Calculate", "Cancel"][button is self.button_calculate])
+        self.button_search.SetLabel(["Search", "Cancel"][button is self.button_search])
+
+    def cancel_regression(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker = None
+            self.set_busy()
 
     def on_calculate(self, evt):
-        data = self.plot_data
-        if data is not None:
+        if self.worker is not None:
+            self.cancel_regression()
+        else:
+            self.do_regression()
+
+    def on_search(self, evt):
+        if self.worker is not None:
+            self.cancel_regression()
+        else:
+            self.do_search()
+
+    def on_search_result(self, worker, data, parameters, score):
+        """
+        Display the best model of a search so far
+        :param worker: the search worker, results of cancelled or replaced workers are ignored
+        :type worker: MachineLearningSearchWorker
+        :param data: best model, trained on all training data
+        :type data: MachineLearningPlotData
+        :param parameters: non-default parameters of the best model
+        :type parameters: dict
+        :param score: mean squared error of the cross-validation
+        :type score: float
+        """
+        try:
+            if worker is not self.worker:
+                return
+        except RuntimeError:  # frame closed
+            return
+        self.reg = data.reg  # the candidate values in the inputs are kept so the search can be repeated or refined
+        self.label_search_score.SetLabel("Best CV MSE: %0.4g" % score)
+        self.label_search_score.SetToolTip(', '.join(["%s: %s" % (variable, value)
+                                                      for variable, value in sorted(parameters.items())]))
+        self.plot.update_data(data)
+
+    def on_training_progress(self, worker, progress):
+        try:
+            if worker is self.worker:
+                self.gauge.SetValue(int(100 * progress))
+        except RuntimeError:  # frame closed
+            pass
+
+    def on_training_complete(self, worker, data, error=None):
+        """
+        :param worker: the worker that trained the model, results of cancelled or replaced workers are ignored
+        :type worker: MachineLearningWorker
+        :param data: trained model, predictions, and split data
+        :type data: MachineLearningPlotData
+        :param error: the error message if training failed
+        :type error: str
+        """
+        try:
+            if worker is not self.worker:
+                return
+        except RuntimeError:  # frame closed
+            return
+        self.worker = None
+        self.set_busy()
+        if error is not None:
+            wx.MessageBox(error, 'Error!',
+                          wx.OK | wx.OK_DEFAULT | wx.ICON_WARNING)
+        elif data is not None:
+            self.reg = data.reg
             self.plot.update_data(data)
 
+    def on_close(self, evt):
+        self.cancel_regression()
+        evt.Skip()
+
     def redraw_plot(self):
         self.plot.redraw_plot()
 
@@ -282,13 +509,15 @@ class MachineLearningFrame(wx.Frame):
         self.plot.save_figure_dlg(self, title, attr_dicts=attr_dicts)
 
     def on_save_model(self, evt):
+        if self.worker is not None or self.reg is None:  # model is still training
+            return
         data = {'y_variable': self.plot.y_variable,
                 'regression': self.reg,
                 'regressor': self.regressor,
                 'tool_tips': self.tool_tips,
                 'x_variables': self.plot.x_variables,
                 'title': self.title,
-                'input_parameters': self.input_parameters,
+                'input_parameters': self.model_parameters,
                 'data_split': self.data_split_parameters,
                 'version': DefaultOptions().VERSION}
         save_data_to_file(self, 'Save Model', data,
@@ -298,7 +527,7 @@ class MachineLearningFrame(wx.Frame):
         self.set_properties()
         self.do_layout()
         self.Show()
-        self.on_calculate(None)
+        self.do_regression()
 
     @property
     def frame_size(self):
@@ -309,6 +538,8 @@ class MachineLearningFrame(wx.Frame):
         return ''.join([s[0] for s in self.title.split(' ')]).upper()
 
     def on_feature_importance(self, evt):
+        if self.worker is not None or self.reg is None:  # model is still training
+            return
         title = "Importance Figure for %s (%s)" % (self.title, self.data['y_variable'])
         plot_title = "%s Feature Importances for %s" % (self.title, self.data['y_variable'])
         self.feature_importance_dlg = FeatureImportanceFrame(self.data['options'], self.data['x_variables'],
@@ -780,6 +1011,16 @@ DATA_SPLIT_TOOL_TIPS = {'test_size': "float, int, or None\n"
                                    " must be None."}
 
 
+SEARCH_TOOL_TIPS = {'search_type': "Grid: evaluate every combination of the candidate parameter values.\n"
+                                   "Random: evaluate n_iter random combinations.",
+                    'cv': "int\nNumber of folds of the k-fold cross-validation of the training data.",
+                    'n_iter': "int\nNumber of parameter combinations evaluated by a random search.",
+                    'search': "Enter comma-separated candidate values for any parameters (e.g., n_estimators: "
+                              "50, 100, 200), then evaluate each combination with k-fold cross-validation of the "
+                              "training data. The model with the lowest mean squared error is plotted, and its "
+                              "parameters are entered so it may be saved."}
+
+
 ALGORITHMS = {'Random Forest': {'regressor': RandomForestRegressor,
                                 'tool_tips': RF_TOOL_TIPS,
                                 'frame': RandomForestFrame},
@@ -794,15 +1035,34 @@ ALGORITHMS = {'Random Forest': {'regressor': RandomForestRegressor,
                                 'frame': DecisionTreeFrame}}
 
 
+TRAINING_STAGES = 20  # progress updates while training random forests
+
+
 class MachineLearningPlotData:
-    def __init__(self, X, y, reg, do_training=True, **kwargs):
+    def __init__(self, X, y, reg, do_training=True, callback=None, cancel_event=None, split_data=None, **kwargs):
+        """
+        :param X: independent data
+        :type X: np.array
+        :param y: dependent data
+        :type y: list
+        :param reg: an sklearn regressor
+        :param do_training: if False, reg is already trained
+        :type do_training: bool
+        :param callback: optional function called with the fraction of training completed
+        :param cancel_event: if set during training, MachineLearningCancelled is raised
+        :type cancel_event: Event
+        :param split_data: optionally provide the output of train_test_split(X, indices), rather than splitting again
+        :type split_data: list
+        :param kwargs: keyword arguments for sklearn.model_selection.train_test_split
+        """
         self.reg = reg
         self.split_args = kwargs
 
         indices = list(range(len(y)))
 
         # split the data for training and testing
-        split_data = train_test_split(X, indices, **kwargs)
+        if split_data is None:
+            split_data = train_test_split(X, indices, **kwargs)
         self.X = {'data': X, 'train': split_data[0], 'test': split_data[1]}
         self.indices = {'data': indices, 'train': split_data[2], 'test': split_data[3]}
         self.y = {'data': y, 'train': [y[i] for i in split_data[2]], 'test': [y[i] for i in split_data[3]]}
@@ -810,7 +1070,7 @@ class MachineLearningPlotData:
 
         # Train model, then calculate predictions, residuals, and mse
         if do_training:
-            self.reg.fit(self.X['train'], self.y['train'])
+            fit_regressor(self.reg, self.X['train'], self.y['train'], callback=callback, cancel_event=cancel_event)
         self.predictions = {key: self.get_prediction(key) for key in self.y.keys()}
         self.residuals = {key: self.get_residual(key) for key in self.y.keys()}
         self.mse = {key: self.get_mse(key) for key in self.y.keys()}
@@ -831,6 +1091,194 @@ class MachineLearningPlotData:
         return None
 
 
+def fit_regressor(reg, X, y, callback=None, cancel_event=None):
+    """
+    Fit an sklearn regressor. Random forests are grown TRAINING_STAGES trees at a time (warm_start) and gradient
+    boosting is monitored after each stage, so that progress is reported and training can be cancelled. Regressors that
+    support n_jobs use all cores unless n_jobs was specified.
+    :param reg: an sklearn regressor
+    :param X: training data of the independent variables
+    :param y: training data of the dependent variable
+    :param callback: optional function called with the fraction of training completed
+    :param cancel_event: if set during training, MachineLearningCancelled is raised
+    :type cancel_event: Event
+    """
+    def is_cancelled():
+        return cancel_event is not None and cancel_event.is_set()
+
+    def update_progress(fraction):
+        if callback is not None:
+            callback(fraction)
+
+    params = reg.get_params()
+    if 'n_jobs' in params and params['n_jobs'] is None:
+        reg.set_params(n_jobs=-1)
+
+    if isinstance(reg, RandomForestRegressor):
+        n_estimators, warm_start = params['n_estimators'], params['warm_start']
+        stage_size = max(int(np.ceil(n_estimators / TRAINING_STAGES)), cpu_count())  # keep each core busy
+        for i, count in enumerate(range(stage_size, n_estimators + stage_size, stage_size)):
+            if is_cancelled():
+                raise MachineLearningCancelled
+            reg.set_params(n_estimators=min(count, n_estimators), warm_start=warm_start or i > 0)
+            reg.fit(X, y)
+            update_progress(min(count, n_estimators) / n_estimators)
+        reg.set_params(warm_start=warm_start)
+
+    elif isinstance(reg, GradientBoostingRegressor):
+        def monitor(stage, estimator, local_vars):
+            update_progress((stage + 1.) / params['n_estimators'])
+            return is_cancelled()  # stops training early if True
+        reg.fit(X, y, monitor=monitor)
+
+    else:
+        reg.fit(X, y)
+        update_progress(1.)
+
+    if is_cancelled():
+        raise MachineLearningCancelled
+
+
+class MachineLearningWorker(Thread):
+    """
+    Create a thread to train a regressor with MachineLearningPlotData, results are sent to the main thread with
+    wx.CallAfter
+    """
+    def __init__(self, X, y, reg, split_args, complete_callback, progress_callback=None):
+        """
+        :param X: independent data
+        :param y: dependent data
+        :param reg: an sklearn regressor
+        :param split_args: keyword arguments for sklearn.model_selection.train_test_split
+        :type split_args: dict
+        :param complete_callback: called with this worker, the MachineLearningPlotData, and an error message or None
+        :param progress_callback: called with this worker and the fraction of training completed
+        """
+        Thread.__init__(self)
+        self.daemon = True  # do not block closing the app
+
+        self.X, self.y, self.reg = X, y, reg
+        self.split_args = split_args
+        self.complete_callback = complete_callback
+        self.progress_callback = progress_callback
+        self.cancel_event = Event()
+        self.last_progress = None
+
+        self.start()  # start the thread
+
+    def run(self):
+        data, error = None, None
+        try:
+            data = MachineLearningPlotData(self.X, self.y, self.reg, callback=self.update_progress,
+                                           cancel_event=self.cancel_event, **self.split_args)
+        except MachineLearningCancelled:
+            return
+        except Exception as e:
+            error = str(e)
+        if not self.cancel_event.is_set():
+            wx.CallAfter(self.complete_callback, self, data, error)
+
+    def update_progress(self, fraction):
+        progress = int(100 * fraction)
+        if self.progress_callback is not None and progress != self.last_progress and not self.cancel_event.is_set():
+            self.last_progress = progress
+            wx.CallAfter(self.progress_callback, self, fraction)
+
+    def cancel(self):
+        """
+        Stop training at the next stage, no results will be sent
+        """
+        self.cancel_event.set()
+
+
+class MachineLearningSearchWorker(MachineLearningWorker):
+    """
+    Create a thread for a cross-validated grid or random search of hyper-parameters. Candidates are evaluated in batches
+    with GridSearchCV across a process pool (n_jobs=-1), and the best model so far is sent after each batch
+    """
+    def __init__(self, X, y, reg, param_grid, search_data, complete_callback, progress_callback, result_callback,
+                 random=False, n_iter=10, random_state=None):
+        """
+        :param X: independent data
+        :param y: dependent data
+        :param reg: an sklearn regressor, with the parameters not included in param_grid
+        :param param_grid: candidate values of each parameter
+        :type param_grid: dict
+        :param search_data: cached data split and cross-validation folds, see MachineLearningFrame.get_search_data
+        :type search_data: dict
+        :param complete_callback: called with this worker, the best MachineLearningPlotData, and an error message or None
+        :param progress_callback: called with this worker and the fraction of candidates evaluated
+        :param result_callback: called with this worker, MachineLearningPlotData, parameters, and mse of a new best
+        :param random: if True, evaluate n_iter random candidates rather than all combinations
+        :type random: bool
+        :param n_iter: number of candidates of a random search
+        :type n_iter: int
+        :param random_state: seed for the random search
+        :type random_state: int
+        """
+        self.param_grid = param_grid
+        self.search_data = search_data
+        self.result_callback = result_callback
+        self.random = random
+        self.n_iter = n_iter
+        self.random_state = random_state
+        MachineLearningWorker.__init__(self, X, y, reg, {}, complete_callback, progress_callback)
+
+    @property
+    def candidates(self):
+        grid = ParameterGrid(self.param_grid)
+        if self.random and self.n_iter < len(grid):
+            return list(ParameterSampler(self.param_grid, self.n_iter, random_state=self.random_state))
+        return list(grid)
+
+    def run(self):
+        data, error = None, None
+        try:
+            data = self.search()
+        except MachineLearningCancelled:
+            return
+        except Exception as e:
+            error = str(e)
+        if not self.cancel_event.is_set():
+            wx.CallAfter(self.complete_callback, self, data, error)
+
+    def search(self):
+        X_train, y_train = self.search_data['X_train'], self.search_data['y_train']
+
+        # the process pool runs one fit per core, so each fit uses a single core
+        estimator = clone(self.reg)
+        if estimator.get_params().get('n_jobs', False) is None:
+            estimator.set_params(n_jobs=1)
+
+        candidates = self.candidates
+        batch_size = cpu_count()
+        best_score, data = None, None
+        for start in range(0, len(candidates), batch_size):
+            if self.cancel_event.is_set():
+                raise MachineLearningCancelled
+            batch = candidates[start:start + batch_size]
+            search = GridSearchCV(estimator, [{key: [value] for key, value in candidate.items()} for candidate in batch],
+                                  scoring='neg_mean_squared_error', cv=self.search_data['folds'], n_jobs=-1,
+                                  refit=False)
+            search.fit(X_train, y_train)
+
+            index = int(np.argmax(search.cv_results_['mean_test_score']))
+            score = -search.cv_results_['mean_test_score'][index]
+            if best_score is None or score < best_score:
+                best_score = score
+                parameters = batch[index]
+                reg = clone(self.reg).set_params(**parameters)
+                fit_regressor(reg, X_train, y_train, cancel_event=self.cancel_event)
+                data = MachineLearningPlotData(self.X, self.y, reg, do_training=False,
+                                               split_data=self.search_data['split_data'])
+                if not self.cancel_event.is_set():
+                    wx.CallAfter(self.result_callback, self, data, parameters, score)
+
+            self.update_progress(float(start + len(batch)) / len(candidates))
+
+        return data
+
+
 class FeatureImportanceFrame(wx.Frame):
     def __init__(self, options, x_variables, feature_importances, frame_title, plot_title):
         wx.Frame.__init__(self, None)
@@ -956,6 +1404,9 @@ class MachineLearningModelViewer:
         for variable, input_obj in self.ml_frame.data_split_input.items():
             input_obj.Disable()
         self.ml_frame.button_calculate.Disable()
+        self.ml_frame.button_search.Disable()
+        for variable, input_obj in self.ml_frame.search_input.items():
+            input_obj.Disable()
         self.ml_frame.button_save_model.Disable()
 
     def __set_X_and_y_data(self):
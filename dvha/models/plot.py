@@ -27,7 +27,7 @@ from scipy.stats import ttest_ind, ranksums, normaltest
 from dvha.dialogs.export import save_data_to_file
 from dvha.tools.errors import PlottingMemoryError, ErrorDialog
 from dvha.tools.utilities import collapse_into_single_dates, moving_avg, is_windows, FIG_WILDCARDS
-from dvha.tools.stats import MultiVariableRegression, get_control_limits
+from dvha.tools.stats import MultiVariableRegression, get_control_limits, is_missing, to_float_array
 from dvha.paths import TEMP_DIR
 from math import pi
 from copy import deepcopy
@@ -233,19 +233,19 @@ class Plot:
     @staticmethod
     def clean_data(*data, mrn=None, uid=None, dates=None):
         """
-        Data used for statistical analysis in Regression and Control Charts requires no 'None' values and the same
-        number of points for each variable.  To mitigate this, clean_data will find all studies that have any 'None'
-        values and return data without these studies
+        Data used for statistical analysis in Regression and Control Charts requires no missing values and the same
+        number of points for each variable.  To mitigate this, clean_data will find all studies that have any missing
+        values ('None' or np.nan) and return data without these studies
         :param data: any number of variables, each being a list of values
         :param mrn: mrns in same order as data
         :param uid: study instance uids in same order data
         :param dates: sim study dates in same order as data
-        :return: data only including studies with no 'None' values
+        :return: data only including studies with no missing values
         :rtype: tuple
         """
         bad_indices = []
         for var in data:
-            bad_indices.extend([i for i, value in enumerate(var) if value == 'None'])
+            bad_indices.extend([i for i, value in enumerate(var) if is_missing(value)])
         bad_indices = set(bad_indices)
 
         ans = [[value for i, value in enumerate(var) if i not in bad_indices] for var in data]
@@ -404,17 +404,14 @@ class PlotStatDVH(Plot):
         self.x = dvh.x_data[0]
         self.stat_dvhs = dvh.get_standard_stat_dvh()
 
-        data = {'dvh': deepcopy(dvh.get_cds_data()),
+        data = {'dvh': dvh.get_cds_data(),
                 'stats': {key: self.stat_dvhs[key] for key in ['max', 'median', 'mean', 'min']},
                 'patch': {'x': self.x, 'y1': self.stat_dvhs['q3'], 'y2': self.stat_dvhs['q1']}}
 
-        # Add additional data to dvh data
-        data['dvh']['x'] = dvh.x_data
-        data['dvh']['y'] = dvh.y_data
-        # data['dvh']['mrn'] = dvh.mrn
-        # data['dvh']['roi_name'] = dvh.roi_name
+        # Add additional data to dvh data, individual DVHs are down-sampled and sent to bokeh as numpy arrays
+        data['dvh']['x'], data['dvh']['y'] = dvh.get_decimated_xy(self.options.DVH_LOD_TOLERANCE)
         data['dvh']['color'] = [color for j, color in zip(range(dvh.count), itertools.cycle(palette))]
-        data['dvh']['group'] = [1] * len(dvh.x_data)
+        data['dvh']['group'] = [1] * dvh.count
 
         # Add x-axis to stats dvhs
         data['stats']['x'] = self.x
@@ -433,42 +430,44 @@ class PlotStatDVH(Plot):
 
     def update_plot_2(self, dvh_2):
 
+        self.set_figure_dimensions()
+
         self.dvh_2 = dvh_2
         self.x_2 = dvh_2.x_data[0]
         self.stat_dvhs_2 = dvh_2.get_standard_stat_dvh()
 
-        dvh = self.source['dvh'].data
-        if 2 in dvh['group']:
-            for row in range(len(dvh['x']))[::-1]:
-                group = dvh['group'][row]
-                if group == 2:
-                    for key in list(dvh):
-                        dvh[key].pop(row)
-
-        data = {'dvh': dvh,
-                'dvh_2': deepcopy(dvh_2.get_cds_data()),
-                'stats_2': {key: self.stat_dvhs_2[key] for key in ['max', 'median', 'mean', 'min']},
+        data = {'stats_2': {key: self.stat_dvhs_2[key] for key in ['max', 'median', 'mean', 'min']},
                 'patch_2': {'x': self.x_2, 'y1': self.stat_dvhs_2['q3'], 'y2': self.stat_dvhs_2['q1']}}
 
-        # Add additional data to dvh data
-        for key, value in data['dvh_2'].items():
-            data['dvh'][key].extend(value)
-
-        data['dvh']['x'].extend(dvh_2.x_data)
-        data['dvh']['y'].extend(dvh_2.y_data)
-        data['dvh']['color'].extend([color for j, color in zip(range(dvh_2.count), itertools.cycle(palette))])
-        data['dvh']['group'].extend([2] * len(dvh_2.x_data))
-
         # Add x-axis to stats dvhs
         data['stats_2']['x'] = self.x_2
 
         # update bokeh CDS
         for key, obj in data.items():
-            if key != 'dvh_2':
-                self.source[key].data = obj
+            self.source[key].data = obj
+
+        self.stream_dvhs_2(dvh_2)
 
         self.update_bokeh_layout_in_wx_python()
 
+    def stream_dvhs_2(self, dvh_2):
+        """
+        Replace the group 2 rows of self.source['dvh'] without rebuilding the group 1 rows, which always come first
+        :param dvh_2: dvh data object of group 2
+        :type dvh_2: DVH
+        """
+        source = self.source['dvh']
+        if 2 in source.data['group']:
+            group_1_count = source.data['group'].index(2)
+            for values in source.data.values():
+                del values[group_1_count:]
+
+        data = dvh_2.get_cds_data()
+        data['x'], data['y'] = dvh_2.get_decimated_xy(self.options.DVH_LOD_TOLERANCE)
+        data['color'] = [color for j, color in zip(range(dvh_2.count), itertools.cycle(palette))]
+        data['group'] = [2] * dvh_2.count
+        source.stream(data)
+
     def get_csv(self, include_summary=True, include_dvhs=True):
         """
         Get a csv string of DVH data used for data export
@@ -500,16 +499,32 @@ class PlotStatDVH(Plot):
                 clean_mrn = mrn.replace(',', '^')
                 clean_uid = data['study_instance_uid'][i].replace(',', '^')
                 clean_roi = data['roi_name'][i].replace(',', '^')
+                y_data = self.get_full_resolution_y(i)
                 dvh_data.append("%s,%s,%s,,%s" %
-                                (clean_mrn, clean_uid, clean_roi, ','.join(str(y) for y in data['y'][i])))
-                if len(data['y'][i]) < dose_bin_count:
+                                (clean_mrn, clean_uid, clean_roi, ','.join(str(y) for y in y_data)))
+                if len(y_data) < dose_bin_count:
                     dvh_data[-1] = dvh_data[-1] + ','.join(['0'] * bin_difference)
 
         return '\n'.join(summary + dvh_data)
 
+    def get_full_resolution_y(self, row):
+        """
+        The DVHs in self.source['dvh'] are down-sampled for plotting, get the y values of a row from its DVH object
+        :param row: index of self.source['dvh'].data
+        :type row: int
+        :return: y values of every dose bin
+        :rtype: list
+        """
+        groups = self.source['dvh'].data['group']
+        dvh = [self.dvh, self.dvh_2][groups[row] - 1]
+        return dvh.dvh[:, row - groups.index(groups[row])].tolist()
+
     def apply_options(self):
         super().apply_options()
 
+        # bokeh only draws every LOD_FACTOR-th DVH while panning or zooming
+        self.figure.lod_factor = self.options.LOD_FACTOR
+
         self.dvhs_renderer.glyph.line_width = self.options.DVH_LINE_WIDTH
         self.dvhs_renderer.glyph.line_dash = self.options.DVH_LINE_DASH
 
@@ -552,6 +567,7 @@ class PlotTimeSeries(Plot):
                              'trend': ColumnDataSource(data=dict(x=[], y=[], mrn=[])),
                              'bound': ColumnDataSource(data=dict(x=[], mrn=[], upper=[], avg=[], lower=[])),
                              'patch': ColumnDataSource(data=dict(x=[], y=[]))} for key in [1, 2]}
+        self.trend_data = {key: None for key in [1, 2]}
         self.y_axis_label = ''
 
         self.__add_plot_data()
@@ -638,6 +654,7 @@ class PlotTimeSeries(Plot):
     def clear_sources(self):
         for key in list(self.source[1]):
             self.clear_source(key)
+        self.trend_data = {key: None for key in [1, 2]}
 
     def update_plot(self, data):
 
@@ -659,12 +676,18 @@ class PlotTimeSeries(Plot):
 
     def update_plot_data(self, data):
         for grp, grp_data in data.items():
-            valid_indices = [i for i, value in enumerate(grp_data['y']) if value != 'None']
-            new_data = {key: [value for i, value in enumerate(grp_data[key]) if i in valid_indices]
-                        for key in ['x', 'y', 'mrn', 'uid']}
+            y = to_float_array(grp_data['y'])
+            valid_indices = np.flatnonzero(~np.isnan(y))
+            new_data = {key: [grp_data[key][i] for i in valid_indices] for key in ['x', 'mrn', 'uid']}
+            new_data['y'] = y[valid_indices].tolist()
             new_data['group'] = [grp] * len(new_data['x'])
             self.source[grp]['plot'].data = new_data
 
+            # dates are in ascending order, collapse once so trend updates only need a cumulative sum
+            x = np.array(new_data['x'], dtype='datetime64[us]')
+            self.trend_data[grp] = {'y': y[valid_indices],
+                                    'daily': collapse_into_single_dates(x, y[valid_indices])}
+
     def update_histogram(self, bin_size=10):
         width_fraction = 0.9
         for grp in [1, 2]:
@@ -680,16 +703,13 @@ class PlotTimeSeries(Plot):
 
         for grp in [1, 2]:
             x = self.source[grp]['plot'].data['x']
-            y = self.source[grp]['plot'].data['y']
-            if x and y:
+            if self.trend_data[grp] is not None and len(x):
 
-                data_collapsed = collapse_into_single_dates(x, y)
-                x_trend, y_trend = moving_avg(data_collapsed, avg_len)
+                x_trend, y_trend = moving_avg(self.trend_data[grp]['daily'], avg_len)
 
-                y_np = np.array(self.source[grp]['plot'].data['y'])
-                upper_bound = float(np.percentile(y_np, 50. + percentile / 2.))
-                average = float(np.percentile(y_np, 50))
-                lower_bound = float(np.percentile(y_np, 50. - percentile / 2.))
+                lower_bound, average, upper_bound = np.percentile(self.trend_data[grp]['y'],
+                                                                  [50. - percentile / 2., 50., 50. + percentile / 2.])
+                lower_bound, average, upper_bound = float(lower_bound), float(average), float(upper_bound)
 
                 self.source[grp]['trend'].data = {'x': x_trend,
                                                   'y': y_trend}
@@ -895,7 +915,7 @@ class PlotCorrelation(Plot):
 
         if stats_data_2 is not None:
             data_2 = stats_data_2.get_corr_matrix_data(self.options,
-                                                       included_vars=included_vars, extra_vars=extra_vars[2])
+                                                       included_vars=included_vars, extra_vars=extra_vars[2])[0]
             for key in list(data_2['source_data']['corr']):
                 data['source_data']['corr'][key].extend(data_2['source_data']['corr'][key])
 
@@ -1035,7 +1055,22 @@ class PlotRegression(Plot):
                                    self.regression_table,
                                    row(self.figure_residual_fits, self.figure_prob_plot))
 
-    def update_plot(self, plot_data, group, x_var, x_axis_title, y_axis_title):
+    def update_plot(self, plot_data, group, x_var, x_axis_title, y_axis_title, trends=None):
+        """
+        :param plot_data: output of StatsData.get_bokeh_data for each group, or None
+        :type plot_data: dict
+        :param group: the group displayed in the residual and probability plots, and in the table
+        :type group: int
+        :param x_var: independent variable
+        :type x_var: str
+        :param x_axis_title: x-axis title
+        :type x_axis_title: str
+        :param y_axis_title: y-axis title
+        :type y_axis_title: str
+        :param trends: optional x and y values of the trend line of each group (e.g., from cached regressions), only
+        the displayed group will be fit
+        :type trends: dict
+        """
         self.group = group
         self.apply_options()
         self.regression_table.columns = self.table_columns
@@ -1048,7 +1083,7 @@ class PlotRegression(Plot):
             else:
                 self.source['plot'][grp].data = plot_data[grp]
 
-        self.update_trend(x_var)
+        self.update_trend(x_var, trends=trends)
         self.figure.xaxis.axis_label = x_axis_title
         self.figure.yaxis.axis_label = y_axis_title
         self.update_bokeh_layout_in_wx_python()
@@ -1064,11 +1099,14 @@ class PlotRegression(Plot):
         self.regression_table.width = int(self.size_factor['table'][0] * float(panel_width))
         self.regression_table.height = int(self.size_factor['table'][1] * float(panel_height))
 
-    def update_trend(self, x_var):
+    def update_trend(self, x_var, trends=None):
 
         mrn, date, x_trend, y_trend = {}, {}, {}, {}
         for grp in [1, 2]:
-            if self.source['plot'][grp].data['x']:
+            if grp != self.group and trends and trends.get(grp) is not None and self.source['plot'][grp].data['x']:
+                self.reg[grp] = None
+                x_trend[grp], y_trend[grp] = trends[grp]
+            elif self.source['plot'][grp].data['x']:
                 x, y, mrn[grp], date[grp] = self.clean_data(self.source['plot'][grp].data['x'],
                                                             self.source['plot'][grp].data['y'],
                                                             mrn=self.source['plot'][grp].data['mrn'],
@@ -1370,8 +1408,10 @@ class PlotMultiVarRegression(Plot):
             return self.reg.p_values[index+1]
 
     def backward_elimination(self, threshold=0.05):
-        while self.worst_x_p_value is not None and self.worst_x_p_value > threshold:
-            self.remove_worst_p_value()
+        x_variables = self.stats_data.get_backward_elimination(self.y_variable, self.x_variables_updated,
+                                                               threshold=threshold)
+        if x_variables != self.x_variables_updated:
+            self.update_plot(self.y_variable, x_variables, self.stats_data, update_x_variables=False)
 
     def get_csv_data(self):
         csv_data = ['Multi-Variable Regression',
@@ -11,6 +11,7 @@ Class to view and calculate linear regressions
 #    available at https://github.com/cutright/DVH-Analytics
 
 import wx
+import numpy as np
 from pubsub import pub
 from dvha.tools.errors import ErrorDialog
 from dvha.models.plot import PlotRegression, PlotMultiVarRegression
@@ -189,7 +190,8 @@ class RegressionFrame:
             self.plot.update_plot(plot_data, self.group,
                                   self.combo_box_x_axis.GetValue(),
                                   stats_data[1].get_axis_title(self.x_axis),
-                                  stats_data[1].get_axis_title(self.y_axis))
+                                  stats_data[1].get_axis_title(self.y_axis),
+                                  trends={grp: self.get_trend(stats_data[grp]) for grp in [1, 2]})
 
         if self.y_axis in list(self.y_variable_nodes) and self.x_axis in list(self.x_variable_nodes[self.y_axis]):
             self.checkbox.SetValue(True)
@@ -202,6 +204,20 @@ class RegressionFrame:
         else:
             self.checkbox.Enable()
 
+    def get_trend(self, stats_data):
+        """
+        :param stats_data: the StatsData of a group
+        :type stats_data: StatsData
+        :return: x and y values of the trend line from the cached regressions of stats_data, or None
+        :rtype: tuple
+        """
+        if stats_data is not None and self.y_axis in stats_data.data:
+            regression = stats_data.get_univariate_regressions(self.y_axis).get(self.x_axis)
+            if regression is not None and regression['n'] > 1 and np.isfinite(regression['slope']):
+                x_trend = [regression['x_min'], regression['x_max']]
+                y_trend = np.add(np.multiply(x_trend, regression['slope']), regression['y_intercept'])
+                return x_trend, y_trend
+
     def spin_x(self, evt):
         new_index = len(self.choices)-1 - int(self.spin_button_x_axis.GetValue())
         self.combo_box_x_axis.SetValue(self.choices[new_index])
@@ -357,7 +373,10 @@ class RegressionFrame:
             selections = None
         choices = [choice for choice in self.combo_box_x_axis.GetItems() if choice != self.y_axis]
         choices.sort()
-        dlg = SelectRegressionVariablesDialog(self.y_axis, choices, selections=selections)
+        stats_data = self.group_data[self.group]['stats_data']
+        has_y = stats_data is not None and self.y_axis in stats_data.data
+        regressions = stats_data.get_univariate_regressions(self.y_axis) if has_y else None
+        dlg = SelectRegressionVariablesDialog(self.y_axis, choices, selections=selections, regressions=regressions)
         res = dlg.ShowModal()
 
         if res == wx.ID_OK:
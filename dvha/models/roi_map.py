@@ -757,7 +757,7 @@ class RemapROIWorker(Thread):
                 condition = "physician = '%s'" % physician
                 uids = cnx.get_unique_values('Plans', 'study_instance_uid', condition)
                 if uids:
-                    condition = "study_instance_uid in ('%s')" % "','".join(uids)
+                    condition = cnx.load_uid_table(uids)
                     variations = cnx.get_unique_values('DVHs', 'roi_name', condition)
                     msg = ["Physician (%s of %s): %s" % (physician_counter+1, physician_count, physician),
                            int(100 * physician_counter / physician_count)]
@@ -794,8 +794,9 @@ class RemapROIWorker(Thread):
         condition = "roi_name = '%s'" % variation
         roi_uids = cnx.get_unique_values('DVHs', 'study_instance_uid', condition)
         if roi_uids:
-            condition = "physician = '%s' and study_instance_uid in ('%s')" % \
-                        (physician, "','".join(roi_uids))
+            # separate from the temp_uids table loaded in run()
+            condition = "physician = '%s' and %s" % \
+                        (physician, cnx.load_uid_table(roi_uids, table_name='temp_roi_uids'))
             uids = cnx.get_unique_values('Plans', 'study_instance_uid', condition)
 
             if uids:
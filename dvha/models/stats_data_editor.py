@@ -6,7 +6,7 @@
 
 import wx
 from dvha.models.spreadsheet import Spreadsheet
-from dvha.tools.stats import sync_variables_in_stats_data_objects
+from dvha.tools.stats import sync_variables_in_stats_data_objects, is_missing
 from dvha.tools.utilities import get_window_size
 
 
@@ -134,7 +134,7 @@ class StatsSpreadsheet(Spreadsheet):
             # self.SetColMinimalWidth(col+2, 1000)
             self.SetCellValue(0, col+3, label)
             for row, value in enumerate(self.stats_data[self.group].data[label]['values']):
-                self.SetCellValue(row+1, col+3, str(value))
+                self.SetCellValue(row+1, col+3, ['%s' % value, 'None'][is_missing(value)])
 
     def update_stats_data(self):
 
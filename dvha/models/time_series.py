@@ -11,10 +11,10 @@ Class for viewing and editing the roi map, and updating the database with change
 #    available at https://github.com/cutright/DVH-Analytics
 
 import wx
-from dateutil.parser import parse as date_parser
 from dvha.db import sql_columns
 from dvha.dialogs.export import save_data_to_file
 from dvha.models.plot import PlotTimeSeries
+from dvha.tools.stats import to_float_array
 
 
 class TimeSeriesFrame:
@@ -38,8 +38,8 @@ class TimeSeriesFrame:
 
         self.parent.Bind(wx.EVT_COMBOBOX, self.combo_box_y_axis_ticker, id=self.combo_box_y_axis.GetId())
         self.parent.Bind(wx.EVT_TEXT_ENTER, self.update_plot_ticker, id=self.text_input_bin_size.GetId())
-        self.parent.Bind(wx.EVT_TEXT_ENTER, self.update_plot_ticker, id=self.text_input_lookback_distance.GetId())
-        self.parent.Bind(wx.EVT_TEXT_ENTER, self.update_plot_ticker, id=self.text_inputs_percentile.GetId())
+        self.parent.Bind(wx.EVT_TEXT_ENTER, self.update_trend_ticker, id=self.text_input_lookback_distance.GetId())
+        self.parent.Bind(wx.EVT_TEXT_ENTER, self.update_trend_ticker, id=self.text_inputs_percentile.GetId())
 
         self.__set_properties()
         self.__do_layout()
@@ -121,21 +121,12 @@ class TimeSeriesFrame:
         data = {}
         for grp, stats_data in self.stats_data.items():
             if stats_data:
-                y_data = stats_data.data[y_axis_selection]['values']
-                x_data = stats_data.sim_study_dates
-
-                sort_index = sorted(range(len(x_data)), key=lambda k: x_data[k])
-                x_values_sorted, y_values_sorted, mrn_sorted, uid_sorted = [], [], [], []
-
-                for s in range(len(x_data)):
-                    try:
-                        x = date_parser(x_data[sort_index[s]])
-                    except Exception:
-                        continue
-                    x_values_sorted.append(x)
-                    y_values_sorted.append(y_data[sort_index[s]])
-                    mrn_sorted.append(stats_data.mrns[sort_index[s]])
-                    uid_sorted.append(stats_data.uids[sort_index[s]])
+                index = stats_data.time_series_index
+                order = index['order']
+                y_values_sorted = to_float_array(stats_data.data[y_axis_selection]['values'])[order].tolist()
+                x_values_sorted = index['dates'].tolist()
+                mrn_sorted = [stats_data.mrns[i] for i in order]
+                uid_sorted = [stats_data.uids[i] for i in order]
 
                 data[grp] = {'x': x_values_sorted,
                              'y': y_values_sorted,
@@ -200,6 +191,11 @@ class TimeSeriesFrame:
     def update_plot_ticker(self, evt):
         self.update_plot()
 
+    def update_trend_ticker(self, evt):
+        # the plotted data is unchanged, only the moving average and percentile region need to be recalculated
+        self.plot.update_trend(self.avg_len, self.percentile)
+        self.plot.update_bokeh_layout_in_wx_python()
+
     def update_y_axis_options(self):
         current_choice = self.combo_box_y_axis.GetValue()
         self.combo_box_y_axis.SetItems(self.choices)
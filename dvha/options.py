@@ -63,6 +63,10 @@ class DefaultOptions:
         # This is only applied to the DVH plot since it has a large amount of data
         self.LOD_FACTOR = 100
 
+        # Individual DVHs are down-sampled for the DVH plot such that the plotted lines are never further than this
+        # relative volume from the DVHs, use 0 to only remove bins along the flat portions of DVHs
+        self.DVH_LOD_TOLERANCE = 0.002
+
         # All DVHs in SQL DB have 1cGy bin widths regardless of this value.  However, the queried DVHs will be
         # down-sampled using this bin_width
         self.dvh_bin_width = 5
@@ -176,6 +180,18 @@ class DefaultOptions:
         self.USE_DICOM_DVH = False
         self.AUTO_SUM_DOSE = True
 
+        # PTV overlap may be calculated with Shapely polygons ('shapely') or with rois rasterized onto a voxel grid
+        # ('mask', see tools.roi_mask), ROI_MASK_RESOLUTION is the voxel width in x and y (mm). Only PTV overlap uses
+        # GEOMETRY_ENGINE, and the mask is only faster than Shapely at coarse resolutions
+        self.GEOMETRY_ENGINE = 'shapely'
+        self.ROI_MASK_RESOLUTION = 1.
+
+        # Surface area may be calculated with Shapely polygons ('shapely') or with a triangle mesh interpolated between
+        # slices ('mesh', see tools.roi_mask.surface_area), SURFACE_AREA_RESOLUTION is the mesh grid spacing (mm).
+        # The mesh is an opt-in for accuracy, it is several times slower than 'shapely' (about 4x at 2 mm)
+        self.SURFACE_AREA_ENGINE = 'shapely'
+        self.SURFACE_AREA_RESOLUTION = 2.
+
         self.save_fig_param = {'figure': {'y_range_start': -0.0005,
                                           'x_range_start': 0.,
                                           'y_range_end': 1.0005,
@@ -31,6 +31,7 @@ BACKUP_DIR = join(DATA_DIR, 'backup')
 TEMP_DIR = join(DATA_DIR, 'temp')
 MODELS_DIR = join(DATA_DIR, 'models')
 PROTOCOL_DIR = join(DATA_DIR, 'protocols')
+CACHE_DIR = join(DATA_DIR, 'cache')
 PROTOCOL_DEFAULT_DIR = join(RESOURCES_DIR, 'protocols')
 DIRECTORIES = {key[:-4]: value for key, value in locals().items() if key.endswith('_DIR')}
 
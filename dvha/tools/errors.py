@@ -50,6 +50,21 @@ class PlottingMemoryError(Exception):
         return self.message
 
 
+class MachineLearningCancelled(Exception):
+    """
+    Raised when a user cancels training of a machine learning model
+    """
+    pass
+
+
+class SessionFileError(Exception):
+    def __init__(self, error_message):
+        self.message = error_message
+
+    def __str__(self):
+        return self.message
+
+
 class PhantomJSError(Exception):
     def __init__(self):
         self.message = "PhantomJS could not be located. Download from https://phantomjs.org/download.html, then " \
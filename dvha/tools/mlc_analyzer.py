@@ -5,7 +5,7 @@
 """
 Tools for analyzing beam and control point information from DICOM files
 Hierarchy of classes:
-    Plan -> FxGroup -> Beam -> ControlPoint
+    Plan -> FxGroup -> Beam -> ControlPoints
 """
 # Copyright (c) 2016-2019 Dan Cutright
 # This file is part of DVH Analytics, released under a BSD license.
@@ -13,10 +13,15 @@ Hierarchy of classes:
 #    available at https://github.com/cutright/DVH-Analytics
 
 from dicompylercore import dicomparser
+import hashlib
 import numpy as np
+from os import rename
+from os.path import isfile
+import pickle
+import pydicom
 from shapely.geometry import Polygon
 from shapely import speedups
-from dvha.tools.utilities import flatten_list_of_lists as flatten
+from dvha.tools.utilities import flatten_list_of_lists as flatten, get_cache_file_path
 from dvha.options import Options
 
 
@@ -114,7 +119,7 @@ class FxGroup:
 class Beam:
     """
     Collect beam information from a beam in a beam sequence of a pydicom RT Plan dataset
-    Automatically parses control point data with ControlPoint class
+    Automatically parses control point data with ControlPoints class
     """
     def __init__(self, beam_dataset, meter_set, ignore_zero_mu_cp=False):
         """
@@ -127,109 +132,167 @@ class Beam:
         """
 
         cp_seq = beam_dataset.ControlPointSequence
-        self.control_point = [ControlPoint(cp) for cp in cp_seq]
-        self.control_point_count = len(self.control_point)
+        self.control_points = ControlPoints(cp_seq)
+        self.control_point_count = len(self.control_points)
 
+        self.leaf_boundaries = None
         for bld_seq in beam_dataset.BeamLimitingDeviceSequence:
             if hasattr(bld_seq, 'LeafPositionBoundaries'):
                 self.leaf_boundaries = bld_seq.LeafPositionBoundaries
 
-        self.jaws = [get_jaws(cp) for cp in self.control_point]
-        self.aperture = [get_shapely_from_cp(cp, self.leaf_boundaries) for cp in self.control_point]
-        self.mlc_borders = [get_mlc_borders(cp, self.leaf_boundaries) for cp in self.control_point]
-
         self.gantry_angle = [float(cp.GantryAngle) for cp in cp_seq if hasattr(cp, 'GantryAngle')]
         self.collimator_angle = [float(cp.BeamLimitingDeviceAngle) for cp in cp_seq if hasattr(cp, 'BeamLimitingDeviceAngle')]
         self.couch_angle = [float(cp.PatientSupportAngle) for cp in cp_seq if hasattr(cp, 'PatientSupportAngle')]
 
         self.meter_set = meter_set
-        self.control_point_meter_set = np.append([0], np.diff(np.array([cp.cum_mu for cp in self.control_point])))
+        self.control_point_meter_set = np.append([0], np.diff(self.control_points.cum_mu))
 
         if hasattr(beam_dataset, 'BeamDescription'):
             self.name = beam_dataset.BeamDescription
         else:
             self.name = beam_dataset.BeamName
 
-        cum_mu = [cp.cum_mu * self.meter_set for cp in self.control_point]
-        cp_mu = np.diff(np.array(cum_mu)).tolist() + [0]
-        x_paths = np.array([get_xy_path_lengths(cp)[0] for cp in self.aperture])
-        y_paths = np.array([get_xy_path_lengths(cp)[1] for cp in self.aperture])
-        area = [cp.area for cp in self.aperture]
-        c1, c2 = options.COMPLEXITY_SCORE_X_WEIGHT, options.COMPLEXITY_SCORE_Y_WEIGHT
-        self.complexity_scores = np.divide(np.multiply(np.add(c1*x_paths, c2*y_paths), cp_mu), area) / self.meter_set
-        # Complexity score based on:
-        # Younge KC, Matuszak MM, Moran JM, McShan DL, Fraass BA, Roberts DA. Penalization of aperture
-        # complexity in inversely planned volumetric modulated arc therapy. Med Phys. 2012;39(11):7160–70.
-
-        self.summary = {'cp': range(1, len(self.control_point)+1),
-                        'cum_mu_frac': [cp.cum_mu for cp in self.control_point],
-                        'cum_mu': cum_mu,
-                        'cp_mu': cp_mu,
-                        'gantry': self.gantry_angle,
-                        'collimator': self.collimator_angle,
-                        'couch': self.couch_angle,
-                        'jaw_x1': [j['x_min']/10 for j in self.jaws],
-                        'jaw_x2': [j['x_max']/10 for j in self.jaws],
-                        'jaw_y1': [j['y_min']/10 for j in self.jaws],
-                        'jaw_y2': [j['y_max']/10 for j in self.jaws],
-                        'area': np.divide(area, 100.).tolist(),
-                        'x_perim': np.divide(x_paths, 10.).tolist(),
-                        'y_perim': np.divide(y_paths, 10.).tolist(),
-                        'perim': np.divide(np.add(x_paths, y_paths), 10.).tolist(),
-                        'cmp_score': self.complexity_scores.tolist()}
-
-        for key in self.summary:
-            if len(self.summary[key]) == 1:
-                self.summary[key] = self.summary[key] * len(self.summary['cp'])
+        cum_mu = self.control_points.cum_mu * self.meter_set
+        cp_mu = np.append(np.diff(cum_mu), 0)
+        area, x_paths, y_paths = get_beam_aperture_metrics(self.control_points, self.leaf_boundaries)
+        self.complexity_scores = get_complexity_scores(x_paths, y_paths, area, cp_mu, self.meter_set)
+
+        # independent of meter_set and complexity score weights, see get_plan_aperture_data
+        self.aperture_data = {'cum_mu_frac': self.control_points.cum_mu,
+                              'area': area, 'x_path': x_paths, 'y_path': y_paths}
+
+        jaws = self.control_points.jaws
+        self.summary_data = {'cp': np.arange(1, self.control_point_count + 1),
+                             'cum_mu_frac': self.control_points.cum_mu,
+                             'cum_mu': cum_mu,
+                             'cp_mu': cp_mu,
+                             'gantry': np.array(self.gantry_angle),
+                             'collimator': np.array(self.collimator_angle),
+                             'couch': np.array(self.couch_angle),
+                             'jaw_x1': jaws[:, 0] / 10,
+                             'jaw_x2': jaws[:, 1] / 10,
+                             'jaw_y1': jaws[:, 2] / 10,
+                             'jaw_y2': jaws[:, 3] / 10,
+                             'area': area / 100.,
+                             'x_perim': x_paths / 10.,
+                             'y_perim': y_paths / 10.,
+                             'perim': (x_paths + y_paths) / 10.,
+                             'cmp_score': self.complexity_scores}
+
+        for key, value in self.summary_data.items():
+            if len(value) == 1:
+                self.summary_data[key] = np.repeat(value, self.control_point_count)
 
         if ignore_zero_mu_cp:
-            non_zero_indices = [i for i, value in enumerate(self.summary['cp_mu']) if value != 0]
-            for key in list(self.summary):
-                self.summary[key] = [self.summary[key][i] for i in non_zero_indices]
+            non_zero_indices = np.flatnonzero(cp_mu != 0)
+            self.summary_data = {key: value[non_zero_indices] for key, value in self.summary_data.items()}
+
+    @property
+    def summary(self):
+        """
+        :return: summary_data as lists, e.g. for plotting
+        :rtype: dict
+        """
+        return {key: value.tolist() for key, value in self.summary_data.items()}
+
+    @property
+    def control_point(self):
+        """
+        :return: a view of each control point
+        :rtype: list of ControlPoint
+        """
+        return [ControlPoint(self.control_points, i) for i in range(self.control_point_count)]
+
+    @property
+    def jaws(self):
+        """
+        :return: the return of get_jaws for each control point
+        :rtype: list
+        """
+        return [dict(zip(['x_min', 'x_max', 'y_min', 'y_max'], row)) for row in self.control_points.jaws.tolist()]
+
+    @property
+    def mlc_borders(self):
+        """
+        :return: the return of get_mlc_borders for each control point
+        :rtype: list
+        """
+        return [get_mlc_borders(cp, self.leaf_boundaries) for cp in self.control_point]
+
+    @property
+    def aperture(self):
+        """
+        :return: a shapely object of the aperture of each control point, not used for the summary metrics
+        :rtype: list
+        """
+        return [get_shapely_from_cp(cp, self.leaf_boundaries) for cp in self.control_point]
 
     def __eq__(self, other):
-        for i, cp in enumerate(self.control_point):
-            if not cp == other.control_point[i]:
-                print('cp %s failed' % i)
-                return False
+        cum_mu_diff = np.abs(self.control_points.cum_mu - other.control_points.cum_mu)
+        for i in np.flatnonzero(cum_mu_diff > 0.00001):
+            print('cp %s failed' % i)
+            return False
+        mlc_diff = np.abs(self.control_points.mlc - other.control_points.mlc)
+        for diff in mlc_diff[mlc_diff > 0.0001]:
+            print(diff)
         return True
 
 
-class ControlPoint:
+class ControlPoints:
     """
-    Collect control point information from a ControlPointSequence in a beam dataset of a pydicom RT Plan dataset
+    Collect the control point information of a ControlPointSequence in a beam dataset of a pydicom RT Plan dataset,
+    stored as arrays with the control point index as the first axis
     """
     def __init__(self, cp_seq):
         """
         :param cp_seq: control point sequence object
         :type cp_seq: Sequence
         """
-        cp = {'cum_mu': float(cp_seq.CumulativeMetersetWeight)}
-        for device_position_seq in cp_seq.BeamLimitingDevicePositionSequence:
-            leaf_jaw_type = str(device_position_seq.RTBeamLimitingDeviceType).lower()
-            if leaf_jaw_type.startswith('mlc'):
-                cp['leaf_type'] = leaf_jaw_type
-                leaf_jaw_type = 'mlc'
-
-            positions = np.array(list(map(float, device_position_seq.LeafJawPositions)))
-            mid_index = int(len(positions) / 2)
-            cp[leaf_jaw_type] = [positions[:mid_index],
-                                 positions[mid_index:]]
-
-        if 'leaf_type' not in list(cp):
-            cp['leaf_type'] = False
+        count = len(cp_seq)
+        self.cum_mu = np.array([float(cp.CumulativeMetersetWeight) for cp in cp_seq])
+        self.leaf_type = np.zeros(count, dtype='<U4')  # empty string if the control point has no mlc
+        self.jaws = np.tile([-options.MAX_FIELD_SIZE_X / 2., options.MAX_FIELD_SIZE_X / 2.,
+                             -options.MAX_FIELD_SIZE_Y / 2., options.MAX_FIELD_SIZE_Y / 2.], (count, 1))
+
+        mlc = {}
+        for i, cp in enumerate(cp_seq):
+            for device_position_seq in cp.BeamLimitingDevicePositionSequence:
+                leaf_jaw_type = str(device_position_seq.RTBeamLimitingDeviceType).lower()
+                positions = np.array(device_position_seq.LeafJawPositions, dtype=float)
+                if leaf_jaw_type.startswith('mlc'):
+                    self.leaf_type[i] = leaf_jaw_type
+                    mlc[i] = positions
+                elif leaf_jaw_type in {'asymx', 'asymy'}:
+                    column = 0 if leaf_jaw_type == 'asymx' else 2
+                    self.jaws[i, column:column + 2] = np.min(positions), np.max(positions)
+
+        # leaf positions with shape (control point count, bank, leaf pair count), nan if the control point has no mlc
+        leaf_count = int(len(next(iter(mlc.values()))) / 2) if mlc else 0
+        self.mlc = np.full((count, 2, leaf_count), np.nan)
+        for i, positions in mlc.items():
+            self.mlc[i] = positions.reshape(2, leaf_count)
+
+    def __len__(self):
+        return len(self.cum_mu)
 
-        for key in cp:
-            setattr(self, key, cp[key])
 
-    def __eq__(self, other):
-        if abs(self.cum_mu - other.cum_mu) > 0.00001:
-            return False
-        for side in [0, 1]:
-            for i, pos in enumerate(self.mlc[side]):
-                if abs(pos - other.mlc[side][i]) > 0.0001:
-                    print(abs(pos - other.mlc[side][i]))
-        return True
+class ControlPoint:
+    """
+    A view of one control point of ControlPoints, for tools that operate on a single control point
+    """
+    def __init__(self, control_points, index):
+        """
+        :param control_points: the control points of a beam
+        :type control_points: ControlPoints
+        :param index: the control point index
+        :type index: int
+        """
+        self.cum_mu = float(control_points.cum_mu[index])
+        self.leaf_type = str(control_points.leaf_type[index]) or False
+        self.mlc = control_points.mlc[index]
+        x_min, x_max, y_min, y_max = control_points.jaws[index].tolist()
+        self.asymx = [x_min, x_max]
+        self.asymy = [y_min, y_max]
 
 
 def get_mlc_borders(control_point, leaf_boundaries):
@@ -289,12 +352,177 @@ def get_shapely_from_cp(control_point, leaf_boundaries):
     mlc_points = a + b[::-1]  # concatenate a and reverse(b)
     mlc_aperture = Polygon(mlc_points).buffer(0)
 
-    # This function is very slow, since jaws are rectangular, perhaps there's a more efficient method?
+    # This function is very slow, see get_aperture_metrics for the method used in Beam
     aperture = mlc_aperture.intersection(jaw_shapely)
 
     return aperture
 
 
+def get_beam_aperture_metrics(control_points, leaf_boundaries):
+    """
+    Calculate the aperture metrics of each control point of a beam with get_aperture_metrics, batching the control
+    points by leaf type
+    :param control_points: control points of a beam
+    :type control_points: ControlPoints
+    :param leaf_boundaries: a LeafPositionBoundaries object from the BeamLimitingDeviceSequence
+    :type leaf_boundaries: MultiValue
+    :return: area (mm^2), x path length (mm), and y path length (mm) of each control point
+    :rtype: tuple
+    """
+    jaws = control_points.jaws
+
+    # control points without an MLC are the jaw opening
+    width, height = jaws[:, 1] - jaws[:, 0], jaws[:, 3] - jaws[:, 2]
+    area, x_paths, y_paths = width * height, 2. * width, 2. * height
+
+    for leaf_type in ['mlcx', 'mlcy']:
+        indices = np.flatnonzero(control_points.leaf_type == leaf_type)
+        if len(indices):
+            leaf_positions = control_points.mlc[indices]
+            if leaf_type == 'mlcx':
+                metrics = get_aperture_metrics(leaf_positions, leaf_boundaries, jaws[indices])
+                area[indices], x_paths[indices], y_paths[indices] = metrics
+            else:  # leaves travel in y, so swap x and y
+                metrics = get_aperture_metrics(leaf_positions, leaf_boundaries, jaws[indices][:, [2, 3, 0, 1]])
+                area[indices], y_paths[indices], x_paths[indices] = metrics
+
+    return area, x_paths, y_paths
+
+
+def get_aperture_metrics(leaf_positions, leaf_boundaries, jaws):
+    """
+    Calculate the open area and path lengths of MLC apertures clipped by the jaws, for any number of control points.
+    Each leaf pair opening is a rectangle, so the aperture outline is made of the sides of each opening (y path) and
+    the parts of each opening not covered by the adjacent openings (x path).
+    :param leaf_positions: positions (mm) of each leaf bank, with shape (control point count, 2, leaf pair count)
+    :type leaf_positions: np.ndarray
+    :param leaf_boundaries: positions (mm) of the leaf boundaries perpendicular to leaf travel, the leaf pair count + 1
+    :type leaf_boundaries: MultiValue
+    :param jaws: jaw positions (mm) in the order of x_min, x_max, y_min, y_max with shape (control point count, 4),
+    where x is the direction of leaf travel
+    :type jaws: np.ndarray
+    :return: area (mm^2), x path length (mm), and y path length (mm) of each control point
+    :rtype: tuple
+    """
+    leaf_boundaries = np.array(leaf_boundaries, dtype=float)
+    x_min, x_max, y_min, y_max = [jaws[:, [i]] for i in range(4)]
+
+    left = np.maximum(leaf_positions[:, 0], x_min)
+    right = np.minimum(leaf_positions[:, 1], x_max)
+    height = np.minimum(leaf_boundaries[1:], y_max) - np.maximum(leaf_boundaries[:-1], y_min)
+    is_open = (right > left) & (height > 0)
+    width = np.where(is_open, right - left, 0.)
+    height = np.where(is_open, height, 0.)
+
+    area = np.sum(width * height, axis=1)
+    y_paths = 2. * np.sum(height, axis=1)
+
+    # pad with closed leaves, so the ends of the outermost open leaves are included
+    left, right, width = [np.pad(np.where(is_open, v, 0.), ((0, 0), (1, 1))) for v in [left, right, width]]
+    overlap = np.maximum(np.minimum(right[:, 1:], right[:, :-1]) - np.maximum(left[:, 1:], left[:, :-1]), 0.)
+    x_paths = np.sum(width[:, 1:] + width[:, :-1] - 2. * overlap, axis=1)
+
+    return area, x_paths, y_paths
+
+
+def get_complexity_scores(x_paths, y_paths, area, cp_mu, meter_set, weights=None):
+    """
+    Complexity score based on:
+    Younge KC, Matuszak MM, Moran JM, McShan DL, Fraass BA, Roberts DA. Penalization of aperture
+    complexity in inversely planned volumetric modulated arc therapy. Med Phys. 2012;39(11):7160–70.
+    :param x_paths: x path length (mm) of each control point
+    :param y_paths: y path length (mm) of each control point
+    :param area: aperture area (mm^2) of each control point
+    :param cp_mu: monitor units of each control point
+    :param meter_set: the monitor units of the beam
+    :type meter_set: float
+    :param weights: x and y path weights, defaults to COMPLEXITY_SCORE_X_WEIGHT and COMPLEXITY_SCORE_Y_WEIGHT
+    :type weights: tuple
+    :return: complexity score of each control point
+    :rtype: np.ndarray
+    """
+    c1, c2 = weights if weights is not None else (options.COMPLEXITY_SCORE_X_WEIGHT, options.COMPLEXITY_SCORE_Y_WEIGHT)
+    return np.divide(np.multiply(np.add(c1*np.asarray(x_paths), c2*np.asarray(y_paths)), cp_mu), area) / meter_set
+
+
+def get_mlc_summary(aperture_data, meter_set, ignore_zero_mu_cp=False, weights=None):
+    """
+    Rescore aperture data (e.g., from get_plan_aperture_data) without parsing the beam
+    :param aperture_data: Beam.aperture_data
+    :type aperture_data: dict
+    :param meter_set: the monitor units of the beam
+    :type meter_set: float
+    :param ignore_zero_mu_cp: If True, skip over zero MU control points (e.g., as in Step-N-Shoot beams)
+    :type ignore_zero_mu_cp: bool
+    :param weights: x and y path weights, defaults to COMPLEXITY_SCORE_X_WEIGHT and COMPLEXITY_SCORE_Y_WEIGHT
+    :type weights: tuple
+    :return: the area, x_perim, y_perim, perim, cmp_score, and cp_mu values of Beam.summary_data
+    :rtype: dict
+    """
+    area, x_paths, y_paths = aperture_data['area'], aperture_data['x_path'], aperture_data['y_path']
+    cp_mu = np.append(np.diff(aperture_data['cum_mu_frac'] * meter_set), 0)
+
+    summary = {'area': area / 100.,
+               'x_perim': x_paths / 10.,
+               'y_perim': y_paths / 10.,
+               'perim': (x_paths + y_paths) / 10.,
+               'cmp_score': get_complexity_scores(x_paths, y_paths, area, cp_mu, meter_set, weights=weights),
+               'cp_mu': cp_mu}
+
+    if ignore_zero_mu_cp:
+        non_zero_indices = np.flatnonzero(cp_mu != 0)
+        summary = {key: value[non_zero_indices] for key, value in summary.items()}
+
+    return summary
+
+
+def get_plan_aperture_data(rt_plan_file_path, rt_plan=None):
+    """
+    Get the aperture data of each beam in an RT Plan, cached in CACHE_DIR by the DVHA version, and the SOP Instance
+    UID and file checksum of the plan, so complexity scores may be recalculated (e.g., with new weights) without parsing the control points
+    :param rt_plan_file_path: absolute file path of the DICOM RT Plan
+    :type rt_plan_file_path: str
+    :param rt_plan: the pydicom dataset of rt_plan_file_path, if already read
+    :return: Beam.aperture_data with the beam numbers as keys, beams that cannot be analyzed are excluded
+    :rtype: dict
+    """
+    with open(rt_plan_file_path, 'rb') as infile:
+        checksum = hashlib.md5(infile.read()).hexdigest()
+    if rt_plan is None:
+        sop_instance_uid = pydicom.read_file(rt_plan_file_path, specific_tags=['SOPInstanceUID']).SOPInstanceUID
+    else:
+        sop_instance_uid = rt_plan.SOPInstanceUID
+    cache_file_path = get_cache_file_path('aperture', '%s_%s' % (sop_instance_uid, checksum))
+
+    if isfile(cache_file_path):
+        try:
+            with open(cache_file_path, 'rb') as infile:
+                return pickle.load(infile)
+        except Exception as e:
+            print('Error: ', e)
+            print('Could not load cached aperture data, recalculating %s' % rt_plan_file_path)
+
+    if rt_plan is None:
+        rt_plan = pydicom.read_file(rt_plan_file_path)
+
+    aperture_data = {}
+    for beam in rt_plan.BeamSequence:
+        try:
+            aperture_data[int(beam.BeamNumber)] = Beam(beam, 1.).aperture_data
+        except Exception:
+            print('MLC Analyzer fail for beam number %s of %s' % (beam.BeamNumber, rt_plan_file_path))
+
+    try:  # write to a temporary file first, so other processes never read a partial file
+        with open(cache_file_path + '.tmp', 'wb') as outfile:
+            pickle.dump(aperture_data, outfile, pickle.HIGHEST_PROTOCOL)
+        rename(cache_file_path + '.tmp', cache_file_path)
+    except Exception as e:
+        print('Error: ', e)
+        print('Could not write aperture data cache for %s' % rt_plan_file_path)
+
+    return aperture_data
+
+
 def get_jaws(control_point):
     """
     Get the jaw positions of a control point
@@ -358,13 +586,11 @@ def update_missing_jaws(beam_list):
     first control point jaw settings
     :rtype: list
     """
+    max_jaws = [-options.MAX_FIELD_SIZE_X / 2, options.MAX_FIELD_SIZE_X / 2,
+                -options.MAX_FIELD_SIZE_Y / 2, options.MAX_FIELD_SIZE_Y / 2]
 
-    for i, beam in enumerate(beam_list):
-        for j, cp in enumerate(beam.jaws):
-            if cp['x_min'] == -options.MAX_FIELD_SIZE_X / 2 and \
-                            cp['x_max'] == options.MAX_FIELD_SIZE_X / 2 and \
-                            cp['y_min'] == -options.MAX_FIELD_SIZE_Y / 2 and \
-                            cp['y_max'] == options.MAX_FIELD_SIZE_Y / 2:
-                beam_list[i].jaws[j] = beam.jaws[0]
+    for beam in beam_list:
+        jaws = beam.control_points.jaws
+        jaws[np.all(jaws == max_jaws, axis=1)] = jaws[0].copy()
 
     return beam_list
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# tools.progress.py
+"""
+Throttled progress reporting for worker threads. Rather than sending a pubsub message with wx.CallAfter for every
+file, roi, or dose plane, workers pass updates to a ProgressReporter, which only keeps the latest message of each topic
+and sends them at most PROGRESS_UPDATE_RATE times per second.
+"""
+# Copyright (c) 2016-2019 Dan Cutright
+# This file is part of DVH Analytics, released under a BSD license.
+#    See the file LICENSE included with this distribution, also
+#    available at https://github.com/cutright/DVH-Analytics
+
+import wx
+from collections import OrderedDict
+from pubsub import pub
+from threading import Lock, Timer
+from time import time
+
+
+PROGRESS_UPDATE_RATE = 10.  # Hz
+
+
+class ProgressReporter:
+    """
+    Coalesce pubsub progress messages of a worker, and count completed items (e.g., plans or rois) to report rates
+    """
+    def __init__(self, rate=PROGRESS_UPDATE_RATE):
+        """
+        :param rate: maximum number of updates per second sent to the GUI
+        :type rate: float
+        """
+        self.interval = 1. / rate
+        self.pending = OrderedDict()
+        self.last_sent = 0.
+        self.timer = None
+        self.lock = Lock()
+
+        self.start_time = time()
+        self.counters = {}
+
+    def update(self, topic, **kwargs):
+        """
+        Queue a pubsub message, replacing any queued message of the same topic
+        :param topic: pubsub topic name
+        :type topic: str
+        :param kwargs: message data passed to pub.sendMessage
+        """
+        with self.lock:
+            self.pending.pop(topic, None)
+            self.pending[topic] = kwargs
+            wait = self.last_sent + self.interval - time()
+            if wait > 0:
+                if self.timer is None:  # the latest update is sent when the interval ends, even if no others follow
+                    self.timer = Timer(wait, self.flush)
+                    self.timer.daemon = True
+                    self.timer.start()
+                return
+        self.flush()
+
+    def flush(self):
+        """
+        Send all queued messages now, call before sending a message that must follow them (e.g., closing a dialog)
+        """
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            for topic, kwargs in self.pending.items():
+                wx.CallAfter(pub.sendMessage, topic, **kwargs)
+            self.pending.clear()
+            self.last_sent = time()
+
+    def increment(self, counter, count=1):
+        """
+        :param counter: name of the counter (e.g., 'plans' or 'rois')
+        :type counter: str
+        :param count: number of items completed
+        :type count: int
+        """
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + count
+
+    def get_rate(self, counter, period=1.):
+        """
+        :param counter: name of the counter
+        :type counter: str
+        :param period: time period of the rate in seconds, e.g. 60 for items per minute
+        :type period: float
+        :return: the number of counted items per period since this object was created
+        :rtype: float
+        """
+        elapsed = time() - self.start_time
+        return self.counters.get(counter, 0) * period / elapsed if elapsed > 0 else 0.
@@ -26,6 +26,10 @@ roi_coord_string from the SQL database
 from shapely.geometry import Polygon, Point
 from shapely import speedups
 import numpy as np
+try:  # vectorized constructors are available as of Shapely 2.0
+    from shapely import linearrings as shapely_linearrings, polygons as shapely_polygons, buffer as shapely_buffer
+except ImportError:
+    shapely_linearrings, shapely_polygons, shapely_buffer = None, None, None
 
 
 MIN_SLICE_THICKNESS = 2  # Update method to pull from DICOM
@@ -71,28 +75,95 @@ def points_to_shapely_polygon(sets_of_points):
     :type sets_of_points: dict
     :return: a composite polygon as a shapely object (either polygon or multipolygon)
     """
+    return contours_to_shapely_polygon([np.asarray(points, dtype=float) for points in sets_of_points])
+
+
+def contours_to_shapely_polygon(contours):
+    """
+    :param contours: the contours of a slice, each a numpy array of points with shape (n, 2) or (n, 3)
+    :type contours: list
+    :return: a composite polygon as a shapely object (either polygon or multipolygon)
+    """
+    contours = [contour[:, :2] for contour in contours if len(contour) > 3]
+    if not contours:
+        return None
+
+    # Polygons are closed automatically, buffer(0) cleans stray points
+    if shapely_linearrings is not None:
+        indices = np.repeat(np.arange(len(contours)), [len(contour) for contour in contours])
+        rings = shapely_linearrings(np.concatenate(contours), indices=indices)
+        polygons = list(shapely_buffer(shapely_polygons(rings), 0))
+    else:
+        polygons = [Polygon(contour).buffer(0) for contour in contours]
 
     composite_polygon = None
-    for set_of_points in sets_of_points:
-        if len(set_of_points) > 3:
-            points = [(point[0], point[1]) for point in set_of_points]
-            points.append(points[0])  # Explicitly connect the final point to the first
-
-            # if there are multiple sets of points in a slice, each set is a polygon,
-            # interior polygons are subtractions, exterior are addition
-            # Only need to check one point for interior vs exterior
-            current_polygon = Polygon(points).buffer(0)  # clean stray points
-            if composite_polygon:
-                if Point((points[0][0], points[0][1])).disjoint(composite_polygon):
-                    composite_polygon = composite_polygon.union(current_polygon)
-                else:
-                    composite_polygon = composite_polygon.symmetric_difference(current_polygon)
+    for contour, current_polygon in zip(contours, polygons):
+        # if there are multiple sets of points in a slice, each set is a polygon,
+        # interior polygons are subtractions, exterior are addition
+        # Only need to check one point for interior vs exterior
+        if composite_polygon:
+            if Point(contour[0]).disjoint(composite_polygon):
+                composite_polygon = composite_polygon.union(current_polygon)
             else:
-                composite_polygon = current_polygon
+                composite_polygon = composite_polygon.symmetric_difference(current_polygon)
+        else:
+            composite_polygon = current_polygon
 
     return composite_polygon
 
 
+class SliceGeometry:
+    """
+    Contours of an roi stored as numpy arrays and the Shapely polygon of each slice, built once so that each of the
+    calculations in tools.roi_geometry does not need to rebuild them from a "sets of points" object
+    """
+    def __init__(self, sets_of_points):
+        """
+        :param sets_of_points: a "sets of points" formatted dictionary
+        :type sets_of_points: dict
+        """
+        self.contours = {z: [np.asarray(points, dtype=float) for points in sets_of_points[z]] for z in sets_of_points}
+        self.polygons = {z: contours_to_shapely_polygon(contours) for z, contours in self.contours.items()}
+
+    @property
+    def thickness(self):
+        """
+        :return: slice thickness of each slice, using str(z) as keys
+        :rtype: dict
+        """
+        z_keys = list(self.contours)
+        all_z_values = np.sort([round(float(z), 2) for z in z_keys])
+        thicknesses = np.abs(np.diff(all_z_values))
+        if len(thicknesses):
+            thicknesses = np.append(thicknesses, np.min(thicknesses))
+        else:
+            thicknesses = np.array([MIN_SLICE_THICKNESS])
+        all_z_values = all_z_values.tolist()
+        return {z: thicknesses[all_z_values.index(round(float(z), 2))] for z in z_keys}
+
+    @property
+    def points(self):
+        """
+        :return: all points of the roi
+        :rtype: numpy.array
+        """
+        contours = [contour for z in self.contours for contour in self.contours[z] if len(contour)]
+        if contours:
+            return np.concatenate(contours)
+        return np.empty((0, 3))
+
+
+def get_slice_geometry(roi):
+    """
+    :param roi: a "sets of points" formatted dictionary or a SliceGeometry object
+    :return: roi as a SliceGeometry, roi is returned as is if already a SliceGeometry so that it may be shared
+    :rtype: SliceGeometry
+    """
+    if isinstance(roi, SliceGeometry):
+        return roi
+    return SliceGeometry(roi)
+
+
 def get_roi_coordinates_from_string(roi_coord_string):
     """
     :param roi_coord_string: roi string representation of an roi as formatted in the SQL database
@@ -148,6 +219,24 @@ def dicompyler_roi_coord_to_db_string(coord):
     return ':'.join(contours)
 
 
+def sets_of_points_to_db_string(sets_of_points):
+    """
+    :param sets_of_points: a "sets of points" formatted dictionary
+    :type sets_of_points: dict
+    :return: roi string representation of an roi as formatted in the SQL database (roi_coord_string)
+    :rtype:  str
+    """
+    contours = []
+    for z in sets_of_points:
+        for polygon in sets_of_points[z]:
+            points = [z]
+            for point in polygon:
+                points.append(str(round(point[0], 3)))
+                points.append(str(round(point[1], 3)))
+            contours.append(','.join(points))
+    return ':'.join(contours)
+
+
 def get_shapely_from_sets_of_points(sets_of_points):
     """
     :param sets_of_points: a "sets of points" formatted dictionary
@@ -19,8 +19,7 @@ Tools for geometric calculations
 from scipy.spatial.distance import cdist
 import numpy as np
 from math import ceil
-from dvha.tools.roi_formatter import points_to_shapely_polygon, dicompyler_roi_to_sets_of_points,\
-    get_shapely_from_sets_of_points
+from dvha.tools.roi_formatter import points_to_shapely_polygon, dicompyler_roi_to_sets_of_points, get_slice_geometry
 
 
 def union(rois):
@@ -105,25 +104,13 @@ def min_distances_to_target(oar_coordinates, target_coordinates):
 def cross_section(roi):
     """
     Calculate the cross section of a given roi
-    :param roi: a "sets of points" formatted dictionary
-    :type roi: dict
+    :param roi: a "sets of points" formatted dictionary or a SliceGeometry object
     :return: max and median cross-sectional area of all slices in cm^2
     :rtype: dict
     """
-    areas = []
+    roi = get_slice_geometry(roi)
 
-    for z in list(roi):
-        shapely_roi = points_to_shapely_polygon(roi[z])
-        if shapely_roi and shapely_roi.area > 0:
-            slice_centroid = shapely_roi.centroid
-            polygon_count = len(slice_centroid.xy[0])
-            for i in range(polygon_count):
-                if polygon_count > 1:
-                    areas.append(shapely_roi[i].area)
-                else:
-                    areas.append(shapely_roi.area)
-
-    areas = np.array(areas)
+    areas = np.array([polygon.area for polygon in roi.polygons.values() if polygon and polygon.area > 0])
 
     area = {'max': float(np.max(areas) / 100.),
             'median': float(np.median(areas) / 100.)}
@@ -134,26 +121,30 @@ def cross_section(roi):
 def surface_area(coord, coord_type='dicompyler'):
     """
     Calculate the surface of a given roi
-    :param coord: dicompyler structure coordinates from GetStructureCoordinates() or a sets_of_points dictionary
-    :param coord_type: either 'dicompyler' or 'sets_of_points'
+    :param coord: dicompyler structure coordinates from GetStructureCoordinates(), a sets_of_points dictionary,
+    or a SliceGeometry object
+    :param coord_type: either 'dicompyler' or 'sets_of_points' (also used for a SliceGeometry)
     :return: surface_area in cm^2
     :rtype: float
     """
     # TODO: This surface area method needs validation, but likely needs to be corrected
+    # Sloped surfaces are approximated as steps between slices (e.g., ~28% high for a sphere),
+    # see tools.roi_mask.surface_area for a more accurate, but slower, mesh based alternative (SURFACE_AREA_ENGINE)
 
     if coord_type == "sets_of_points":
-        sets_of_points = coord
+        roi = get_slice_geometry(coord)
     else:
-        sets_of_points = dicompyler_roi_to_sets_of_points(coord)
+        roi = get_slice_geometry(dicompyler_roi_to_sets_of_points(coord))
 
-    shapely_roi = get_shapely_from_sets_of_points(sets_of_points)
+    roi_thickness = roi.thickness
+    z_keys = [z for z, polygon in roi.polygons.items() if polygon]
 
-    slice_count = len(shapely_roi['z'])
+    slice_count = len(z_keys)
 
     area = 0.
-    polygon = shapely_roi['polygon']
-    z = shapely_roi['z']
-    thickness = min(shapely_roi['thickness'])
+    polygon = [roi.polygons[key] for key in z_keys]
+    z = [round(float(key), 2) for key in z_keys]
+    thickness = min([roi_thickness[key] for key in z_keys])
 
     for i in range(slice_count):
         for j in [-1, 1]:  # -1 for bottom area and 1 for top area
@@ -172,31 +163,20 @@ def surface_area(coord, coord_type='dicompyler'):
 def overlap_volume(oar, tv):
     """
     Calculate the overlap volume of two rois
-    :param oar: organ-at-risk as a "sets of points" formatted dictionary
-    :type oar: dict
-    :param tv: treatment volume as a "sets of points" formatted dictionary
-    :type tv: dict
+    :param oar: organ-at-risk as a "sets of points" formatted dictionary or a SliceGeometry object
+    :param tv: treatment volume as a "sets of points" formatted dictionary or a SliceGeometry object
     :rtype: float
     """
+    oar, tv = get_slice_geometry(oar), get_slice_geometry(tv)
 
     intersection_volume = 0.
-    all_z_values = [round(float(z), 2) for z in list(tv)]
-    all_z_values = np.sort(all_z_values)
-    thicknesses = np.abs(np.diff(all_z_values))
-    if len(thicknesses) > 0:
-        thicknesses = np.append(thicknesses, np.min(thicknesses))
-        all_z_values = all_z_values.tolist()
-
-        for z in list(tv):
-            # z in coord will not necessarily go in order of z, convert z to float to lookup thickness
-            # also used to check for top and bottom slices, to add area of those contours
-
-            if z in list(oar):
-                thickness = thicknesses[all_z_values.index(round(float(z), 2))]
-                shapely_tv = points_to_shapely_polygon(tv[z])
-                shapely_oar = points_to_shapely_polygon(oar[z])
+    if len(tv.polygons) > 1:
+        tv_thickness = tv.thickness
+        for z, shapely_tv in tv.polygons.items():
+            if z in oar.polygons:
+                shapely_oar = oar.polygons[z]
                 if shapely_oar and shapely_tv:
-                    intersection_volume += shapely_tv.intersection(shapely_oar).area * thickness
+                    intersection_volume += shapely_tv.intersection(shapely_oar).area * tv_thickness[z]
 
         return round(intersection_volume / 1000., 2)
     return 0.
@@ -204,7 +184,7 @@ def overlap_volume(oar, tv):
 
 def volume(roi):
     """
-    :param roi: a "sets of points" formatted dictionary
+    :param roi: a "sets of points" formatted dictionary or a SliceGeometry object
     :return: volume in cm^3 of roi
     :rtype: float
     """
@@ -214,47 +194,33 @@ def volume(roi):
     # polygon n is inside polygon n-1, then the current accumulated polygon is
     #    polygon n subtracted from the accumulated polygon up to and including polygon n-1
     #    Same method DICOM uses to handle rings and islands
+    roi = get_slice_geometry(roi)
 
     vol = 0.
-    all_z_values = [round(float(z), 2) for z in list(roi)]
-    all_z_values = np.sort(all_z_values)
-    thicknesses = np.abs(np.diff(all_z_values))
-    thicknesses = np.append(thicknesses, np.min(thicknesses))
-    all_z_values = all_z_values.tolist()
-
-    for z in list(roi):
-        # z in coord will not necessarily go in order of z, convert z to float to lookup thickness
-        # also used to check for top and bottom slices, to add area of those contours
-
-        thickness = thicknesses[all_z_values.index(round(float(z), 2))]
-        shapely_roi = points_to_shapely_polygon(roi[z])
+    thickness = roi.thickness
+    for z, shapely_roi in roi.polygons.items():
         if shapely_roi:
-            vol += shapely_roi.area * thickness
+            vol += shapely_roi.area * thickness[z]
 
     return round(vol / 1000., 2)
 
 
 def centroid(roi):
     """
-    :param roi: a "sets of points" formatted dictionary
+    :param roi: a "sets of points" formatted dictionary or a SliceGeometry object
     :return: centroid or the roi in x, y, z dicom coordinates (mm)
     :rtype: list
     """
-    centroids = {'x': [], 'y': [], 'z': [], 'area': []}
+    roi = get_slice_geometry(roi)
 
-    for z in list(roi):
-        shapely_roi = points_to_shapely_polygon(roi[z])
+    centroids = {'x': [], 'y': [], 'z': [], 'area': []}
+    for z, shapely_roi in roi.polygons.items():
         if shapely_roi and shapely_roi.area > 0:
             slice_centroid = shapely_roi.centroid
-            polygon_count = len(slice_centroid.xy[0])
-            for i in range(polygon_count):
-                centroids['x'].append(slice_centroid.xy[0][i])
-                centroids['y'].append(slice_centroid.xy[1][i])
-                centroids['z'].append(float(z))
-                if polygon_count > 1:
-                    centroids['area'].append(shapely_roi[i].area)
-                else:
-                    centroids['area'].append(shapely_roi.area)
+            centroids['x'].append(slice_centroid.x)
+            centroids['y'].append(slice_centroid.y)
+            centroids['z'].append(float(z))
+            centroids['area'].append(shapely_roi.area)
 
     x = np.array(centroids['x'])
     y = np.array(centroids['y'])
@@ -271,25 +237,14 @@ def centroid(roi):
 
 def spread(roi):
     """
-    :param roi: a "sets of points" formatted dictionary
+    :param roi: a "sets of points" formatted dictionary or a SliceGeometry object
     :return: x, y, z dimensions of a rectangular prism encompassing roi
     :rtype: list
     """
-    all_points = {'x': [], 'y': [], 'z': []}
-
-    for z in list(roi):
-        for polygon in roi[z]:
-            for point in polygon:
-                all_points['x'].append(point[0])
-                all_points['y'].append(point[1])
-                all_points['z'].append(point[2])
-
-    all_points = {'x': np.array(all_points['x']),
-                  'y': np.array(all_points['y']),
-                  'z': np.array(all_points['z'])}
+    points = get_slice_geometry(roi).points
 
-    if len(all_points['x'] > 1):
-        data = [abs(float(np.max(all_points[dim]) - np.min(all_points[dim]))) for dim in ['x', 'y', 'z']]
+    if len(points):
+        data = [abs(float(np.max(points[:, i]) - np.min(points[:, i]))) for i in range(3)]
     else:
         data = [0, 0, 0]
 
@@ -0,0 +1,426 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# tools.roi_mask.py
+"""
+Raster mask alternative to the Shapely based PTV overlap in tools.roi_geometry, used when GEOMETRY_ENGINE is 'mask'
+(see Options). It is only faster than Shapely at coarse resolutions.
+
+The treatment volume is rasterized once onto a VoxelGrid, and stored as a bitmask packed along x. The overlap of each
+roi is then calculated with numpy boolean operations.
+Each voxel is included if its center is inside the slice polygon, so accuracy depends on the grid resolution.
+Surface area is calculated from a triangle mesh of the roi (marching tetrahedra, a variant of marching cubes that does
+not require a 256 case lookup table).
+
+"""
+# Copyright (c) 2016-2019 Dan Cutright
+# This file is part of DVH Analytics, released under a BSD license.
+#    See the file LICENSE included with this distribution, also
+#    available at https://github.com/cutright/DVH-Analytics
+
+from collections import OrderedDict
+import hashlib
+import numpy as np
+from scipy.spatial import cKDTree
+try:  # Shapely 2.0+
+    from shapely import contains_xy
+except ImportError:
+    from shapely.vectorized import contains as contains_xy
+from dvha.tools.roi_formatter import get_slice_geometry, get_planes_from_string, MIN_SLICE_THICKNESS
+
+
+# number of set bits in each possible uint8 value
+BIT_COUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+# Each cube is split into six tetrahedra sharing the diagonal from corner 0 to corner 7, corners are indexed by their
+# (z, y, x) offsets as 4 * dz + 2 * dy + dx.  All cubes are split the same way, so the mesh is watertight.
+CUBE_CORNERS = [(dz, dy, dx) for dz in (0, 1) for dy in (0, 1) for dx in (0, 1)]
+TETRAHEDRA = [(0, 1, 3, 7), (0, 1, 5, 7), (0, 2, 3, 7), (0, 2, 6, 7), (0, 4, 5, 7), (0, 4, 6, 7)]
+TETRAHEDRON_EDGES = np.array([(0, 1), (0, 2), (0, 3), (1, 2), (1, 3), (2, 3)])
+
+
+def get_triangle_edges():
+    """
+    Lookup table of the iso-surface triangles in a tetrahedron, indexed by the included vertices as a bitmask
+    :return: edge indices (of TETRAHEDRON_EDGES) of two triangles for each case, with shape (16, 2, 3)
+    :rtype: numpy.array
+    """
+    edge_index = {edge: i for i, edge in enumerate(map(tuple, TETRAHEDRON_EDGES))}
+
+    def edge(v_1, v_2):
+        return edge_index[(min(v_1, v_2), max(v_1, v_2))]
+
+    table = np.zeros((16, 2, 3), dtype=int)  # unused triangles repeat an edge, so their area is 0
+    for case in range(1, 15):
+        included = [v for v in range(4) if case & (1 << v)]
+        excluded = [v for v in range(4) if not case & (1 << v)]
+        if len(included) == 2:  # quadrilateral
+            (a, b), (c, d) = included, excluded
+            table[case] = [[edge(a, c), edge(a, d), edge(b, d)], [edge(a, c), edge(b, d), edge(b, c)]]
+        else:  # triangle, around the vertex that differs from the other three
+            lone, others = (included[0], excluded) if len(included) == 1 else (excluded[0], included)
+            table[case, 0] = [edge(lone, v) for v in others]
+            table[case, 1] = table[case, 0, 0]
+    return table
+
+
+TRIANGLE_EDGES = get_triangle_edges()
+
+# Surface areas of recently imported rois, keyed by a checksum of the roi_coord_string and the resolution
+SURFACE_AREA_CACHE_SIZE = 512
+SURFACE_AREA_CACHE = OrderedDict()
+
+# signed distances are clipped to this value (mm), also used for slices without contours
+MAX_DISTANCE = 1000.
+
+# number of nearest contour samples used to find the nearest contour segment of a point
+CANDIDATE_COUNT = 4
+
+
+class VoxelGrid:
+    """
+    A voxel grid encompassing the provided rois, x and y are sampled by resolution, z uses the slices of the rois
+    """
+    def __init__(self, rois, resolution=1., padding=0):
+        """
+        :param rois: rois formatted as "sets of points" dictionaries or SliceGeometry objects
+        :type rois: list
+        :param resolution: voxel width in x and y (mm)
+        :type resolution: float
+        :param padding: number of voxels to add beyond the rois in x and y
+        :type padding: int
+        """
+        rois = [get_slice_geometry(roi) for roi in rois]
+        points = np.concatenate([roi.points for roi in rois])
+
+        self.resolution = float(resolution)
+        x_min, y_min = np.min(points[:, 0:2], axis=0)
+        x_max, y_max = np.max(points[:, 0:2], axis=0)
+        x_min, y_min = x_min - padding * self.resolution, y_min - padding * self.resolution
+        x_max, y_max = x_max + padding * self.resolution, y_max + padding * self.resolution
+        self.x = np.arange(x_min + self.resolution / 2., x_max + self.resolution / 2., self.resolution)
+        self.y = np.arange(y_min + self.resolution / 2., y_max + self.resolution / 2., self.resolution)
+
+        self.z = np.array(sorted(set([round(float(z), 2) for roi in rois for z in roi.polygons])))
+        self.z_index = {z: i for i, z in enumerate(self.z)}
+        thickness = np.abs(np.diff(self.z))
+        if len(thickness):
+            self.thickness = np.append(thickness, np.min(thickness))
+        else:
+            self.thickness = np.array([MIN_SLICE_THICKNESS])
+
+    @property
+    def shape(self):
+        return len(self.z), len(self.y), len(self.x)
+
+    @property
+    def voxel_volume(self):
+        """
+        :return: the volume (mm^3) of a voxel in each slice
+        :rtype: numpy.array
+        """
+        return self.thickness * self.resolution ** 2
+
+    def get_mask(self, roi):
+        """
+        Rasterize an roi onto this grid, the roi is clipped to the extent of the grid
+        :param roi: a "sets of points" formatted dictionary or a SliceGeometry object
+        :return: the rasterized roi
+        :rtype: ROIMask
+        """
+        roi = get_slice_geometry(roi)
+        mask = np.zeros(self.shape, dtype=bool)
+
+        for z, polygon in roi.polygons.items():
+            z_index = self.z_index.get(round(float(z), 2))
+            if polygon and z_index is not None:
+                # only check voxels within the bounds of the polygon
+                x_min, y_min, x_max, y_max = polygon.bounds
+                x_slice = slice(np.searchsorted(self.x, x_min), np.searchsorted(self.x, x_max, side='right'))
+                y_slice = slice(np.searchsorted(self.y, y_min), np.searchsorted(self.y, y_max, side='right'))
+                x, y = np.meshgrid(self.x[x_slice], self.y[y_slice])
+                if x.size:
+                    mask[z_index, y_slice, x_slice] = contains_xy(polygon, x, y)
+
+        return ROIMask(self, np.packbits(mask, axis=-1))
+
+
+class ROIMask:
+    """
+    An roi rasterized onto a VoxelGrid, stored as a bitmask packed along x
+    """
+    def __init__(self, grid, packed_mask):
+        """
+        :param grid: the grid used to create packed_mask
+        :type grid: VoxelGrid
+        :param packed_mask: return of numpy.packbits(mask, axis=-1), where mask has the shape of grid
+        :type packed_mask: numpy.array
+        """
+        self.grid = grid
+        self.packed_mask = packed_mask
+
+    def __and__(self, other):
+        return ROIMask(self.grid, np.bitwise_and(self.packed_mask, other.packed_mask))
+
+    @property
+    def voxel_count(self):
+        """
+        :return: number of voxels in each slice
+        :rtype: numpy.array
+        """
+        return np.sum(BIT_COUNT[self.packed_mask], axis=(1, 2), dtype=np.int64)
+
+    @property
+    def volume(self):
+        """
+        :return: volume in cm^3 of roi
+        :rtype: float
+        """
+        return round(float(np.sum(self.voxel_count * self.grid.voxel_volume)) / 1000., 2)
+
+    def overlap_volume(self, other):
+        """
+        :param other: another roi rasterized on the same grid
+        :type other: ROIMask
+        :return: the overlap volume (cm^3) of the two rois
+        :rtype: float
+        """
+        return (self & other).volume
+
+
+def surface_area(roi, resolution=1.):
+    """
+    Surface area of a triangle mesh of an roi.  Signed distances (mm) to the contours of each slice are linearly
+    interpolated between slices (i.e., shape-based interpolation), and the lateral surface is meshed with marching
+    tetrahedra.  Consistent with tools.roi_geometry.volume, the first and last slice of each contiguous block of
+    slices extend half a slice thickness, so these caps are added from the polygons directly.
+    :param roi: a "sets of points" formatted dictionary or a SliceGeometry object
+    :param resolution: voxel width in x and y (mm)
+    :type resolution: float
+    :return: surface area in cm^2
+    :rtype: float
+    """
+    roi = get_slice_geometry(roi)
+    grid = VoxelGrid([roi], resolution=resolution, padding=1)
+    polygons = {round(float(z), 2): polygon for z, polygon in roi.polygons.items()}
+    contours = {round(float(z), 2): contours for z, contours in roi.contours.items()}
+    thickness = np.min(grid.thickness)
+
+    area = 0.
+    slices = {}
+    for i, z in enumerate(grid.z):
+        # first and last slice of a block, if prev/next slice is not adjacent, assume non-contiguous ROI
+        for j in [-1, 1]:
+            if i + j < 0 or i + j == len(grid.z) or abs(z - grid.z[i + j]) > 2 * thickness:
+                if polygons.get(z):
+                    area += polygons[z].area + polygons[z].length * thickness / 2.
+            elif j == 1:
+                slices = {k: slices[k] for k in slices if k == i}  # the next slab only needs the current slice
+                for k in [i, i + 1]:
+                    if k not in slices:
+                        slices[k] = SignedDistanceSlice(contours.get(grid.z[k], []), grid.x, grid.y)
+                area += slab_surface_area(slices[i], slices[i + 1], grid.x, grid.y, z, grid.z[i + 1])
+
+    return round(area / 100., 3)
+
+
+class SignedDistanceSlice:
+    """
+    Signed distance (mm) from the voxel centers of a slice to its contours, positive inside the roi.
+    The inside of the roi is determined with the even-odd rule, so interior contours are holes.
+    Distances are only calculated as needed.
+    """
+    def __init__(self, contours, x, y):
+        """
+        :param contours: contours of the slice, as stored in SliceGeometry.contours
+        :type contours: list
+        :param x: x coordinates of the voxel centers
+        :type x: numpy.array
+        :param y: y coordinates of the voxel centers
+        :type y: numpy.array
+        """
+        self.contours = [contour[:, 0:2] for contour in contours if len(contour) > 2]
+        self.x, self.y = x, y
+        self.mask = rasterize_contours(self.contours, x, y)
+        self.distance = np.full(self.mask.shape, np.nan)
+        self.tree = None
+
+    def get_values(self, y_index, x_index):
+        """
+        :param y_index: y indices of the voxels
+        :type y_index: numpy.array
+        :param x_index: x indices of the voxels
+        :type x_index: numpy.array
+        :return: signed distances of the voxels
+        :rtype: numpy.array
+        """
+        missing = np.isnan(self.distance[y_index, x_index])
+        if np.any(missing):
+            flat_index = np.unique(np.ravel_multi_index((y_index[missing], x_index[missing]), self.mask.shape))
+            y_missing, x_missing = np.unravel_index(flat_index, self.mask.shape)
+            points = np.stack([self.x[x_missing], self.y[y_missing]], axis=1)
+            sign = np.where(self.mask[y_missing, x_missing], 1., -1.)
+            self.distance[y_missing, x_missing] = sign * self.distance_to_contours(points)
+        return self.distance[y_index, x_index]
+
+    def distance_to_contours(self, points):
+        """
+        :param points: x, y coordinates with shape (n, 2)
+        :type points: numpy.array
+        :return: the distance from each point to the nearest contour segment, MAX_DISTANCE if there are no contours
+        :rtype: numpy.array
+        """
+        if not self.contours:
+            return np.full(len(points), MAX_DISTANCE)
+
+        if self.tree is None:
+            # sample each segment, the segments of the nearest samples are candidates for the nearest segment
+            self.start = np.concatenate(self.contours)
+            self.segment = np.concatenate([np.roll(contour, -1, axis=0) for contour in self.contours]) - self.start
+            self.length_squared = np.maximum(np.sum(self.segment ** 2, axis=1), np.finfo(float).eps)
+            spacing = (self.x[1] - self.x[0]) / 2. if len(self.x) > 1 else 1.
+            count = np.maximum(np.ceil(np.sqrt(self.length_squared) / spacing).astype(int), 1)
+            self.sample_segment = np.repeat(np.arange(len(self.start)), count)
+            offset = np.arange(len(self.sample_segment)) - np.repeat(np.cumsum(count) - count, count)
+            t = offset / np.repeat(count, count)
+            self.tree = cKDTree(self.start[self.sample_segment] + t[:, np.newaxis] * self.segment[self.sample_segment])
+
+        k = min(CANDIDATE_COUNT, len(self.sample_segment))
+        candidates = self.sample_segment[self.tree.query(points, k=k)[1].reshape(len(points), k)]
+
+        a, ab = self.start[candidates], self.segment[candidates]
+        ap = points[:, np.newaxis, :] - a
+        t = np.clip(np.sum(ap * ab, axis=2) / self.length_squared[candidates], 0., 1.)
+        distance = np.sqrt(np.min(np.sum((ap - t[:, :, np.newaxis] * ab) ** 2, axis=2), axis=1))
+        return np.minimum(distance, MAX_DISTANCE)
+
+
+def rasterize_contours(contours, x, y):
+    """
+    Scan line rasterization of contours with the even-odd rule
+    :param contours: closed contours, each with shape (n, 2)
+    :type contours: list
+    :param x: x coordinates of the voxel centers, must be increasing
+    :type x: numpy.array
+    :param y: y coordinates of the voxel centers, must be increasing
+    :type y: numpy.array
+    :return: boolean mask with shape (len(y), len(x)), True for voxel centers inside the contours
+    :rtype: numpy.array
+    """
+    if not contours:
+        return np.zeros((len(y), len(x)), dtype=bool)
+
+    start = np.concatenate(contours)
+    end = np.concatenate([np.roll(contour, -1, axis=0) for contour in contours])
+    y_min, y_max = np.minimum(start[:, 1], end[:, 1]), np.maximum(start[:, 1], end[:, 1])
+
+    # each edge crosses the rows with y_min <= y < y_max, so vertices are not counted twice
+    row_start = np.searchsorted(y, y_min)
+    count = np.searchsorted(y, y_max) - row_start
+    edge = np.repeat(np.arange(len(start)), count)
+    row = np.repeat(row_start, count) + np.arange(len(edge)) - np.repeat(np.cumsum(count) - count, count)
+
+    p0, p1 = start[edge], end[edge]
+    x_crossing = p0[:, 0] + (y[row] - p0[:, 1]) * (p1[:, 0] - p0[:, 0]) / (p1[:, 1] - p0[:, 1])
+
+    # voxels right of an odd number of crossings are inside
+    column = np.searchsorted(x, x_crossing, side='right')
+    crossings = np.bincount(row * (len(x) + 1) + column, minlength=len(y) * (len(x) + 1))
+    return (np.cumsum(crossings.reshape(len(y), len(x) + 1), axis=1)[:, :len(x)] % 2).astype(bool)
+
+
+def slab_surface_area(slice_0, slice_1, x, y, z_0, z_1):
+    """
+    Area of the lateral surface between two adjacent slices using marching tetrahedra
+    :param slice_0: signed distances of the lower slice
+    :type slice_0: SignedDistanceSlice
+    :param slice_1: signed distances of the upper slice
+    :type slice_1: SignedDistanceSlice
+    :param x: x coordinates of the voxel centers
+    :type x: numpy.array
+    :param y: y coordinates of the voxel centers
+    :type y: numpy.array
+    :param z_0: z coordinate of slice_0
+    :type z_0: float
+    :param z_1: z coordinate of slice_1
+    :type z_1: float
+    :return: surface area in mm^2
+    :rtype: float
+    """
+    ny, nx = len(y) - 1, len(x) - 1
+    slices = [slice_0, slice_1]
+
+    # the 8 corner values of each cube between the slices
+    corners = [slices[dz].mask[dy:dy + ny, dx:dx + nx] for dz, dy, dx in CUBE_CORNERS]
+    mixed = np.logical_or.reduce(corners) & ~np.logical_and.reduce(corners)
+    cube_y, cube_x = np.nonzero(mixed)
+    if not len(cube_x):
+        return 0.
+
+    # calculate the distances of each slice at once
+    values = [slices[dz].get_values(np.concatenate([cube_y + dy for dy, dx in [(0, 0), (0, 1), (1, 0), (1, 1)]]),
+                                    np.concatenate([cube_x + dx for dy, dx in [(0, 0), (0, 1), (1, 0), (1, 1)]]))
+              for dz in (0, 1)]
+    values = np.concatenate([value.reshape(4, -1) for value in values]).T  # same order as CUBE_CORNERS
+
+    points = np.stack([np.stack([x[cube_x + dx], y[cube_y + dy], np.full(len(cube_x), [z_0, z_1][dz])], axis=1)
+                       for dz, dy, dx in CUBE_CORNERS], axis=1)
+
+    # evaluate the tetrahedra of all cubes at once
+    return tetrahedron_surface_area(values[:, TETRAHEDRA].reshape(-1, 4), points[:, TETRAHEDRA].reshape(-1, 4, 3))
+
+
+def tetrahedron_surface_area(values, points):
+    """
+    :param values: signed distances of the 4 vertices of each tetrahedron, shape (n, 4)
+    :type values: numpy.array
+    :param points: coordinates of the 4 vertices of each tetrahedron, shape (n, 4, 3)
+    :type points: numpy.array
+    :return: total area of the iso-surface (signed distance of 0) within the tetrahedra
+    :rtype: float
+    """
+    included = values > 0
+    case = np.dot(included, [1, 2, 4, 8])
+    crossed = (case > 0) & (case < 15)
+    values, points, case = values[crossed], points[crossed], case[crossed]
+
+    # the iso-surface point on each edge, interpolated from the signed distances of its vertices
+    a, b = TETRAHEDRON_EDGES[:, 0], TETRAHEDRON_EDGES[:, 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = values[:, a] / (values[:, a] - values[:, b])
+    t = np.where(np.isfinite(t), t, 0.)  # edges that are not crossed are only used by degenerate triangles
+    edge_points = points[:, a] + t[:, :, np.newaxis] * (points[:, b] - points[:, a])
+
+    # two triangles per tetrahedron, shape (n, 2, 3, 3)
+    triangles = edge_points[np.arange(len(case))[:, np.newaxis, np.newaxis], TRIANGLE_EDGES[case]]
+    cross = np.cross(triangles[:, :, 1] - triangles[:, :, 0], triangles[:, :, 2] - triangles[:, :, 0])
+    return float(np.sum(np.linalg.norm(cross, axis=2)) / 2.)
+
+
+def cached_surface_area(roi_coord_string, roi=None, resolution=1.):
+    """
+    Surface area of an roi, reusing the result if the same roi_coord_string was recently calculated (e.g., a
+    structure set shared by several plans)
+    :param roi_coord_string: roi string representation of an roi as formatted in the SQL database
+    :type roi_coord_string: str
+    :param roi: roi_coord_string as a "sets of points" formatted dictionary or a SliceGeometry object, if available
+    :param resolution: voxel width in x and y (mm)
+    :type resolution: float
+    :return: surface area (cm^2) of a triangle mesh of the rasterized roi
+    :rtype: float
+    """
+    key = (hashlib.md5(roi_coord_string.encode()).hexdigest(), float(resolution))
+    if key in SURFACE_AREA_CACHE:
+        SURFACE_AREA_CACHE.move_to_end(key)
+        return SURFACE_AREA_CACHE[key]
+
+    if roi is None:
+        roi = get_planes_from_string(roi_coord_string)
+    area = surface_area(roi, resolution=resolution)
+
+    SURFACE_AREA_CACHE[key] = area
+    if len(SURFACE_AREA_CACHE) > SURFACE_AREA_CACHE_SIZE:
+        SURFACE_AREA_CACHE.popitem(last=False)
+
+    return area
+
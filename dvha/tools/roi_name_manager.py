@@ -14,6 +14,7 @@ Code to create and edit a the roi name mapping, calculate data used to plot map
 import os
 from copy import deepcopy
 import difflib
+from dvha.db.sql_columns import dvh_pyramid
 from dvha.db.sql_to_python import QuerySQL
 from dvha.db.sql_connector import DVH_SQL
 from dvha.paths import PREF_DIR
@@ -780,7 +781,8 @@ def get_physician_from_uid(uid):
 
 def update_uncategorized_rois_in_database():
     roi_map = DatabaseROIs()
-    dvh_data = QuerySQL('DVHs', "physician_roi = 'uncategorized'")
+    dvh_columns = {'dvh_string'}.union(set(dvh_pyramid.values()))  # only roi names and study data are needed
+    dvh_data = QuerySQL('DVHs', "physician_roi = 'uncategorized'", ignored_columns=dvh_columns)
 
     with DVH_SQL() as cnx:
         for i in range(len(dvh_data.roi_name)):
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# tools.session.py
+"""
+Save and load DVHA session files (.dvha). A session file is a zip archive with a JSON manifest of versioned metadata,
+a pickle of the session data with its numerical arrays removed, and each array stored as a compressed .npy file.
+Arrays are named by their keys in the session data (e.g., arrays/group_data/1/dvh/dvh.npy). Lists of 1D arrays
+(e.g., DTHs) are stored as one array of concatenated values and one of offsets. Arrays are read directly into numpy
+on load, rather than unpickled element by element. Query data (DVHs, table columns, and stats data) are stored as plain
+data, and their DVHA objects are rebuilt by DVHAMainFrame.load_group_save_data.
+Sessions saved by older versions of DVHA are plain pickles, and are still loaded with load_object_from_file.
+"""
+# Copyright (c) 2016-2019 Dan Cutright
+# This file is part of DVH Analytics, released under a BSD license.
+#    See the file LICENSE included with this distribution, also
+#    available at https://github.com/cutright/DVH-Analytics
+
+import json
+import numpy as np
+import pickle
+import zipfile
+from datetime import datetime
+from dvha._version import __version__
+from dvha.tools.errors import SessionFileError
+from dvha.tools.utilities import load_object_from_file
+
+
+SESSION_FORMAT = 'dvha-session'
+SESSION_FORMAT_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+PICKLE_FILE = 'session.pickle'
+MIN_ARRAY_SIZE = 64  # smaller arrays are left in the pickle
+ARRAY_KINDS = 'biufcmM'  # numerical, boolean, and datetime dtypes, object arrays are left in the pickle
+COMPRESS_LEVEL = 1  # zero padded DVHs compress well at the fastest deflate level
+
+
+class SessionPickler(pickle.Pickler):
+    """
+    Pickle session data, replacing numerical arrays with references to arrays that are written separately
+    """
+    def __init__(self, file):
+        pickle.Pickler.__init__(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.arrays = {}
+        self.array_names = {}
+        self.persistent_ids = {}
+        self.objects = []  # keep stored objects alive so their ids are not reused during the dump
+
+    def set_array_names(self, obj, name='arrays'):
+        """
+        Name the arrays in the nested dicts of obj by their keys, arrays not found here are numbered
+        :param obj: the session data, call before dump
+        :param name: the name of obj
+        :type name: str
+        """
+        if type(obj) is dict:
+            for key, value in obj.items():
+                self.set_array_names(value, '%s/%s' % (name, str(key).replace('/', '_')))
+        elif is_stored_array(obj) or is_ragged_array(obj):
+            self.array_names.setdefault(id(obj), name)
+
+    def persistent_id(self, obj):
+        if id(obj) in self.persistent_ids:
+            return self.persistent_ids[id(obj)]
+
+        name = self.array_names.get(id(obj), 'arrays/%s' % len(self.arrays))
+        if is_stored_array(obj):
+            pid = ('array', self.add_array(obj, name))
+        elif is_ragged_array(obj):
+            offsets = np.cumsum([0] + [len(array) for array in obj])
+            pid = ('ragged', self.add_array(np.concatenate(obj), name + '/values'),
+                   self.add_array(offsets, name + '/offsets'))
+        else:
+            return None
+
+        self.persistent_ids[id(obj)] = pid
+        self.objects.append(obj)
+        return pid
+
+    def add_array(self, array, name):
+        file_name = '%s.npy' % name
+        if file_name in self.arrays:
+            file_name = '%s_%s.npy' % (name, len(self.arrays))
+        self.arrays[file_name] = array
+        return file_name
+
+
+class SessionUnpickler(pickle.Unpickler):
+    """
+    Unpickle session data, reading referenced arrays from the session archive
+    """
+    def __init__(self, file, archive):
+        pickle.Unpickler.__init__(self, file)
+        self.archive = archive
+        self.loaded = {}
+
+    def persistent_load(self, pid):
+        if pid not in self.loaded:
+            if pid[0] == 'array':
+                self.loaded[pid] = self.read_array(pid[1])
+            elif pid[0] == 'ragged':
+                values, offsets = self.read_array(pid[1]), self.read_array(pid[2])
+                self.loaded[pid] = np.split(values, offsets[1:-1])
+            else:
+                raise pickle.UnpicklingError("Unsupported persistent id: %s" % pid[0])
+        return self.loaded[pid]
+
+    def read_array(self, name):
+        with self.archive.open(name) as infile:
+            return np.lib.format.read_array(infile, allow_pickle=False)
+
+
+def is_stored_array(obj):
+    return type(obj) is np.ndarray and obj.dtype.kind in ARRAY_KINDS and obj.size >= MIN_ARRAY_SIZE
+
+
+def is_ragged_array(obj):
+    """
+    :return: True if obj is a list of 1D numerical arrays with the same dtype
+    :rtype: bool
+    """
+    if type(obj) is not list or not obj or type(obj[0]) is not np.ndarray or obj[0].dtype.kind not in ARRAY_KINDS:
+        return False
+    dtype = obj[0].dtype
+    return all(type(array) is np.ndarray and array.ndim == 1 and array.dtype == dtype for array in obj) and \
+        sum(len(array) for array in obj) >= MIN_ARRAY_SIZE
+
+
+def save_session(save_data, abs_file_path):
+    """
+    :param save_data: session data from MainFrame.save_data_obj
+    :type save_data: dict
+    :param abs_file_path: file path of the session file
+    :type abs_file_path: str
+    """
+    with zipfile.ZipFile(abs_file_path, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+        archive.compresslevel = COMPRESS_LEVEL  # only applied by Python 3.7+
+        with archive.open(PICKLE_FILE, 'w', force_zip64=True) as outfile:
+            pickler = SessionPickler(outfile)
+            pickler.set_array_names(save_data)
+            pickler.dump(save_data)
+
+        for name, array in pickler.arrays.items():
+            with archive.open(name, 'w', force_zip64=True) as outfile:
+                np.lib.format.write_array(outfile, array, allow_pickle=False)
+
+        manifest = {'format': SESSION_FORMAT,
+                    'format_version': SESSION_FORMAT_VERSION,
+                    'dvha_version': __version__,
+                    'time_stamp': str(datetime.now()),
+                    'arrays': {name: {'shape': list(array.shape), 'dtype': array.dtype.str}
+                               for name, array in pickler.arrays.items()}}
+        archive.writestr(MANIFEST_FILE, json.dumps(manifest, indent=2))
+
+
+def load_session(abs_file_path):
+    """
+    :param abs_file_path: file path of a session file, saved with save_session or pickled by older versions of DVHA
+    :type abs_file_path: str
+    :return: session data
+    :rtype: dict
+    """
+    if not zipfile.is_zipfile(abs_file_path):
+        try:
+            return load_object_from_file(abs_file_path)
+        except Exception as e:
+            raise SessionFileError(get_version_error_message(None, e))
+
+    with zipfile.ZipFile(abs_file_path, 'r') as archive:
+        manifest = get_session_manifest(archive)
+        with archive.open(PICKLE_FILE) as infile:
+            try:
+                return SessionUnpickler(infile, archive).load()
+            except Exception as e:
+                # Session data are pickled DVHA objects, which may not be compatible with other versions of DVHA
+                raise SessionFileError(get_version_error_message(manifest.get('dvha_version'), e))
+
+
+def get_session_manifest(archive):
+    """
+    :param archive: an opened session file
+    :type archive: zipfile.ZipFile
+    :return: the session manifest, if the session file format is supported by this version of DVHA
+    :rtype: dict
+    """
+    try:
+        manifest = json.loads(archive.read(MANIFEST_FILE).decode('utf-8'))
+    except (KeyError, ValueError):
+        raise SessionFileError("This file is not a DVHA session file.")
+
+    if manifest.get('format') != SESSION_FORMAT:
+        raise SessionFileError("This file is not a DVHA session file.")
+    if manifest.get('format_version', 0) > SESSION_FORMAT_VERSION:
+        raise SessionFileError("This session was saved with DVHA %s and a newer session file format. "
+                               "Please update DVHA to open it." % manifest.get('dvha_version'))
+    return manifest
+
+
+def get_version_error_message(saved_version, error):
+    """
+    :param saved_version: the DVHA version that saved the session, None if unknown
+    :type saved_version: str
+    :param error: the exception raised while loading the session
+    :return: error message for a session that could not be loaded
+    :rtype: str
+    """
+    if saved_version == __version__:
+        return "This session file could not be read.\n%s" % error
+    saved_version = 'an older version' if saved_version is None else 'version %s' % saved_version
+    return "This session was saved with DVHA %s and could not be opened with DVHA %s.\n%s" % \
+           (saved_version, __version__, error)
@@ -12,7 +12,10 @@ in Regression and Control Chart tabs
 #    See the file LICENSE included with this distribution, also
 #    available at https://github.com/cutright/DVH-Analytics
 
+from dateutil.parser import parse as date_parser
 import numpy as np
+import warnings
+from scipy import linalg as scipy_linalg
 from scipy import stats as scipy_stats
 from sklearn import linear_model
 from sklearn.metrics import mean_squared_error, r2_score
@@ -20,8 +23,11 @@ from regressors import stats as regressors_stats
 from dvha.db import sql_columns
 
 
+STAT_TYPES = ['min', 'mean', 'median', 'max']
+
+
 class StatsData:
-    def __init__(self, dvhs, table_data, group=1):
+    def __init__(self, dvhs, table_data, group=1, save_data=None):
         """
         Class used to to collect data for Regression and Control Chart
         This process is different than for Time Series since regressions require all variables to be the same length
@@ -29,6 +35,9 @@ class StatsData:
         :type dvhs: DVH
         :param table_data: table data other than from DVHs
         :type table_data: dict
+        :param save_data: variable data from get_save_data (e.g., from a saved session), used rather than collecting
+        the variables from dvhs and table_data
+        :type save_data: dict
         """
         self.dvhs = dvhs
         self.table_data = table_data
@@ -38,65 +47,96 @@ class StatsData:
         self.correlation_variables = list(self.column_info)
         self.correlation_variables.sort()
 
-        self.__map_data()
+        if save_data is not None:
+            self.load_save_data(save_data)
+        else:
+            self.__map_data()
 
     def __map_data(self):
         self.data = {}
-        stat_types = ['min', 'mean', 'median', 'max']
+        self.__set_index_maps()
         for var in self.correlation_variables:
             if var in self.column_info.keys():
                 var_name = self.column_info[var]['var_name']
                 table = self.column_info[var]['table']
+                units = self.column_info[var]['units']
 
                 if table == 'DVHs':
-                    self.data[var] = {'units': self.column_info[var]['units'],
-                                      'values': getattr(self.dvhs, var_name)}
+                    values = getattr(self.dvhs, var_name)
+                    self.data[var] = {'units': units,
+                                      'values': list(values) if 'Date' in var else to_float_array(values)}
 
                 # single value variables
                 elif table == 'Plans':
-                    src = self.table_data[table]
-                    self.data[var] = {'units': self.column_info[var]['units'],
-                                      'values': [getattr(src, var_name)[self.get_plan_index(uid)] for uid in self.uids]}
+                    values = getattr(self.table_data[table], var_name)
+                    if 'Date' in var:  # dates are kept as strings
+                        values = [values[i] if i > -1 else 'None' for i in self.plan_index]
+                    else:
+                        values = to_float_array(values)
+                        values = np.where(self.plan_index > -1, values[self.plan_index], np.nan)
+                    self.data[var] = {'units': units, 'values': values}
 
                 # multi value variables
                 elif table == 'Beams':
-                    src = self.table_data[table]
+                    grouped = self.get_grouped_beam_values(var_name)
 
                     if str_starts_with_any_in_list(var, ['Beam Complexity', 'Beam Area', 'Control Point MU',
                                                          'Beam Perimeter', 'Beam Energy']):
                         # stats of these four variable types have min, mean, median, and max types in DB
                         # The following will take min, mean, median, or max of all values for a UID based on var type
                         # Example, if var_name == Beam Complexity (Max), the following will return the Max of these
-                        temp = []
-                        for uid in self.uids:
-                            indices = self.get_beam_indices(uid)
-                            beam_data = getattr(self.table_data['Beams'], var_name)
-                            values = [beam_data[i] for i in indices if beam_data[i] != 'None']
-                            for stat in stat_types:
-                                if stat in var.lower():
-                                    if values:
-                                        temp.append(getattr(np, stat)(values))
-                                    else:
-                                        temp.append(None)
-                        self.data[var] = {'units': self.column_info[var]['units'],
-                                          'values': temp}
+                        for stat in STAT_TYPES:
+                            if stat in var.lower():
+                                self.data[var] = {'units': units,
+                                                  'values': get_grouped_stat(grouped, stat)[self.beam_group]}
                     else:
-                        temp = {s: [] for s in stat_types}
-                        for uid in self.uids:
-                            for stat in stat_types:
-                                values = self.get_src_values(src, var_name, uid)
-                                values = [v for v in values if v != 'None']
-                                if values:
-                                    temp[stat].append(getattr(np, stat)(values))
-                                else:
-                                    temp[stat].append(None)
-
-                        for stat in stat_types:
+                        for stat in STAT_TYPES:
                             corr_key = "%s (%s)" % (var, stat.capitalize())
-                            self.data[corr_key] = {'units': self.column_info[var]['units'],
-                                                   'values': temp[stat]}
+                            self.data[corr_key] = {'units': units,
+                                                   'values': get_grouped_stat(grouped, stat)[self.beam_group]}
         self.validate_data()
 
+    def __set_index_maps(self):
+        """
+        Map each row of the DVH data to its row in the Plans table and its group of rows in the Beams table, so that
+        each variable can be collected with array indexing rather than searching for uids
+        """
+        uids = self.uids
+
+        plan_uids = self.table_data['Plans'].study_instance_uid
+        plan_rows = {}
+        for i, uid in enumerate(plan_uids):
+            plan_rows.setdefault(uid, i)  # keep the first row, consistent with list.index
+        self.plan_index = np.array([plan_rows.get(uid, -1) for uid in uids], dtype=int)
+
+        # one group per unique uid of the DVH data, beam_group maps each DVH row to its group
+        groups = {}
+        self.beam_group = np.array([groups.setdefault(uid, len(groups)) for uid in uids], dtype=int)
+        beam_uids = self.table_data['Beams'].study_instance_uid
+        beam_codes = np.array([groups.get(uid, -1) for uid in beam_uids], dtype=int)
+
+        # column of each beam row within a (group count x max beams per group) array
+        included = np.where(beam_codes > -1)[0]
+        order = included[np.argsort(beam_codes[included], kind='stable')]
+        codes = beam_codes[order]
+        counts = np.bincount(codes, minlength=len(groups))
+        starts = np.cumsum(counts) - counts
+        self.beam_rows = order
+        self.beam_cells = (codes, np.arange(len(order)) - starts[codes])
+        self.beam_shape = (len(groups), int(np.max(counts)) if len(counts) else 0)
+
+    def get_grouped_beam_values(self, var_name):
+        """
+        :param var_name: column of the Beams table
+        :type var_name: str
+        :return: values of each group of beams (one group per uid), padded with np.nan
+        :rtype: np.ndarray
+        """
+        values = to_float_array(getattr(self.table_data['Beams'], var_name))
+        grouped = np.full(self.beam_shape, np.nan)
+        grouped[self.beam_cells] = values[self.beam_rows]
+        return grouped
+
     def validate_data(self):
         """
         Remove any variables that are constant to avoid crash on regression
@@ -107,12 +147,31 @@ class StatsData:
                 if var_name != 'Simulation Date':
                     bad_vars.append(var_name)
             else:
-                values = [float(val) for val in var_obj['values'] if val != 'None' and val is not None]
-                if not any(np.diff(values).tolist()):
+                values = to_float_array(var_obj['values'])
+                values = values[~np.isnan(values)]
+                if not values.size or np.all(values == values[0]):
                     bad_vars.append(var_name)
 
         for var in bad_vars:
             self.data.pop(var)
+        self.clear_cache()
+
+    def get_save_data(self):
+        """
+        :return: the variables of this object, including those added or edited by the user, as plain data
+        :rtype: dict
+        """
+        return {'data': self.data,
+                'correlation_variables': self.correlation_variables}
+
+    def load_save_data(self, save_data):
+        """
+        :param save_data: the return of get_save_data
+        :type save_data: dict
+        """
+        self.data = save_data['data']
+        self.correlation_variables = save_data['correlation_variables']
+        self.clear_cache()
 
     def update_endpoints_and_radbio(self):
         """
@@ -124,7 +183,7 @@ class StatsData:
                 for var in self.dvhs.endpoints['defs']['label']:
                     if var not in self.variables:
                         self.data[var] = {'units': '',
-                                          'values': self.dvhs.endpoints['data'][var]}
+                                          'values': to_float_array(self.dvhs.endpoints['data'][var])}
 
                 for var in self.variables:
                     if var[0:2] in {'D_', 'V_'}:
@@ -133,23 +192,12 @@ class StatsData:
 
             if self.dvhs.eud:
                 self.data['EUD'] = {'units': 'Gy',
-                                    'values': self.dvhs.eud}
+                                    'values': to_float_array(self.dvhs.eud)}
             if self.dvhs.ntcp_or_tcp:
                 self.data['NTCP or TCP'] = {'units': '',
-                                            'values': self.dvhs.ntcp_or_tcp}
+                                            'values': to_float_array(self.dvhs.ntcp_or_tcp)}
             self.validate_data()
 
-    @staticmethod
-    def get_src_values(src, var_name, uid):
-        uid_indices = [i for i, x in enumerate(src.study_instance_uid) if x == uid]
-        return [getattr(src, var_name)[i] for i in uid_indices]
-
-    def get_plan_index(self, uid):
-        return self.table_data['Plans'].study_instance_uid.index(uid)
-
-    def get_beam_indices(self, uid):
-        return [i for i, x in enumerate(self.table_data['Beams'].study_instance_uid) if x == uid]
-
     def get_bokeh_data(self, x, y):
         """
         Get data in a format compatible with bokeh's ColumnDataSource.data
@@ -169,8 +217,8 @@ class StatsData:
             return {'uid': self.uids,
                     'mrn': self.mrns,
                     'date': self.sim_study_dates,
-                    'x': self.data[x]['values'],
-                    'y': self.data[y]['values']}
+                    'x': to_list(self.data[x]['values']),
+                    'y': to_list(self.data[y]['values'])}
         return {key: [] for key in ['uid', 'mrn', 'date', 'x', 'y']}
 
     @property
@@ -185,6 +233,20 @@ class StatsData:
     def sim_study_dates(self):
         return self.data['Simulation Date']['values']
 
+    @property
+    def time_series_index(self):
+        """
+        Simulation dates are parsed once, and cached with their sort order for the Time Series tab
+        :return: row indices sorted by simulation date, excluding unparsable dates, and the sorted dates
+        :rtype: dict
+        """
+        if getattr(self, '_time_series_index', None) is None:
+            dates = to_datetime64(self.sim_study_dates)
+            order = np.argsort(dates, kind='mergesort')
+            order = order[~np.isnat(dates[order])]
+            self._time_series_index = {'order': order, 'dates': dates[order]}
+        return self._time_series_index
+
     @property
     def variables(self):
         return [var for var in list(self.data) if var != 'Simulation Date']
@@ -209,29 +271,12 @@ class StatsData:
         :type include_patient_info: bool
         :return: X, y or X, y, mrn, uid, dates
         """
-        data, mrn, uid, dates = [], [], [], []
-        y_var_data = []
-        for i, value in enumerate(self.data[y_variable]['values']):
-            y_var_data.append([value, np.nan][value == 'None'])
-            mrn.append(self.mrns[i])
-            uid.append(self.uids[i])
-            dates.append(self.sim_study_dates[i])
-
-        data.append(y_var_data)
-        for var in x_variables:
-            x_var_data = []
-            for value in self.data[var]['values']:
-                x_var_data.append([value, np.nan][value == 'None'])
-            data.append(x_var_data)
-
-        data = np.array(data)
-        bad_indices = get_index_of_nan(data)
-
-        for bad_index in bad_indices[::-1]:
-            data = np.delete(data, bad_index, 1)
-            mrn.pop(bad_index)
-            uid.pop(bad_index)
-            dates.pop(bad_index)
+        data = np.array([to_float_array(self.data[var]['values']) for var in [y_variable] + x_variables])
+        good_indices = np.where(~np.any(np.isnan(data), axis=0))[0]
+        data = data[:, good_indices]
+        mrn = [self.mrns[i] for i in good_indices]
+        uid = [self.uids[i] for i in good_indices]
+        dates = [self.sim_study_dates[i] for i in good_indices]
 
         X = np.transpose(data[1:])
         y = data[0]
@@ -240,9 +285,47 @@ class StatsData:
             return X, y
         return X, y, mrn, uid, dates
 
+    def get_backward_elimination(self, y_variable, x_variables, threshold=0.05):
+        """
+        Remove the independent variable with the highest p-value until all p-values are below threshold (or one
+        variable remains). The least squares fit is factored once (QR), and each removal downdates the factorization,
+        unless the removal changes which studies have complete data
+        :param y_variable: dependent variable
+        :type y_variable: str
+        :param x_variables: independent variables
+        :type x_variables: list
+        :param threshold: maximum p-value of the remaining variables
+        :type threshold: float
+        :return: the remaining independent variables
+        :rtype: list
+        """
+        x_variables = list(x_variables)
+        x_data = np.array([to_float_array(self.data[var]['values']) for var in x_variables]).T
+        y_data = to_float_array(self.data[y_variable]['values'])
+        x_data = x_data.reshape(len(y_data), len(x_variables))
+
+        missing = np.isnan(x_data)
+        columns = list(range(len(x_variables)))
+        rows, ols = None, None
+        while len(columns) > 1:
+            new_rows = ~np.any(missing[:, columns], axis=1) & ~np.isnan(y_data)
+            if ols is None or np.any(rows != new_rows):
+                rows = new_rows
+                ols = IncrementalOLS(x_data[rows][:, columns], y_data[rows])
+
+            p_values = ols.p_values[1:]  # exclude y-intercept
+            index = int(np.argmax(p_values))
+            if not p_values[index] > threshold:
+                break
+            ols.remove_column(index + 1)
+            columns.pop(index)
+
+        return [x_variables[i] for i in columns]
+
     def add_variable(self, variable, values, units=''):
         if variable not in list(self.data):
-            self.data[variable] = {'units': units, 'values': values}
+            self.data[variable] = {'units': units, 'values': to_float_array(values)}
+            self.clear_cache()
         if variable not in self.correlation_variables:
             self.correlation_variables.append(variable)
             self.correlation_variables.sort()
@@ -250,12 +333,14 @@ class StatsData:
     def del_variable(self, variable):
         if variable in list(self.data):
             self.data.pop(variable)
+            self.clear_cache()
         if variable in self.correlation_variables:
             index = self.correlation_variables.index(variable)
             self.correlation_variables.pop(index)
 
     def set_variable_data(self, variable, data, units=None):
-        self.data[variable]['values'] = data
+        self.data[variable]['values'] = to_float_array(data)
+        self.clear_cache()
         if units is not None:
             self.data[variable]['units'] = units
 
@@ -291,68 +376,253 @@ class StatsData:
         source_data = {'corr': {sk: [] for sk in s_keys},
                        'line': {'x': [0.5, var_count - 0.5], 'y': [var_count - 0.5, 0.5]}}
 
-        min_size, max_size = 3, 20
+        # indices of each category in the cached correlation matrix, -1 for extra_vars (not in this group's data)
+        corr = self.correlation
+        corr_index = {var: i for i, var in enumerate(corr['variables'])}
+        index = np.array([-1 if c in extra_vars else corr_index[c] for c in categories], dtype=int)
+
+        x, y = np.meshgrid(np.arange(var_count), np.arange(var_count), indexing='ij')
+        x, y = x.flatten(), y.flatten()
+        pairs = (x > y) if self.group == 1 else (x < y)
+        pairs = pairs & (index[x] > -1) & (index[y] > -1)
+        x, y = x[pairs], y[pairs]
+        i, j = index[x], index[y]
+
         removed_mrns = set()
-        for x in range(var_count):
-            for y in range(var_count):
-                if x > y and self.group == 1 or x < y and self.group == 2:
-                    if categories[x] not in extra_vars and categories[y] not in extra_vars:
-
-                        bad_indices = [i for i, v in enumerate(self.data[categories[x]]['values'])
-                                       if type(v) in [str, type(None)]]
-                        bad_indices.extend([i for i, v in enumerate(self.data[categories[y]]['values'])
-                                            if type(v) in [str, type(None)]])
-                        bad_indices = list(set(bad_indices))
-                        removed_mrns = removed_mrns.union(set(self.mrns[i] for i in bad_indices))
-
-                        x_data = [v for i, v in enumerate(self.data[categories[x]]['values']) if i not in bad_indices]
-                        y_data = [v for i, v in enumerate(self.data[categories[y]]['values']) if i not in bad_indices]
-
-                        if x_data and len(x_data) == len(y_data):
-                            r, p_value = scipy_stats.pearsonr(x_data, y_data)
-                        else:
-                            r, p_value = 0, 0
-                        if np.isnan(r):
-                            r = 0
-
-                        sign = ['neg', 'pos'][r >= 0]
-                        color = getattr(options, 'CORRELATION_%s_COLOR_%s' % (sign.upper(), self.group))
-                        source_data['corr']['color'].append(color)
-                        source_data['corr']['r'].append(r)
-                        source_data['corr']['p'].append(p_value)
-                        source_data['corr']['alpha'].append(abs(r))
-                        source_data['corr']['size'].append(((max_size - min_size) * abs(r)) + min_size)
-                        source_data['corr']['x'].append(x + 0.5)  # 0.5 offset due to bokeh 0.12.9 bug
-                        source_data['corr']['y'].append(var_count - y - 0.5)  # 0.5 offset due to bokeh 0.12.9 bug
-                        source_data['corr']['x_name'].append(categories_for_label[x])
-                        source_data['corr']['y_name'].append(categories_for_label[y])
-                        source_data['corr']['group'].append(self.group)
-
-                        try:
-                            x_norm, x_p = scipy_stats.normaltest(x_data)
-                        except ValueError:
-                            x_p = 'N/A'
-                        try:
-                            y_norm, y_p = scipy_stats.normaltest(y_data)
-                        except ValueError:
-                            y_p = 'N/A'
-
-                        source_data['corr']['x_normality'].append(x_p)
-                        source_data['corr']['y_normality'].append(y_p)
+        if len(x):
+            used = np.unique(np.concatenate((i, j)))
+            bad_rows = np.where(np.any(corr['missing'][:, used], axis=1))[0]
+            removed_mrns = set(self.mrns[row] for row in bad_rows)
+
+        r, p_value = corr['r'][i, j], corr['p'][i, j]
+        colors = [getattr(options, 'CORRELATION_%s_COLOR_%s' % (sign, self.group)) for sign in ['NEG', 'POS']]
+        min_size, max_size = 3, 20
+
+        source_data['corr']['color'] = [colors[int(value >= 0)] for value in r]
+        source_data['corr']['r'] = r.tolist()
+        source_data['corr']['p'] = p_value.tolist()
+        source_data['corr']['alpha'] = np.abs(r).tolist()
+        source_data['corr']['size'] = ((max_size - min_size) * np.abs(r) + min_size).tolist()
+        source_data['corr']['x'] = (x + 0.5).tolist()  # 0.5 offset due to bokeh 0.12.9 bug
+        source_data['corr']['y'] = (var_count - y - 0.5).tolist()  # 0.5 offset due to bokeh 0.12.9 bug
+        source_data['corr']['x_name'] = [categories_for_label[k] for k in x]
+        source_data['corr']['y_name'] = [categories_for_label[k] for k in y]
+        source_data['corr']['group'] = [self.group] * len(x)
+        source_data['corr']['x_normality'] = [corr['normality'][k] for k in i]
+        source_data['corr']['y_normality'] = [corr['normality'][k] for k in j]
 
         return {'source_data': source_data, 'x_factors': x_factors, 'y_factors': y_factors}, removed_mrns
 
+    @property
+    def correlation(self):
+        """
+        Pearson correlation of every pair of non-date variables, calculated only after self.data is changed
+        :return: variables, r and p-value matrices, normality p-value of each variable, and the mask of missing data
+        :rtype: dict
+        """
+        if getattr(self, '_correlation', None) is None:
+            variables = [var for var in list(self.data) if 'date' not in var.lower()]
+            data = np.array([to_float_array(self.data[var]['values']) for var in variables]).T
+            data = data.reshape(len(self.mrns), len(variables))
+            r, p_value = get_pearson_matrix(data)
+            self._correlation = {'variables': variables,
+                                 'r': r,
+                                 'p': p_value,
+                                 'normality': [get_normality_p_value(values) for values in data.T],
+                                 'missing': np.isnan(data)}
+        return self._correlation
+
+    def get_univariate_regressions(self, y_variable):
+        """
+        Linear regression of y_variable against each other variable, calculated together and cached until self.data
+        is changed
+        :param y_variable: dependent variable
+        :type y_variable: str
+        :return: slope, y_intercept, r_sq, mse, std_err, p_value, etc. (see get_univariate_regressions) of each
+        independent variable
+        :rtype: dict
+        """
+        if getattr(self, '_univariate_regressions', None) is None:
+            self._univariate_regressions = {}
+        if y_variable not in self._univariate_regressions:
+            x_variables = [var for var in self.variables if var != y_variable and 'date' not in var.lower()]
+            X = np.array([to_float_array(self.data[var]['values']) for var in x_variables]).T
+            y = to_float_array(self.data[y_variable]['values'])
+            results = get_univariate_regressions(X.reshape(len(y), len(x_variables)), y)
+            self._univariate_regressions[y_variable] = {var: {key: values[i] for key, values in results.items()}
+                                                        for i, var in enumerate(x_variables)}
+        return self._univariate_regressions[y_variable]
+
+    def clear_cache(self):
+        """
+        Call after self.data is changed so the correlation matrix, regressions, and sorted dates will be recalculated
+        """
+        self._correlation = None
+        self._univariate_regressions = None
+        self._time_series_index = None
+
+
+def to_float_array(values):
+    """
+    :param values: numerical data, missing values may be None, 'None', or np.nan
+    :type values: list or np.ndarray
+    :return: values as floats with np.nan for missing or non-numerical values
+    :rtype: np.ndarray
+    """
+    try:
+        return np.array(values, dtype=float)
+    except (TypeError, ValueError):
+        return np.array([to_float(value) for value in values], dtype=float)
 
-def get_index_of_nan(numpy_array):
-    bad_indices = []
-    nan_data = np.isnan(numpy_array)
-    for var_data in nan_data:
-        indices = np.where(var_data)[0].tolist()
-        if indices:
-            bad_indices.extend(indices)
-    bad_indices = list(set(bad_indices))
-    bad_indices.sort()
-    return bad_indices
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def to_list(values):
+    """
+    Convert StatsData values for bokeh and wx, which do not accept numpy arrays in all cases
+    """
+    if isinstance(values, np.ndarray):
+        return values.tolist()
+    return list(values)
+
+
+def to_datetime64(dates):
+    """
+    :param dates: date strings, each unique string is only parsed once
+    :type dates: list
+    :return: dates with np.datetime64('NaT') for dates that could not be parsed
+    :rtype: np.ndarray
+    """
+    parsed = {}
+    for date in set(dates):
+        try:
+            parsed[date] = np.datetime64(date_parser(date), 'us')
+        except Exception:
+            parsed[date] = np.datetime64('NaT')
+    return np.array([parsed[date] for date in dates], dtype='datetime64[us]')
+
+
+def is_missing(value):
+    """
+    :return: True if value is None, 'None', or np.nan
+    :rtype: bool
+    """
+    return value is None or value == 'None' or (isinstance(value, float) and np.isnan(value))
+
+
+def get_pearson_matrix(data):
+    """
+    Pearson correlation of each pair of columns, using only the rows where both columns have data
+    :param data: values with shape (observations, variables), np.nan for missing values
+    :type data: np.ndarray
+    :return: r and two-sided p-value of each pair of variables, r = 0 for pairs without variance
+    :rtype: tuple
+    """
+    valid = (~np.isnan(data)).astype(float)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)  # columns without values (Mean of empty slice)
+        center = np.nanmean(data, axis=0)  # reduces round-off error, r is independent of the offset
+    values = np.where(valid > 0, data - center, 0.)
+
+    # sums over the rows where both variables of a pair have data
+    n = valid.T @ valid
+    sum_x = values.T @ valid
+    sum_xx = (values ** 2).T @ valid
+    sum_xy = values.T @ values
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = sum_xy - sum_x * sum_x.T / n
+        var_x = sum_xx - sum_x ** 2 / n
+        var_y = var_x.T
+        r = np.clip(cov / np.sqrt(var_x * var_y), -1., 1.)
+
+        # p-value of the t-statistic with n - 2 degrees of freedom, as in scipy.stats.pearsonr
+        dof = n - 2
+        t = r * np.sqrt(dof / ((1. - r) * (1. + r)))
+        p_value = 2. * scipy_stats.t.sf(np.abs(t), dof)
+
+    p_value[(n == 2) & ~np.isnan(r)] = 1.
+    p_value[n == 0] = 0.
+    r[np.isnan(r)] = 0.
+    return r, p_value
+
+
+def get_univariate_regressions(X, y):
+    """
+    Linear regression of y against each column of X, using the rows where both have data. Standard errors and p-values
+    are calculated as in get_p_values.
+    :param X: independent data with shape (observations, variables), np.nan for missing values
+    :type X: np.ndarray
+    :param y: dependent data, np.nan for missing values
+    :type y: np.ndarray
+    :return: arrays of n, slope, y_intercept, r_sq, mse, std_err (of slope and y-intercept), t_value, p_value (of
+    slope and y-intercept), x_min, and x_max, one value per column of X
+    :rtype: dict
+    """
+    valid = ~np.isnan(X) & ~np.isnan(y)[:, np.newaxis]
+    n = np.sum(valid, axis=0)
+    y_data = np.broadcast_to(y[:, np.newaxis], X.shape)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_mean = np.sum(np.where(valid, X, 0.), axis=0) / n
+        y_mean = np.sum(np.where(valid, y_data, 0.), axis=0) / n
+        dx = np.where(valid, X - x_mean, 0.)
+        dy = np.where(valid, y_data - y_mean, 0.)
+        s_xx, s_yy, s_xy = np.sum(dx ** 2, axis=0), np.sum(dy ** 2, axis=0), np.sum(dx * dy, axis=0)
+
+        slope = s_xy / s_xx
+        y_intercept = y_mean - slope * x_mean
+        sse = np.maximum(s_yy - slope * s_xy, 0.)
+
+        mse = sse / (n - 2)  # MSE of get_p_values, with degrees of freedom for 2 parameters
+        std_err = np.array([np.sqrt(mse * (1. / n + x_mean ** 2 / s_xx)), np.sqrt(mse / s_xx)])
+        t_value = np.array([y_intercept, slope]) / std_err
+        p_value = 2 * scipy_stats.t.sf(np.abs(t_value), n - 1)
+
+        results = {'n': n,
+                   'slope': slope,
+                   'y_intercept': y_intercept,
+                   'r_sq': 1. - sse / s_yy,
+                   'mse': sse / n,
+                   'std_err': std_err.T,
+                   't_value': t_value.T,
+                   'p_value': p_value.T,
+                   'x_min': np.min(np.where(valid, X, np.inf), axis=0),
+                   'x_max': np.max(np.where(valid, X, -np.inf), axis=0)}
+    return results
+
+
+def get_normality_p_value(values):
+    """
+    :param values: data of a variable, np.nan for missing values
+    :type values: np.ndarray
+    :return: p-value of scipy.stats.normaltest, or 'N/A' if there are too few values
+    """
+    try:
+        return scipy_stats.normaltest(values[~np.isnan(values)])[1]
+    except ValueError:
+        return 'N/A'
+
+
+def get_grouped_stat(grouped, stat):
+    """
+    :param grouped: values padded with np.nan, one row per group
+    :type grouped: np.ndarray
+    :param stat: 'min', 'mean', 'median', or 'max'
+    :type stat: str
+    :return: the stat of each row, ignoring np.nan, or np.nan if a row has no values
+    :rtype: np.ndarray
+    """
+    if not grouped.shape[1]:
+        return np.full(grouped.shape[0], np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)  # rows without values (All-NaN slice)
+        return getattr(np, 'nan%s' % stat)(grouped, axis=1)
 
 
 def str_starts_with_any_in_list(string_a, string_list):
@@ -437,6 +707,60 @@ class MultiVariableRegression:
         self.f_p_value = scipy_stats.f.cdf(self.f_stat, self.df_model, self.df_error)
 
 
+class IncrementalOLS:
+    """
+    Ordinary least squares with a y-intercept, from the R of a QR factorization of [1, X, y]. Independent variables
+    can be removed by downdating R with Givens rotations, rather than refitting
+    """
+    def __init__(self, X, y):
+        """
+        :param X: independent data, shape (observations, variables)
+        :type X: np.ndarray
+        :param y: dependent data
+        :type y: np.ndarray
+        """
+        self.n = len(y)
+        data = np.column_stack((np.ones(self.n), X, y))
+        self.R = np.linalg.qr(data, mode='r')
+        if self.R.shape[0] < self.R.shape[1]:  # fewer observations than columns
+            self.R = np.vstack((self.R, np.zeros((self.R.shape[1] - self.R.shape[0], self.R.shape[1]))))
+
+    def remove_column(self, index):
+        """
+        :param index: column of [1, X] to remove (i.e., index 1 is the first independent variable)
+        :type index: int
+        """
+        R = np.delete(self.R, index, axis=1)
+        for i in range(index, R.shape[1]):  # zero the sub-diagonal left by the removed column
+            a, b = R[i, i], R[i + 1, i]
+            r = np.hypot(a, b)
+            if r:
+                c, s = a / r, b / r
+                R[[i, i + 1], i:] = [c * R[i, i:] + s * R[i + 1, i:], -s * R[i, i:] + c * R[i + 1, i:]]
+        self.R = R[:-1]
+
+    @property
+    def p_values(self):
+        """
+        :return: p-values of the y-intercept and each slope, as calculated by get_p_values
+        :rtype: np.ndarray
+        """
+        k = self.R.shape[1] - 1  # number of parameters (including y-intercept)
+        R = self.R[:k, :k]
+        try:
+            R_inv = scipy_linalg.solve_triangular(R, np.eye(k))
+        except np.linalg.LinAlgError:  # singular, e.g. more variables than studies
+            R_inv = np.linalg.pinv(R)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            params = np.dot(R_inv, self.R[:k, k])
+            # MSE is infinite with no residual degrees of freedom (e.g., as many studies as parameters), as in get_p_values
+            mse = self.R[k, k] ** 2 / (self.n - k) if self.n > k else np.inf
+            var_b = mse * np.sum(R_inv ** 2, axis=1)  # diagonal of inv(X'X)
+            ts_b = params / np.sqrt(var_b)
+        p_values = 2 * scipy_stats.t.sf(np.abs(ts_b), self.n - 1)
+        return np.where(np.isnan(p_values), 1., p_values)  # undefined p-values are removed first
+
+
 def get_control_limits(y, std_devs=3):
     """
     Calculate control limits for Control Chart
@@ -17,7 +17,7 @@ from dateutil.parser import parse as parse_date
 import linecache
 import numpy as np
 from os import walk, listdir, unlink, mkdir, rmdir, chdir, sep, environ
-from os.path import join, isfile, isdir, splitext, basename, dirname, realpath, pathsep
+from os.path import join, isfile, isdir, splitext, basename, dirname, realpath, pathsep, getmtime, getsize
 import pickle
 import pydicom
 from pydicom.uid import ImplicitVRLittleEndian
@@ -26,10 +26,13 @@ from subprocess import check_output
 import sys
 import tracemalloc
 from dvha.db.sql_connector import DVH_SQL
-from dvha.paths import SQL_CNF_PATH, WIN_APP_ICON, PIP_LIST_PATH, DIRECTORIES, APP_DIR, BACKUP_DIR, DATA_DIR
+from dvha._version import __version__
+from dvha.paths import SQL_CNF_PATH, WIN_APP_ICON, PIP_LIST_PATH, DIRECTORIES, APP_DIR, BACKUP_DIR, DATA_DIR, \
+    CACHE_DIR
 
 
 IGNORED_FILES = ['.ds_store']
+MAX_CACHE_SIZE = 2 ** 30  # bytes, see prune_cache_directory
 
 
 def is_windows():
@@ -56,6 +59,50 @@ def initialize_directories():
             mkdir(directory)
 
 
+def get_cache_file_path(prefix, key):
+    """
+    :param prefix: the type of cached data (e.g., 'aperture')
+    :type prefix: str
+    :param key: a unique key of the cached data (e.g., a checksum of its source files)
+    :type key: str
+    :return: file path in CACHE_DIR, specific to this version of DVHA since cached objects are pickled
+    :rtype: str
+    """
+    return join(CACHE_DIR, '%s_%s_%s.pickle' % (prefix, __version__, key))
+
+
+def prune_cache_directory(max_size=MAX_CACHE_SIZE):
+    """
+    Delete files in CACHE_DIR written by other versions of DVHA (or left by an interrupted write), then delete the
+    oldest files until the total size of CACHE_DIR is less than max_size
+    :param max_size: maximum size of CACHE_DIR in bytes
+    :type max_size: int
+    """
+    if not isdir(CACHE_DIR):
+        return
+    version_tag = '_%s_' % __version__
+    cache_files = []
+    for file_name in listdir(CACHE_DIR):
+        file_path = join(CACHE_DIR, file_name)
+        try:
+            if version_tag not in file_name or not file_name.endswith('.pickle'):
+                unlink(file_path)
+            else:
+                cache_files.append((getmtime(file_path), getsize(file_path), file_path))
+        except OSError as e:
+            print('Could not prune cache file %s: %s' % (file_path, e))
+
+    total_size = sum([file_size for _, file_size, _ in cache_files])
+    for _, file_size, file_path in sorted(cache_files):
+        if total_size < max_size:
+            break
+        try:
+            unlink(file_path)
+            total_size -= file_size
+        except OSError as e:
+            print('Could not prune cache file %s: %s' % (file_path, e))
+
+
 def write_sql_connection_settings(config):
     """
     Create a file storing the SQL login credentials
@@ -141,47 +188,24 @@ def get_study_instance_uids(**kwargs):
     Get lists of study instance uids in the SQL database that meet provided conditions
     The values return in the 'common' key are used for the DVH class in models.dvh.py
     :param kwargs: keys are SQL table names and the values are conditions in SQL syntax
-    :return: study instance uids for each table, uids found in all tables, and a list of unique uids
+    :return: study instance uids for each table, uids found in all tables, and a sorted list of unique uids
     :rtype: dict
     """
+    start_time = datetime.now()
+
     with DVH_SQL() as cnx:
         uids = {table: cnx.get_unique_values(table, 'study_instance_uid', condition)
                 for table, condition in kwargs.items()}
 
-    complete_list = flatten_list_of_lists(list(uids.values()), remove_duplicates=True)
-
-    uids['common'] = [uid for uid in complete_list if is_uid_in_all_keys(uid, uids)]
-    uids['unique'] = complete_list
+    uid_sets = [set(value) for value in uids.values()]
+    common = set.intersection(*uid_sets) if uid_sets else set()
 
-    return uids
+    uids['common'] = sorted(common)
+    uids['unique'] = sorted(set().union(*uid_sets))
 
+    print_run_time(start_time, datetime.now(), 'Cohort study instance uids found')
 
-def is_uid_in_all_keys(uid, uids):
-    """
-    Check if uid is found in each of the uid lists for each SQL table
-    :param uid: study instance uid
-    :type uid: str
-    :param uids: lists of study instance uids organized by SQL table
-    :type uids: dict
-    :return: True only if uid is found in each of the tables
-    :rtype: bool
-    """
-
-    table_answer = {}
-    # Initialize a False value for each key
-    for table in list(uids):
-        table_answer[table] = False
-    # search for uid in each keyword fof uid_kwlist
-    for table, value in uids.items():
-        if uid in value:
-            table_answer[table] = True
-
-    final_answer = True
-    # Product of all answer[key] values (except 'unique')
-    for table, value in table_answer.items():
-        if table not in 'unique':
-            final_answer *= value
-    return final_answer
+    return uids
 
 
 def flatten_list_of_lists(some_list, remove_duplicates=False, sort=False):
@@ -214,19 +238,12 @@ def collapse_into_single_dates(x, y):
     """
 
     # average daily data and keep track of points per day
-    x_collapsed = [x[0]]
-    y_collapsed = [y[0]]
-    w_collapsed = [1]
-    for n in range(1, len(x)):
-        if x[n] == x_collapsed[-1]:
-            y_collapsed[-1] = (y_collapsed[-1] + y[n])
-            w_collapsed[-1] += 1
-        else:
-            x_collapsed.append(x[n])
-            y_collapsed.append(y[n])
-            w_collapsed.append(1)
+    x, y = np.asarray(x), np.asarray(y, dtype=float)
+    if not len(x):
+        return {'x': x, 'y': y, 'w': np.array([], dtype=int)}
+    starts = np.flatnonzero(np.concatenate(([True], x[1:] != x[:-1])))
 
-    return {'x': x_collapsed, 'y': y_collapsed, 'w': w_collapsed}
+    return {'x': x[starts], 'y': np.add.reduceat(y, starts), 'w': np.diff(np.append(starts, len(x)))}
 
 
 def moving_avg(xyw, avg_len):
@@ -236,19 +253,14 @@ def moving_avg(xyw, avg_len):
     :type xyw: dict
     :param avg_len: average of these number of points, i.e., look-back window
     :type avg_len: int
-    :return: list of x values, list of y values
+    :return: x values, moving averages
     :rtype: tuple
     """
-    cumsum, moving_aves, x_final = [0], [], []
-
-    for i, y in enumerate(xyw['y'], 1):
-        cumsum.append(cumsum[i - 1] + y / xyw['w'][i - 1])
-        if i >= avg_len:
-            moving_ave = (cumsum[i] - cumsum[i - avg_len]) / avg_len
-            moving_aves.append(moving_ave)
-    x_final = [xyw['x'][i] for i in range(avg_len - 1, len(xyw['x']))]
+    avg_len = max(1, avg_len)
+    cumsum = np.concatenate(([0.], np.cumsum(np.asarray(xyw['y'], dtype=float) / xyw['w'])))
+    moving_aves = (cumsum[avg_len:] - cumsum[:-avg_len]) / avg_len
 
-    return x_final, moving_aves
+    return xyw['x'][avg_len - 1:], moving_aves
 
 
 def convert_value_to_str(value, rounding_digits=2):
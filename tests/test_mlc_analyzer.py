@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# tests.test_mlc_analyzer.py
+"""
+Compare the NumPy aperture metrics of tools.mlc_analyzer to the Shapely apertures of each control point
+"""
+# Copyright (c) 2016-2019 Dan Cutright
+# This file is part of DVH Analytics, released under a BSD license.
+#    See the file LICENSE included with this distribution, also
+#    available at https://github.com/cutright/DVH-Analytics
+
+import numpy as np
+import pytest
+from pydicom.dataset import Dataset
+from pydicom.sequence import Sequence
+from dvha.tools import mlc_analyzer
+
+
+def get_device(device_type, positions):
+    device = Dataset()
+    device.RTBeamLimitingDeviceType = device_type
+    device.LeafJawPositions = [float(v) for v in positions]
+    return device
+
+
+def get_beam_dataset(leaf_type, jaws_in_each_cp, cp_count=30, leaf_pair_count=60, seed=0):
+    """
+    :return: a beam with random leaf positions (some leaf pairs closed) and random jaws
+    :rtype: Dataset
+    """
+    rng = np.random.RandomState(seed)
+    leaf_boundaries = np.concatenate([np.arange(-200, -100, 10), np.arange(-100, 100, 5), np.arange(100, 201, 10)])
+
+    beam = Dataset()
+    beam.BeamName = 'test'
+    device = Dataset()
+    device.RTBeamLimitingDeviceType = leaf_type
+    device.LeafPositionBoundaries = [float(v) for v in leaf_boundaries[:leaf_pair_count + 1]]
+    beam.BeamLimitingDeviceSequence = Sequence([device])
+
+    control_points = []
+    for i in range(cp_count):
+        cp = Dataset()
+        cp.CumulativeMetersetWeight = i / (cp_count - 1.)
+        cp.GantryAngle = float(i)
+        devices = []
+        if i == 0 or jaws_in_each_cp:
+            devices.append(get_device('ASYMX', sorted(rng.uniform(-80, 80, 2))))
+            devices.append(get_device('ASYMY', sorted(rng.uniform(-80, 80, 2))))
+        bank_a = rng.uniform(-60, 40, leaf_pair_count)
+        width = rng.uniform(-5, 30, leaf_pair_count)
+        width[rng.random_sample(leaf_pair_count) < 0.2] = 0.
+        devices.append(get_device(leaf_type, np.concatenate([bank_a, bank_a + np.maximum(width, 0.)])))
+        cp.BeamLimitingDevicePositionSequence = Sequence(devices)
+        control_points.append(cp)
+    beam.ControlPointSequence = Sequence(control_points)
+    return beam
+
+
+@pytest.mark.parametrize('leaf_type', ['MLCX', 'MLCY'])
+@pytest.mark.parametrize('jaws_in_each_cp', [True, False])
+def test_aperture_metrics(leaf_type, jaws_in_each_cp):
+    beam = mlc_analyzer.Beam(get_beam_dataset(leaf_type, jaws_in_each_cp), 100.)
+    area, x_paths, y_paths = mlc_analyzer.get_beam_aperture_metrics(beam.control_points, beam.leaf_boundaries)
+
+    aperture = beam.aperture
+    shapely_paths = np.array([mlc_analyzer.get_xy_path_lengths(cp) for cp in aperture])
+    np.testing.assert_allclose(area, [cp.area for cp in aperture], atol=1e-6)
+    np.testing.assert_allclose(x_paths, shapely_paths[:, 0], atol=1e-6)
+    np.testing.assert_allclose(y_paths, shapely_paths[:, 1], atol=1e-6)
+
+
+def test_mlc_summary_of_aperture_data():
+    """Rescoring the cached aperture data matches the scores calculated with the beam"""
+    beam = mlc_analyzer.Beam(get_beam_dataset('MLCX', False), 100.)
+    summary = mlc_analyzer.get_mlc_summary(beam.aperture_data, 100.)
+    np.testing.assert_allclose(summary['cmp_score'], beam.summary_data['cmp_score'])
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# tests.test_roi_mask.py
+"""
+Compare the raster mask and mesh calculations of tools.roi_mask to tools.roi_geometry and to analytic values
+"""
+# Copyright (c) 2016-2019 Dan Cutright
+# This file is part of DVH Analytics, released under a BSD license.
+#    See the file LICENSE included with this distribution, also
+#    available at https://github.com/cutright/DVH-Analytics
+
+import numpy as np
+import pytest
+from dvha.tools import roi_geometry as roi_geom
+from dvha.tools import roi_mask
+from dvha.tools.roi_formatter import get_slice_geometry
+
+
+def get_cylinder(radius, height, x=0., y=0., slice_thickness=3., point_count=100):
+    """
+    :return: a cylinder along z formatted as a "sets of points" dictionary
+    :rtype: dict
+    """
+    angles = np.linspace(0, 2 * np.pi, point_count, endpoint=False)
+    roi = {}
+    for z in np.arange(slice_thickness / 2., height, slice_thickness):
+        z = round(float(z), 2)
+        roi[str(z)] = [[[x + radius * np.cos(a), y + radius * np.sin(a), z] for a in angles]]
+    return roi
+
+
+def get_sphere(radius, slice_thickness=3., point_count=100):
+    """
+    :return: a sphere centered at the origin formatted as a "sets of points" dictionary
+    :rtype: dict
+    """
+    angles = np.linspace(0, 2 * np.pi, point_count, endpoint=False)
+    roi = {}
+    for z in np.arange(-radius + slice_thickness / 2., radius, slice_thickness):
+        z = round(float(z), 2)
+        r = np.sqrt(radius ** 2 - z ** 2)
+        roi[str(z)] = [[[r * np.cos(a), r * np.sin(a), z] for a in angles]]
+    return roi
+
+
+@pytest.mark.parametrize('radius', [30., 80.])
+def test_mesh_surface_area_of_sphere(radius):
+    """Sloped surfaces are steps between slices with roi_geometry, the mesh interpolates between slices"""
+    roi = get_sphere(radius)
+    exact = 4 * np.pi * radius ** 2 / 100.
+    mesh = roi_mask.surface_area(roi, resolution=2.)
+    shapely = roi_geom.surface_area(roi, coord_type='sets_of_points')
+    assert mesh == pytest.approx(exact, rel=0.02)
+    assert abs(mesh - exact) < abs(shapely - exact)
+
+
+def test_mesh_surface_area_of_cylinder():
+    """Both methods are exact for vertical surfaces"""
+    roi = get_cylinder(40., 90.)
+    mesh = roi_mask.surface_area(roi, resolution=2.)
+    shapely = roi_geom.surface_area(roi, coord_type='sets_of_points')
+    assert mesh == pytest.approx(shapely, rel=0.005)
+
+
+def test_cached_surface_area():
+    roi = get_sphere(30.)
+    roi_coord_string = str(roi)  # any unique string representation is sufficient for the cache key
+    area = roi_mask.cached_surface_area(roi_coord_string, roi, resolution=2.)
+    assert area == roi_mask.surface_area(roi, resolution=2.)
+    assert roi_mask.cached_surface_area(roi_coord_string, resolution=2.) == area  # the roi is not parsed again
+
+
+@pytest.mark.parametrize('resolution', [0.5, 1.])
+def test_mask_overlap_volume(resolution):
+    """PTV overlap with the mask engine, compared to roi_geometry (see db.update.get_treatment_volume_mask)"""
+    tv = get_cylinder(30., 60.)
+    rois = [get_cylinder(20., 30., x=25.), get_cylinder(10., 90., y=-5.), get_cylinder(10., 30., x=60.)]
+    tv_mask = roi_mask.VoxelGrid([tv], resolution=resolution).get_mask(tv)
+    assert tv_mask.volume == pytest.approx(roi_geom.volume(tv), rel=0.02)
+    for roi in rois:
+        expected = roi_geom.overlap_volume(get_slice_geometry(roi), tv)
+        overlap = tv_mask.overlap_volume(tv_mask.grid.get_mask(roi))
+        assert overlap == pytest.approx(expected, rel=0.03, abs=0.05)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# tests.test_stats.py
+"""
+Compare the vectorized calculations of tools.stats to straightforward calculations of each value
+"""
+# Copyright (c) 2016-2019 Dan Cutright
+# This file is part of DVH Analytics, released under a BSD license.
+#    See the file LICENSE included with this distribution, also
+#    available at https://github.com/cutright/DVH-Analytics
+
+import numpy as np
+import pytest
+from scipy import stats as scipy_stats
+from sklearn import linear_model
+from sklearn.metrics import mean_squared_error, r2_score
+from dvha.tools.stats import StatsData, IncrementalOLS, get_pearson_matrix, get_univariate_regressions, \
+    get_p_values
+
+
+def get_data(observations, variables, missing_fraction=0.2, seed=0):
+    """
+    :return: correlated random data with np.nan for missing values
+    :rtype: np.ndarray
+    """
+    rng = np.random.RandomState(seed)
+    data = rng.normal(size=(observations, variables))
+    data[:, 1:] += data[:, [0]]
+    data[rng.random_sample(data.shape) < missing_fraction] = np.nan
+    return data
+
+
+def get_stats_data(X, y):
+    """
+    :return: a StatsData object with only the data needed for get_backward_elimination
+    :rtype: StatsData
+    """
+    stats_data = StatsData.__new__(StatsData)
+    stats_data.data = {'y': {'units': '', 'values': y}}
+    for i in range(X.shape[1]):
+        stats_data.data['x%s' % i] = {'units': '', 'values': X[:, i]}
+    return stats_data
+
+
+def get_p_values_of_fit(X, y):
+    reg = linear_model.LinearRegression().fit(X, y)
+    return get_p_values(X, y, reg.predict(X), np.append(reg.intercept_, reg.coef_))[0]
+
+
+def backward_elimination(X, y, threshold=0.05):
+    """
+    Refit with get_p_values after each removal, as the Regression tab did before IncrementalOLS
+    :return: indices of the remaining columns of X
+    :rtype: list
+    """
+    columns = list(range(X.shape[1]))
+    while len(columns) > 1:
+        rows = ~np.any(np.isnan(X[:, columns]), axis=1) & ~np.isnan(y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            p_values = np.array(get_p_values_of_fit(X[rows][:, columns], y[rows])[1:])
+        p_values[np.isnan(p_values)] = 1.
+        index = int(np.argmax(p_values))
+        if not p_values[index] > threshold:
+            break
+        columns.pop(index)
+    return columns
+
+
+def test_pearson_matrix():
+    data = get_data(40, 6)
+    r, p_value = get_pearson_matrix(data)
+    for i in range(data.shape[1]):
+        for j in range(data.shape[1]):
+            rows = ~np.isnan(data[:, i]) & ~np.isnan(data[:, j])
+            expected_r, expected_p = scipy_stats.pearsonr(data[rows, i], data[rows, j])
+            assert r[i, j] == pytest.approx(expected_r, abs=1e-10)
+            assert p_value[i, j] == pytest.approx(expected_p, rel=1e-6, abs=1e-12)
+
+
+def test_pearson_matrix_without_pairs():
+    """Pairs without common data have r = 0 and p = 0, as before the matrix was vectorized"""
+    data = np.array([[1., np.nan], [2., np.nan], [np.nan, 3.], [np.nan, 5.]])
+    r, p_value = get_pearson_matrix(data)
+    assert r[0, 1] == 0. and p_value[0, 1] == 0.
+
+
+def test_univariate_regressions():
+    data = get_data(50, 5)
+    y, X = data[:, 0], data[:, 1:]
+    results = get_univariate_regressions(X, y)
+    for i in range(X.shape[1]):
+        rows = ~np.isnan(X[:, i]) & ~np.isnan(y)
+        x_data, y_data = X[rows, i:i + 1], y[rows]
+        reg = linear_model.LinearRegression().fit(x_data, y_data)
+        predictions = reg.predict(x_data)
+        p_values, std_err, t_values = get_p_values(x_data, y_data, predictions, np.append(reg.intercept_, reg.coef_))
+
+        assert results['n'][i] == len(y_data)
+        assert results['slope'][i] == pytest.approx(reg.coef_[0])
+        assert results['y_intercept'][i] == pytest.approx(reg.intercept_)
+        assert results['r_sq'][i] == pytest.approx(r2_score(y_data, predictions))
+        assert results['mse'][i] == pytest.approx(mean_squared_error(y_data, predictions))
+        np.testing.assert_allclose(results['std_err'][i], std_err)
+        np.testing.assert_allclose(results['t_value'][i], t_values)
+        np.testing.assert_allclose(results['p_value'][i], p_values, atol=1e-12)
+        assert results['x_min'][i] == np.min(x_data) and results['x_max'][i] == np.max(x_data)
+
+
+def test_incremental_ols_p_values():
+    data = get_data(30, 6, missing_fraction=0.)
+    y, X = data[:, 0], data[:, 1:]
+    ols = IncrementalOLS(X, y)
+    np.testing.assert_allclose(ols.p_values, get_p_values_of_fit(X, y), atol=1e-10)
+
+    ols.remove_column(2)  # the second independent variable
+    np.testing.assert_allclose(ols.p_values, get_p_values_of_fit(np.delete(X, 1, axis=1), y), atol=1e-10)
+
+
+@pytest.mark.parametrize('observations, variables, seed', [(60, 8, 0), (60, 8, 1), (23, 11, 2), (23, 11, 3),
+                                                           (12, 11, 4)])  # the last case is saturated
+def test_backward_elimination(observations, variables, seed):
+    rng = np.random.RandomState(seed)
+    X = rng.normal(size=(observations, variables))
+    y = 2. * X[:, 0] + rng.normal(size=observations)
+    X[rng.random_sample(X.shape) < 0.02] = np.nan
+
+    x_variables = ['x%s' % i for i in range(variables)]
+    remaining = get_stats_data(X, y).get_backward_elimination('y', x_variables)
+    assert remaining == [x_variables[i] for i in backward_elimination(X, y)]
+
+
+def test_backward_elimination_of_saturated_fit():
+    """With as many studies as parameters, the MSE is infinite and variables are removed until the fit has residuals"""
+    rng = np.random.RandomState(0)
+    X, y = rng.normal(size=(12, 11)), rng.normal(size=12)
+    x_variables = ['x%s' % i for i in range(11)]
+    remaining = get_stats_data(X, y).get_backward_elimination('y', x_variables)
+    assert len(remaining) < 11
+    assert remaining == [x_variables[i] for i in backward_elimination(X, y)]
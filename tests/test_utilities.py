@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# tests.test_utilities.py
+"""
+Compare the vectorized time series trends of tools.utilities to loops over each value
+"""
+# Copyright (c) 2016-2019 Dan Cutright
+# This file is part of DVH Analytics, released under a BSD license.
+#    See the file LICENSE included with this distribution, also
+#    available at https://github.com/cutright/DVH-Analytics
+
+import numpy as np
+import pytest
+from dvha.tools.utilities import collapse_into_single_dates, moving_avg
+
+
+def collapse_with_loop(x, y):
+    x_collapsed, y_collapsed, w_collapsed = [x[0]], [y[0]], [1]
+    for n in range(1, len(x)):
+        if x[n] == x_collapsed[-1]:
+            y_collapsed[-1] += y[n]
+            w_collapsed[-1] += 1
+        else:
+            x_collapsed.append(x[n])
+            y_collapsed.append(y[n])
+            w_collapsed.append(1)
+    return {'x': x_collapsed, 'y': y_collapsed, 'w': w_collapsed}
+
+
+def moving_avg_with_loop(xyw, avg_len):
+    cumsum, moving_aves = [0], []
+    for i, y in enumerate(xyw['y'], 1):
+        cumsum.append(cumsum[i - 1] + y / xyw['w'][i - 1])
+        if i >= avg_len:
+            moving_aves.append((cumsum[i] - cumsum[i - avg_len]) / avg_len)
+    return [xyw['x'][i] for i in range(avg_len - 1, len(xyw['x']))], moving_aves
+
+
+def get_time_series(count=200, seed=0):
+    rng = np.random.RandomState(seed)
+    dates = np.sort(np.datetime64('2019-01-01') + rng.randint(0, 120, count).astype('timedelta64[D]'))
+    return dates, rng.normal(size=count)
+
+
+def test_collapse_into_single_dates():
+    x, y = get_time_series()
+    collapsed, expected = collapse_into_single_dates(x, y), collapse_with_loop(x, y)
+    np.testing.assert_array_equal(collapsed['x'], expected['x'])
+    np.testing.assert_allclose(collapsed['y'], expected['y'])
+    np.testing.assert_array_equal(collapsed['w'], expected['w'])
+
+
+def test_collapse_into_single_dates_without_data():
+    collapsed = collapse_into_single_dates([], [])
+    assert not len(collapsed['x']) and not len(collapsed['y']) and not len(collapsed['w'])
+
+
+@pytest.mark.parametrize('avg_len', [1, 5, 30])
+def test_moving_avg(avg_len):
+    xyw = collapse_into_single_dates(*get_time_series())
+    x, y = moving_avg(xyw, avg_len)
+    expected_x, expected_y = moving_avg_with_loop(collapse_with_loop(*get_time_series()), avg_len)
+    np.testing.assert_array_equal(x, expected_x)
+    np.testing.assert_allclose(y, expected_y)